@@ -1,5 +1,11 @@
 -- === General Options ===
 
+-- Cache compiled Lua modules as bytecode (Neovim 0.9+)
+
+if vim.loader then vim.loader.enable() end
+
+
+
 local opt = {}
 
 
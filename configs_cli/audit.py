@@ -0,0 +1,89 @@
+"""Audit managed symlinks across many home directories"""
+import glob
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+OK = "ok"
+MISSING = "missing"
+NOT_SYMLINK = "not-symlink"
+WRONG_TARGET = "wrong-target"
+BROKEN = "broken"
+
+
+def expand_homes(specs):
+    """Expand globs and comma-separated lists into existing home directories"""
+    homes = []
+    seen = set()
+    for spec in specs:
+        for part in spec.split(","):
+            part = os.path.expanduser(part.strip())
+            if not part:
+                continue
+            matches = sorted(glob.glob(part)) if glob.has_magic(part) else [part]
+            for path in matches:
+                path = os.path.abspath(path)
+                if path not in seen and os.path.isdir(path):
+                    seen.add(path)
+                    homes.append(path)
+    return homes
+
+
+def _scan(directory):
+    """Map entry name -> DirEntry for one directory with a single scandir call"""
+    try:
+        with os.scandir(directory) as entries:
+            return {entry.name: entry for entry in entries}
+    except OSError:
+        return {}
+
+
+def audit_home(home, links):
+    """
+    Check every (relative link path, expected target) pair for one home.
+    Each parent directory is listed once with scandir, so a home costs one
+    scandir per distinct parent plus one readlink per symlink.
+    """
+    listings = {}
+    results = []
+    for rel_path, expected in links:
+        link_path = os.path.join(home, rel_path)
+        parent = os.path.dirname(link_path)
+        if parent not in listings:
+            listings[parent] = _scan(parent)
+        entry = listings[parent].get(os.path.basename(link_path))
+
+        result = {"path": link_path, "expected": expected, "actual": None}
+        if entry is None:
+            result["status"] = MISSING
+        elif not entry.is_symlink():
+            result["status"] = NOT_SYMLINK
+        else:
+            actual = os.readlink(link_path)
+            if not os.path.isabs(actual):
+                actual = os.path.normpath(os.path.join(parent, actual))
+            result["actual"] = actual
+            if os.path.normpath(actual) != os.path.normpath(expected):
+                result["status"] = WRONG_TARGET
+            elif not os.path.exists(actual):
+                result["status"] = BROKEN
+            else:
+                result["status"] = OK
+        results.append(result)
+
+    return {"home": home, "ok": all(r["status"] == OK for r in results), "links": results}
+
+
+def audit_homes(homes, links, jobs=16):
+    """Audit many homes in parallel, preserving the order of homes"""
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        return list(pool.map(lambda home: audit_home(home, links), homes))
+
+
+def audit_report(repo, reports):
+    """Assemble the machine-readable report"""
+    drifted = [r["home"] for r in reports if not r["ok"]]
+    return {
+        "repo": repo,
+        "homes": reports,
+        "summary": {"homes": len(reports), "drifted": len(drifted)},
+    }
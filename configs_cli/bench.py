@@ -0,0 +1,144 @@
+"""Startup benchmarks for the provisioned environment (zsh, tmux, neovim)"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from configs_cli import process, status
+
+DEFAULT_BASELINE = os.path.join("~", ".local", "state", "configs-cli", "bench-baseline.json")
+
+
+def _zsh_command(workdir):
+    return ["zsh", "-i", "-c", "exit"]
+
+
+def _nvim_command(workdir):
+    return ["nvim", "--headless", "--startuptime", os.path.join(workdir, "nvim-startup.log"), "+qa"]
+
+
+def _tmux_command(workdir):
+    # A private socket keeps the throwaway server away from the user's sessions
+    return ["tmux", "-L", f"configs-cli-bench-{os.getpid()}",
+            "-f", os.path.expanduser("~/.tmux.conf"), "new-session", "-d", "true"]
+
+
+def _tmux_cleanup(workdir):
+    process.run(["tmux", "-L", f"configs-cli-bench-{os.getpid()}", "kill-server"],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def _prompt_command(workdir):
+    # A fresh status file watching as many paths as a typical configs repository
+    watched = []
+    for i in range(64):
+        watched.append(os.path.join(workdir, f"managed-{i}"))
+        with open(watched[-1], "w"):
+            pass
+    path = os.path.join(workdir, "state", "status")
+    status.write({"repo": workdir, "behind": "1", "links": "0", "modified": "2"}, watched, path)
+    script = (f"import os, sys; os.environ['CONFIGS_CLI_STATUS_FILE'] = {path!r}; "
+              "sys.argv = ['configs-cli', 'status', '--prompt']; "
+              "from configs_cli.cli import main; main()")
+    return [sys.executable, "-c", script]
+
+
+# name -> (binary, command builder, cleanup run after every iteration)
+BENCHMARKS = {
+    "zsh": ("zsh", _zsh_command, None),
+    "nvim": ("nvim", _nvim_command, None),
+    "tmux": ("tmux", _tmux_command, _tmux_cleanup),
+    "prompt": (sys.executable, _prompt_command, None),
+}
+# Fixed p50 ceilings, independent of the baseline: status --prompt runs on every prompt
+# and blows through this as soon as it imports the full CLI
+BUDGETS_MS = {"prompt": 50}
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(samples)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def summarize(samples):
+    return {
+        "iterations": len(samples),
+        "min_ms": round(min(samples) * 1000, 2),
+        "p50_ms": round(percentile(samples, 50) * 1000, 2),
+        "p95_ms": round(percentile(samples, 95) * 1000, 2),
+    }
+
+
+def run_benchmark(name, iterations, warmup=1):
+    """Time iterations runs of one benchmark; returns its summary or None if unavailable"""
+    binary, build_command, cleanup = BENCHMARKS[name]
+    if not shutil.which(binary):
+        print(f"Skipping {name}: {binary} not found")
+        return None
+
+    samples = []
+    with tempfile.TemporaryDirectory(prefix="configs-cli-bench-") as workdir:
+        command = build_command(workdir)
+        for i in range(warmup + iterations):
+            started = time.perf_counter()
+            result = process.run(command, stdin=subprocess.DEVNULL,
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            elapsed = time.perf_counter() - started
+            if cleanup:
+                cleanup(workdir)
+            if result.returncode != 0:
+                print(f"Warning: {name} exited with {result.returncode}")
+            if i >= warmup:
+                samples.append(elapsed)
+    return summarize(samples)
+
+
+def load_baseline(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_baseline(path, results):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results}, f, indent=2)
+
+
+def compare(results, baseline, threshold_pct):
+    """Return (name, baseline p50, current p50, change %) for every regression over threshold"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous or not previous.get("p50_ms"):
+            continue
+        change = (current["p50_ms"] - previous["p50_ms"]) / previous["p50_ms"] * 100
+        if change > threshold_pct:
+            regressions.append((name, previous["p50_ms"], current["p50_ms"], change))
+    return regressions
+
+
+def over_budget(results):
+    """Return (name, budget, p50) for every benchmark whose p50 exceeds its fixed budget"""
+    return [(name, BUDGETS_MS[name], stats["p50_ms"]) for name, stats in results.items()
+            if name in BUDGETS_MS and stats["p50_ms"] > BUDGETS_MS[name]]
+
+
+def print_results(results, baseline=None):
+    print(f"\n{'benchmark':<10} {'min ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'base p50':>9} {'change':>8}")
+    print("-" * 60)
+    for name, stats in results.items():
+        previous = (baseline or {}).get("results", {}).get(name)
+        base, change = "", ""
+        if previous and previous.get("p50_ms"):
+            base = f"{previous['p50_ms']:.2f}"
+            change = f"{(stats['p50_ms'] - previous['p50_ms']) / previous['p50_ms'] * 100:+.1f}%"
+        print(f"{name:<10} {stats['min_ms']:9.2f} {stats['p50_ms']:9.2f} {stats['p95_ms']:9.2f} "
+              f"{base:>9} {change:>8}")
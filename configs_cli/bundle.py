@@ -0,0 +1,240 @@
+"""
+Offline provisioning bundles.
+A bundle is a single gzip-compressed tar stream holding everything setup would
+otherwise download: bare git mirrors, download cache objects, gem files, npm
+tarballs and prebuilt treesitter parsers, preceded by a manifest.json. It is
+written and read strictly as a stream, so it can be piped between hosts, and
+on import every member goes straight into the cache it belongs to instead of
+being unpacked to a scratch directory first.
+"""
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from configs_cli import gitcache, nvim, offline, process
+from configs_cli.download import DownloadCache, fetch_first
+
+FORMAT_VERSION = 1
+MANIFEST = "manifest.json"
+
+
+class BundleError(Exception):
+    pass
+
+
+def _add_bytes(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    info.mode = 0o644
+    tar.addfile(info, io.BytesIO(data))
+
+
+def _fetch_gems(gems, workdir):
+    """Download gems with all of their dependencies; returns the .gem files"""
+    if not gems:
+        return []
+    install_dir = os.path.join(workdir, "gems")
+    # stdout may be the archive itself, so child output follows our own prints
+    process.run(["gem", "install", *gems, "--install-dir", install_dir, "--no-document"],
+                check=True, stdout=sys.stdout)
+    cache = os.path.join(install_dir, "cache")
+    return sorted(os.path.join(cache, name) for name in os.listdir(cache) if name.endswith(".gem"))
+
+
+def _pack_npm(packages, workdir):
+    """npm pack each package; returns the tarball paths"""
+    destination = os.path.join(workdir, "npm")
+    os.makedirs(destination, exist_ok=True)
+    tarballs = []
+    for package in packages:
+        result = process.run(["npm", "pack", package, "--pack-destination", destination],
+                             check=True, capture_output=True, text=True)
+        tarballs.append(os.path.join(destination, result.stdout.strip().splitlines()[-1]))
+    return tarballs
+
+
+def _cached_parsers():
+    directory = nvim.parser_cache_dir()
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(os.path.join(directory, name) for name in names if name.endswith(".so"))
+
+
+def _write(stream, git_urls, downloads, gems, npm_packages, jobs):
+    git_urls = list(dict.fromkeys(git_urls))
+    print(f"Mirroring {len(git_urls)} git repositories")
+    with contextlib.ExitStack() as held:
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+            mirrors = dict(zip(git_urls, pool.map(gitcache.ensure_mirror, git_urls)))
+        # Keep the mirrors from being evicted until they are in the archive
+        for mirror in mirrors.values():
+            held.enter_context(gitcache.reading(mirror))
+
+        cache = DownloadCache()
+        entries = {}
+        for urls, sha256 in downloads:
+            url, _path = fetch_first(urls, sha256=sha256, cache=cache)
+            entry = cache.index_entries([url])[url]
+            # Alternatives resolve to the same object, so offline lookups of any of them hit
+            for alternative in urls:
+                entries[alternative] = {"sha256": entry["sha256"], "fetched": entry.get("fetched")}
+            entries[url] = entry
+
+        with tempfile.TemporaryDirectory(prefix="configs-cli-bundle-") as workdir:
+            gem_files = _fetch_gems(list(gems), workdir)
+            tarballs = _pack_npm(list(npm_packages), workdir)
+            parsers = _cached_parsers()
+            manifest = {
+                "version": FORMAT_VERSION,
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "git": {url: "git/" + os.path.basename(mirror) for url, mirror in mirrors.items()},
+                "downloads": entries,
+                "gems": [os.path.basename(path) for path in gem_files],
+                "npm": [os.path.basename(path) for path in tarballs],
+                "parsers": [os.path.basename(path) for path in parsers],
+            }
+
+            print("Writing bundle")
+            with tarfile.open(fileobj=stream, mode="w|gz") as tar:
+                # The manifest goes first so readers can validate before importing anything
+                _add_bytes(tar, MANIFEST, json.dumps(manifest, indent=2, sort_keys=True).encode())
+                for url, mirror in mirrors.items():
+                    tar.add(mirror, arcname=manifest["git"][url])
+                for digest in sorted({entry["sha256"] for entry in entries.values()}):
+                    tar.add(cache.object_path(digest), arcname=f"downloads/{digest}")
+                for kind, paths in (("gems", gem_files), ("npm", tarballs), ("parsers", parsers)):
+                    for path in paths:
+                        tar.add(path, arcname=f"{kind}/{os.path.basename(path)}")
+        return manifest
+
+
+def create(output, git_urls, downloads=(), gems=(), npm_packages=(), jobs=8):
+    """
+    Collect every artifact into a bundle written to output ("-" for stdout).
+    downloads is a list of (alternative URLs, sha256 or None) pairs, fetched
+    like the setup step fetches them. Returns the manifest.
+    """
+    if output == "-":
+        # The archive owns stdout; progress goes to stderr
+        with contextlib.redirect_stdout(sys.stderr):
+            return _write(sys.__stdout__.buffer, git_urls, downloads, gems, npm_packages, jobs)
+
+    tmp = f"{output}.tmp-{os.getpid()}"
+    try:
+        with open(tmp, "wb") as stream:
+            manifest = _write(stream, git_urls, downloads, gems, npm_packages, jobs)
+        os.replace(tmp, output)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+    print(f"Bundle written to {output} ({os.path.getsize(output) // 1024} KiB)")
+    return manifest
+
+
+def _split_member(member):
+    """Return (kind, relative path) for a member, rejecting anything unsafe"""
+    name = member.name
+    parts = name.split("/")
+    if name.startswith("/") or ".." in parts:
+        raise BundleError(f"unsafe path in bundle: {name}")
+    if not (member.isfile() or member.isdir()):
+        raise BundleError(f"unexpected member type in bundle: {name}")
+    kind, _, rest = name.partition("/")
+    return kind, rest
+
+
+def _unpack(source, cache, targets, counts, unpacked):
+    """Stream the members of a bundle into targets; git mirrors go to the temp names recorded in unpacked"""
+    manifest = None
+    stream = sys.stdin.buffer if source == "-" else open(source, "rb")
+    try:
+        with tarfile.open(fileobj=stream, mode="r|gz") as tar:
+            for member in tar:
+                if member.name == MANIFEST:
+                    manifest = json.load(tar.extractfile(member))
+                    if manifest.get("version") != FORMAT_VERSION:
+                        raise BundleError(f"unsupported bundle version {manifest.get('version')}")
+                    continue
+                if manifest is None:
+                    raise BundleError(f"{MANIFEST} must be the first member of the bundle")
+                kind, rest = _split_member(member)
+                if kind == "downloads" and member.isfile():
+                    digest, path = cache.store(tar.extractfile(member))
+                    if digest != rest:
+                        os.unlink(path)
+                        raise BundleError(f"checksum mismatch for bundled download {rest}")
+                elif kind == "git" and rest:
+                    name, _, inside = rest.partition("/")
+                    unpacked.setdefault(name, f"{name}.tmp-{os.getpid()}")
+                    member.name = os.path.join(unpacked[name], inside)
+                    tar.extract(member, targets[kind], set_attrs=False)
+                elif kind in targets and rest:
+                    member.name = rest
+                    tar.extract(member, targets[kind], set_attrs=False)
+                else:
+                    raise BundleError(f"unexpected member in bundle: {member.name}")
+                if member.isfile() and kind != "git":
+                    counts[kind] += 1
+    except (tarfile.TarError, OSError, ValueError) as e:
+        raise BundleError(f"could not read bundle {source}: {e}") from e
+    finally:
+        if stream is not sys.stdin.buffer:
+            stream.close()
+    if manifest is None:
+        raise BundleError(f"{source} has no {MANIFEST}")
+    return manifest
+
+
+def extract(source):
+    """
+    Stream a bundle (a path, or "-" for stdin) into the local caches, one
+    member at a time, and return its manifest. Git mirrors are unpacked
+    under temporary names and moved into the git cache once complete, so
+    nothing using the cache meanwhile sees a half-written one. Downloads are
+    re-hashed into the download cache, and gems and npm tarballs are staged
+    for the offline installers.
+    """
+    cache = DownloadCache()
+    targets = {
+        "git": gitcache.cache_dir(),
+        "gems": offline.staging_dir("gems"),
+        "npm": offline.staging_dir("npm"),
+        "parsers": nvim.parser_cache_dir(),
+    }
+    # Artifacts staged from an older bundle must not mix with this one
+    for kind in ("gems", "npm"):
+        shutil.rmtree(targets[kind], ignore_errors=True)
+    for directory in targets.values():
+        os.makedirs(directory, exist_ok=True)
+
+    counts = {"git": 0, "downloads": 0, "gems": 0, "npm": 0, "parsers": 0}
+    unpacked = {}
+    try:
+        manifest = _unpack(source, cache, targets, counts, unpacked)
+    except BaseException:
+        # A half-unpacked mirror never reaches the cache
+        for tmp in unpacked.values():
+            shutil.rmtree(os.path.join(targets["git"], tmp), ignore_errors=True)
+        raise
+
+    cache.import_entries(manifest["downloads"])
+    for name, tmp in unpacked.items():
+        if name.endswith(".git"):
+            gitcache.install_mirror(os.path.join(targets["git"], tmp), name, targets["git"])
+            counts["git"] += 1
+        else:
+            shutil.rmtree(os.path.join(targets["git"], tmp), ignore_errors=True)
+    print(f"Imported {counts['git']} git mirrors, {counts['downloads']} downloads, "
+          f"{counts['gems']} gems, {counts['npm']} npm packages and "
+          f"{counts['parsers']} treesitter parsers from {source}")
+    return manifest
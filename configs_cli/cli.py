@@ -0,0 +1,18 @@
+"""
+Console entry point.
+`status --prompt` runs on every shell prompt, so it is answered here before
+the full CLI (and everything main imports) is loaded.
+"""
+import sys
+
+
+def main():
+    if sys.argv[1:2] == ["status"] and "--prompt" in sys.argv[2:]:
+        from configs_cli import status
+        sys.exit(status.prompt())
+    from configs_cli.main import main as full_main
+    full_main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+Startup cost attribution for zsh and Neovim.
+zsh is started through a throwaway ZDOTDIR that loads zprof and turns on
+xtrace with a microsecond timestamp, the source file and the line number in
+PS4. Every traced line is charged the time until the next one, so the cost of
+each plugin (the file it came from) and of each section of the zshrc (every
+line run while that section was active, sourced plugins included) can be
+summed. Neovim is run with --startuptime, whose sourcing/require lines are
+mapped onto lazy.nvim plugin directories, and lazy.nvim's own per-plugin load
+times are read back as well.
+"""
+import json
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import tempfile
+
+from configs_cli import nvim, process, shellbuild
+
+PS4 = r"+%D{%s.%6.}\t%x\t%I> "
+ZSHRC_WRAPPER = """\
+zmodload zsh/zprof
+PS4=$'{ps4}'
+exec 3>&2 2>{trace}
+setopt xtrace
+source $HOME/.zshrc
+unsetopt xtrace
+exec 2>&3 3>&-
+zprof >{zprof}
+"""
+LAZY_TIMES = """\
+local ok, config = pcall(require, "lazy.core.config")
+local times = {{}}
+if ok then
+  for name, plugin in pairs(config.plugins) do
+    local loaded = plugin._ and plugin._.loaded
+    if loaded and loaded.time then times[name] = loaded.time / 1e6 end
+  end
+end
+vim.fn.writefile({{vim.json.encode(times)}}, "{path}")
+"""
+
+_TRACE = re.compile(r"^\++(\d+\.\d+)\t([^\t]*)\t(\d+)> ")
+_ZPROF = re.compile(r"^\s*\d+\)\s+(\d+)\s+([\d.]+)\s+[\d.]+\s+[\d.]+%\s+([\d.]+)\s+[\d.]+\s+[\d.]+%\s+(\S+)\s*$")
+_HEADER_RULE = re.compile(r"^#\s*-{10,}\s*$")
+_STARTUP_SOURCED = re.compile(r"^\s*([\d.]+)\s+([\d.]+)\s+([\d.]+):\s+(sourcing|require)\s*\(?'?(.+?)'?\)?\s*$")
+_STARTUP_EVENT = re.compile(r"^\s*([\d.]+)\s+([\d.]+):\s+(.+?)\s*$")
+
+
+def zshrc_blocks(path):
+    """
+    Map line numbers of a zshrc to the title of the section they are in;
+    sections are introduced by a '# Title' line between two '# ----' rules.
+    """
+    try:
+        with open(path) as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return {}
+    blocks, title = {}, "preamble"
+    for number, line in enumerate(lines, 1):
+        if (1 < number < len(lines) and _HEADER_RULE.match(lines[number - 2])
+                and _HEADER_RULE.match(lines[number]) and line.startswith("#")):
+            title = line.lstrip("# ").strip() or title
+        blocks[number] = title
+    return blocks
+
+
+def zsh_plugin_name(path, home=None):
+    """A readable plugin name for a sourced zsh file"""
+    home = home or os.path.expanduser("~")
+    parts = path.split("/")
+    for anchor in ("plugins", "themes"):
+        if anchor in parts[:-1]:
+            name = parts[parts.index(anchor) + 1]
+            return name if anchor == "plugins" else f"{name} theme"
+    omz = os.path.join(home, ".oh-my-zsh")
+    if path.startswith(omz + "/"):
+        return "oh-my-zsh" if path.endswith("oh-my-zsh.sh") else f"oh-my-zsh {parts[len(omz.split('/'))]}"
+    zsh_dir = os.path.join(home, ".zsh")
+    if path.startswith(zsh_dir + "/"):
+        return re.sub(r"\.(plugin\.)?zsh$", "", parts[len(zsh_dir.split("/"))])
+    return os.path.basename(path) or "(unknown)"
+
+
+def parse_zsh_trace(lines, zshrc_paths, wrapper=None, home=None):
+    """
+    Return ({zshrc section: ms}, {plugin: ms}) from xtrace lines. zshrc_paths
+    maps each file that is "the zshrc" (the dotfile, the precompiled copy) to
+    its line -> section map.
+    """
+    events = []
+    for line in lines:
+        match = _TRACE.match(line)
+        if match:
+            events.append((float(match.group(1)), match.group(2), int(match.group(3))))
+    blocks, plugins = {}, {}
+    current = None
+    for (stamp, path, number), (next_stamp, _path, _number) in zip(events, events[1:]):
+        if path == wrapper:
+            continue
+        cost = (next_stamp - stamp) * 1000
+        real = os.path.realpath(path) if path else path
+        if real in zshrc_paths:
+            current = zshrc_paths[real].get(number, current)
+            name = "zshrc"
+        else:
+            name = zsh_plugin_name(path, home)
+        plugins[name] = plugins.get(name, 0.0) + cost
+        if current:
+            blocks[current] = blocks.get(current, 0.0) + cost
+    return blocks, plugins
+
+
+def parse_zprof(text):
+    """{function: self ms} from zprof's summary table"""
+    functions = {}
+    for line in text.splitlines():
+        match = _ZPROF.match(line)
+        if match:
+            functions.setdefault(match.group(4), float(match.group(3)))
+    return functions
+
+
+def lua_module_owners(lazy_root):
+    """Map top-level Lua module names to the lazy.nvim plugin that provides them"""
+    owners = {}
+    try:
+        plugins = os.listdir(lazy_root)
+    except FileNotFoundError:
+        return owners
+    for plugin in plugins:
+        try:
+            modules = os.listdir(os.path.join(lazy_root, plugin, "lua"))
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        for module in modules:
+            owners.setdefault(re.sub(r"\.lua$", "", module), plugin)
+    return owners
+
+
+def parse_startuptime(lines, lazy_root, config_dir=None):
+    """
+    Return ({plugin: self ms}, {startup phase: ms}) from a --startuptime log.
+    Files under the lazy root are charged to their plugin, require()d modules
+    to the plugin providing them, and the rest to the config or the runtime.
+    """
+    owners = lua_module_owners(lazy_root)
+    config_dir = config_dir or os.path.join(os.path.expanduser("~"), ".config", "nvim")
+    plugins, phases = {}, {}
+    for line in lines:
+        match = _STARTUP_SOURCED.match(line)
+        if match:
+            self_ms, kind, target = float(match.group(3)), match.group(4), match.group(5)
+            if kind == "require":
+                module = target.split(".")[0]
+                name = owners.get(module)
+                if name is None:
+                    config_module = os.path.join(config_dir, "lua", module)
+                    is_config = os.path.exists(config_module) or os.path.exists(config_module + ".lua")
+                    name = "config" if is_config else "runtime"
+            elif target.startswith(lazy_root + "/"):
+                name = target[len(lazy_root) + 1:].split("/")[0]
+            elif target.startswith(config_dir + "/") or target == config_dir:
+                name = "config"
+            else:
+                name = "runtime"
+            plugins[name] = plugins.get(name, 0.0) + self_ms
+            continue
+        match = _STARTUP_EVENT.match(line)
+        if match and not match.group(3).startswith("---"):
+            phases[match.group(3)] = phases.get(match.group(3), 0.0) + float(match.group(2))
+    return plugins, phases
+
+
+def profile_zsh():
+    """Run one traced interactive zsh; returns {kind: {name: ms}}"""
+    home = os.path.expanduser("~")
+    with tempfile.TemporaryDirectory(prefix="configs-cli-doctor-") as zdotdir:
+        trace, zprof = os.path.join(zdotdir, "trace"), os.path.join(zdotdir, "zprof")
+        wrapper = os.path.join(zdotdir, ".zshrc")
+        with open(os.path.join(zdotdir, ".zshenv"), "w") as f:
+            f.write('[[ -r $HOME/.zshenv ]] && source $HOME/.zshenv\n')
+        with open(wrapper, "w") as f:
+            f.write(ZSHRC_WRAPPER.format(ps4=PS4, trace=trace, zprof=zprof))
+        process.run(["zsh", "-i", "-c", "exit"], env=dict(os.environ, ZDOTDIR=zdotdir),
+                    stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        zshrc_paths = {}
+        for path in (os.path.join(home, ".zshrc"), shellbuild.output_path()):
+            zshrc_paths[os.path.realpath(path)] = zshrc_blocks(path)
+        try:
+            with open(trace, errors="replace") as f:
+                blocks, plugins = parse_zsh_trace(f, zshrc_paths, wrapper, home)
+            with open(zprof, errors="replace") as f:
+                functions = parse_zprof(f.read())
+        except FileNotFoundError:
+            return {}
+    return {"block": blocks, "plugin": plugins, "function": functions}
+
+
+def profile_nvim():
+    """Run one headless Neovim startup; returns {kind: {name: ms}}"""
+    with tempfile.TemporaryDirectory(prefix="configs-cli-doctor-") as workdir:
+        log, lazy_json = os.path.join(workdir, "startuptime.log"), os.path.join(workdir, "lazy.json")
+        script = os.path.join(workdir, "lazy-times.lua")
+        with open(script, "w") as f:
+            f.write(LAZY_TIMES.format(path=lazy_json))
+        process.run(["nvim", "--headless", "--startuptime", log, "-c", f"luafile {script}", "+qa"],
+                    stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            with open(log, errors="replace") as f:
+                plugins, phases = parse_startuptime(f, nvim.lazy_root())
+        except FileNotFoundError:
+            return {}
+        try:
+            with open(lazy_json) as f:
+                lazy = json.load(f) or {}
+        except (OSError, ValueError):
+            lazy = {}
+    return {"plugin": plugins, "lazy": lazy, "phase": phases}
+
+
+PROFILERS = {"zsh": ("zsh", profile_zsh), "nvim": ("nvim", profile_nvim)}
+
+
+def diagnose(names, iterations=3):
+    """
+    Profile each tool iterations times and return rows
+    {"tool", "kind", "name", "ms"} (median over the runs), costliest first.
+    """
+    rows = []
+    for tool in names:
+        binary, profile = PROFILERS[tool]
+        if not shutil.which(binary):
+            print(f"Skipping {tool}: {binary} not found")
+            continue
+        runs = [profile() for _ in range(max(1, iterations))]
+        keys = {(kind, name) for run in runs for kind, costs in run.items() for name in costs}
+        for kind, name in keys:
+            ms = statistics.median(run.get(kind, {}).get(name, 0.0) for run in runs)
+            rows.append({"tool": tool, "kind": kind, "name": name, "ms": round(ms, 3)})
+    rows.sort(key=lambda row: (row["tool"], row["kind"], -row["ms"]))
+    return rows
+
+
+def print_report(rows, top=15):
+    """One ranked table per tool and kind, with each row's share of that table"""
+    groups = {}
+    for row in rows:
+        groups.setdefault((row["tool"], row["kind"]), []).append(row)
+    for (tool, kind), group in groups.items():
+        total = sum(row["ms"] for row in group) or 1.0
+        print(f"\n{tool} by {kind}")
+        print(f"  {'NAME':<48} {'MS':>9} {'SHARE':>6}")
+        for row in group[:top]:
+            print(f"  {row['name'][:48]:<48} {row['ms']:>9.2f} {row['ms'] / total:>6.1%}")
+        if len(group) > top:
+            rest = sum(row["ms"] for row in group[top:])
+            print(f"  {f'({len(group) - top} more)':<48} {rest:>9.2f} {rest / total:>6.1%}")
@@ -0,0 +1,180 @@
+"""Content-addressed download cache with conditional revalidation"""
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+from configs_cli import offline
+
+DEFAULT_CACHE_DIR = os.path.join("~", ".cache", "configs-cli", "downloads")
+
+
+class DownloadError(Exception):
+    pass
+
+
+def cache_dir():
+    """Return the download cache directory (CONFIGS_CLI_DOWNLOAD_CACHE overrides the default)"""
+    return os.path.expanduser(os.environ.get("CONFIGS_CLI_DOWNLOAD_CACHE", DEFAULT_CACHE_DIR))
+
+
+class DownloadCache:
+    """
+    Fetched artifacts are stored as objects/<sha256>; index.json maps each URL
+    to its current object plus the ETag/Last-Modified needed to revalidate it.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or cache_dir()
+        self.objects = os.path.join(self.root, "objects")
+        self.index_path = os.path.join(self.root, "index.json")
+        os.makedirs(self.objects, exist_ok=True)
+
+    def _locked_index(self):
+        lock = open(os.path.join(self.root, "index.lock"), "a")
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    def _read_index(self):
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _update_index(self, url, entry):
+        self.import_entries({url: entry})
+
+    def index_entries(self, urls):
+        """Return the index entries of the given URLs that are cached"""
+        index = self._read_index()
+        return {url: index[url] for url in urls if url in index}
+
+    def import_entries(self, entries):
+        """Merge index entries (url -> entry) whose objects were placed in objects/"""
+        lock = self._locked_index()
+        try:
+            index = self._read_index()
+            index.update(entries)
+            fd, tmp = tempfile.mkstemp(dir=self.root, prefix=".index-")
+            with os.fdopen(fd, "w") as f:
+                json.dump(index, f, indent=2, sort_keys=True)
+            os.replace(tmp, self.index_path)
+        finally:
+            lock.close()
+
+    def object_path(self, digest):
+        return os.path.join(self.objects, digest)
+
+    def cached(self, url, sha256=None):
+        """Return the cached object path for url if present (and matching sha256)"""
+        entry = self._read_index().get(url)
+        if not entry:
+            return None
+        path = self.object_path(entry["sha256"])
+        if not os.path.exists(path) or (sha256 and entry["sha256"] != sha256.lower()):
+            return None
+        return path
+
+    def fetch(self, url, sha256=None, timeout=30):
+        """
+        Return a local path holding url's content.
+        A cached copy is revalidated with If-None-Match/If-Modified-Since; a
+        304 costs no body transfer. If sha256 is given, the content must match
+        it. When the network fails, a cached copy is used if there is one.
+        In offline mode only the cache is consulted.
+        """
+        entry = self._read_index().get(url)
+        if offline.enabled():
+            if entry and os.path.exists(self.object_path(entry["sha256"])):
+                print(f"Using cached copy of {url} (offline)")
+                return self._verified(entry["sha256"], sha256, url)
+            raise DownloadError(f"{url}: not in the download cache and network access is disabled")
+        request = urllib.request.Request(url, headers={"User-Agent": "configs-cli"})
+        if entry and os.path.exists(self.object_path(entry["sha256"])):
+            if entry.get("etag"):
+                request.add_header("If-None-Match", entry["etag"])
+            if entry.get("last_modified"):
+                request.add_header("If-Modified-Since", entry["last_modified"])
+        else:
+            entry = None
+
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                digest, path = self.store(response)
+                headers = response.headers
+        except urllib.error.HTTPError as e:
+            if e.code == 304 and entry:
+                print(f"Cached copy of {url} is current")
+                return self._verified(entry["sha256"], sha256, url)
+            raise DownloadError(f"{url}: HTTP {e.code}") from e
+        except (urllib.error.URLError, OSError) as e:
+            if entry:
+                print(f"Warning: could not revalidate {url} ({e}); using cached copy")
+                return self._verified(entry["sha256"], sha256, url)
+            raise DownloadError(f"{url}: {e}") from e
+
+        if sha256 and digest != sha256.lower():
+            # Never index a bad payload: later 304s and offline runs would keep serving it
+            self._discard(digest)
+            raise DownloadError(f"{url}: checksum mismatch (expected {sha256}, got {digest})")
+        self._update_index(url, {
+            "sha256": digest,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "fetched": time.time(),
+        })
+        print(f"Downloaded {url} ({os.path.getsize(path)} bytes)")
+        return path
+
+    def store(self, stream):
+        """Stream a response (or any binary file object) into the object store, hashing as it goes"""
+        hasher = hashlib.sha256()
+        fd, tmp = tempfile.mkstemp(dir=self.objects, prefix=".partial-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in iter(lambda: stream.read(65536), b""):
+                    hasher.update(chunk)
+                    f.write(chunk)
+            digest = hasher.hexdigest()
+            path = self.object_path(digest)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        return digest, path
+
+    def _discard(self, digest):
+        """Remove an object no index entry refers to"""
+        lock = self._locked_index()
+        try:
+            if all(entry["sha256"] != digest for entry in self._read_index().values()):
+                try:
+                    os.unlink(self.object_path(digest))
+                except FileNotFoundError:
+                    pass
+        finally:
+            lock.close()
+
+    def _verified(self, digest, expected, url):
+        if expected and digest != expected.lower():
+            raise DownloadError(f"{url}: checksum mismatch (expected {expected}, got {digest})")
+        return self.object_path(digest)
+
+
+def fetch_first(urls, sha256=None, cache=None):
+    """Fetch the first URL that works; returns (url, cached path)"""
+    cache = cache or DownloadCache()
+    errors = []
+    for url in urls:
+        try:
+            return url, cache.fetch(url, sha256=sha256)
+        except DownloadError as e:
+            print(f"Failed to download {url}: {e}")
+            errors.append(str(e))
+    raise DownloadError("; ".join(errors))
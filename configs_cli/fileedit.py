@@ -0,0 +1,140 @@
+"""Single-pass, atomic editor for files configs-cli manages (such as zshrc)"""
+import os
+import re
+import tempfile
+
+BLOCK_BEGIN = "# >>> configs-cli {name} >>>"
+BLOCK_END = "# <<< configs-cli {name} <<<"
+_BLOCK_BEGIN = re.compile(r"^# >>> configs-cli (.+) >>>$")
+
+
+def atomic_write(path, data):
+    """Write bytes to path via a temp file, fsync and rename, keeping its mode"""
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        mode = os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        mode = 0o644
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+    # Make the rename itself durable
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def split_managed_blocks(text):
+    """
+    Return (text without any configs-cli blocks, [(block name, body lines)]).
+    The blank line managed_block() puts before an appended block goes with it.
+    """
+    lines, blocks, kept = text.splitlines(), [], []
+    i = 0
+    while i < len(lines):
+        match = _BLOCK_BEGIN.match(lines[i])
+        end = BLOCK_END.format(name=match.group(1)) if match else None
+        if match and end in lines[i + 1:]:
+            stop = lines.index(end, i + 1)
+            blocks.append((match.group(1), lines[i + 1:stop]))
+            if kept and kept[-1] == "":
+                kept.pop()
+            i = stop + 1
+            continue
+        kept.append(lines[i])
+        i += 1
+    return ("\n".join(kept) + "\n" if kept else ""), blocks
+
+
+class FileEditor:
+    """
+    Collect edits to a text file and apply them in memory in the order they
+    were requested. apply() reads the file once and writes it at most once,
+    atomically, and only if the content actually changed. Symlinks are
+    resolved so the link itself is never replaced by a regular file.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.realpath(path)
+        self.edits = []
+
+    def ensure_line(self, line, block):
+        """
+        Make sure line is present: left alone if the file already has it,
+        otherwise kept in the managed block named block, so the addition
+        never reads as a local edit to a tracked file
+        """
+        self.edits.append(("ensure", line, block))
+        return self
+
+    def remove_matching(self, text):
+        """Drop every line containing text"""
+        self.edits.append(("remove", text))
+        return self
+
+    def managed_block(self, name, lines):
+        """Replace (or append) the block delimited by configs-cli markers; empty removes it"""
+        self.edits.append(("block", name, list(lines)))
+        return self
+
+    def render(self, content):
+        """Return content with all collected edits applied"""
+        lines = content.splitlines()
+        for edit in self.edits:
+            kind = edit[0]
+            if kind == "ensure":
+                without = self._replace_block(lines, edit[2], [])
+                if edit[1] in (line.rstrip() for line in without):
+                    lines = without
+                else:
+                    if edit[1] not in lines:
+                        print(f"Added line to {self.path}: {edit[1]}")
+                    lines = self._replace_block(lines, edit[2], [edit[1]])
+            elif kind == "remove":
+                kept = [line for line in lines if edit[1] not in line]
+                if len(kept) != len(lines):
+                    print(f"Removed {len(lines) - len(kept)} line(s) containing '{edit[1]}' from {self.path}")
+                lines = kept
+            else:
+                lines = self._replace_block(lines, edit[1], edit[2])
+        return "\n".join(lines) + "\n" if lines else ""
+
+    @staticmethod
+    def _replace_block(lines, name, body):
+        begin, end = BLOCK_BEGIN.format(name=name), BLOCK_END.format(name=name)
+        block = [begin] + body + [end] if body else []
+        try:
+            start = lines.index(begin)
+            stop = lines.index(end, start)
+        except ValueError:
+            if not block:
+                return lines
+            return lines + [""] + block
+        return lines[:start] + block + lines[stop + 1:]
+
+    def apply(self):
+        """Apply the edits; returns True if the file was rewritten"""
+        try:
+            with open(self.path, "rb") as f:
+                original = f.read()
+        except FileNotFoundError:
+            original = b""
+        updated = self.render(original.decode()).encode()
+        self.edits = []
+        if updated == original:
+            return False
+        atomic_write(self.path, updated)
+        return True
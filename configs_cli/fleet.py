@@ -0,0 +1,170 @@
+"""Run the setup pipeline on many hosts concurrently over a pluggable transport"""
+import asyncio
+import shlex
+import sys
+import time
+
+# Bytes read from a host's output at a time; lines may be longer than this
+READ_CHUNK = 64 * 1024
+
+
+class Transport:
+    """Turns a command meant for a target into a local argv that runs it there"""
+
+    name = None
+
+    def __init__(self, target):
+        self.target = target
+
+    def argv(self, command):
+        raise NotImplementedError
+
+
+def split_ssh_target(target):
+    """
+    Split [user@]host[:port] into ([user@]host, port or None). IPv6 addresses
+    take a port only in brackets ([addr]:port); a bare one is all host.
+    """
+    user, at, host = target.rpartition("@")
+    port = None
+    if host.startswith("["):
+        address, _, rest = host[1:].partition("]")
+        host = address
+        if rest.startswith(":") and rest[1:]:
+            port = rest[1:]
+    elif host.count(":") == 1:
+        host, port = host.split(":")
+    return f"{user}{at}{host}", port or None
+
+
+class SSHTransport(Transport):
+    """Run the command on target (user@host[:port], user@[ipv6]:port) over ssh"""
+
+    name = "ssh"
+
+    def argv(self, command):
+        host, port = split_ssh_target(self.target)
+        argv = ["ssh", "-o", "BatchMode=yes", "-o", "ConnectTimeout=10"]
+        if port:
+            argv += ["-p", port]
+        return argv + [host, shlex.join(command)]
+
+
+class LocalTransport(Transport):
+    """Run the command as a local subprocess; the target is only a label"""
+
+    name = "local"
+
+    def argv(self, command):
+        return list(command)
+
+
+class ChrootTransport(Transport):
+    """Run the command inside the chroot at target"""
+
+    name = "chroot"
+
+    def argv(self, command):
+        return ["sudo", "chroot", self.target] + list(command)
+
+
+TRANSPORTS = {cls.name: cls for cls in (SSHTransport, LocalTransport, ChrootTransport)}
+
+
+def load_inventory(path, default_transport="ssh"):
+    """
+    Read one target per line. A line may name its transport explicitly
+    (local:name, chroot:/srv/vm1, ssh:user@host); otherwise default_transport
+    is used. Blank lines and # comments are ignored.
+    """
+    transports = []
+    with open(path) as f:
+        for raw in f:
+            line = raw.split("#", 1)[0].strip()
+            if not line:
+                continue
+            kind, sep, target = line.partition(":")
+            if not sep or kind not in TRANSPORTS:
+                kind, target = default_transport, line
+            transports.append(TRANSPORTS[kind](target))
+    return transports
+
+
+class HostResult:
+    def __init__(self, target, returncode, duration, error=None):
+        self.target = target
+        self.returncode = returncode
+        self.duration = duration
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.returncode == 0 and self.error is None
+
+
+async def _stream(reader, prefix, sink):
+    # Read in chunks rather than readline(), which gives up on lines over its buffer limit
+    pending = b""
+    while True:
+        chunk = await reader.read(READ_CHUNK)
+        if not chunk:
+            break
+        *lines, pending = (pending + chunk).split(b"\n")
+        for line in lines:
+            sink.write(f"{prefix} {line.decode(errors='replace').rstrip()}\n")
+        sink.flush()
+    if pending:
+        sink.write(f"{prefix} {pending.decode(errors='replace').rstrip()}\n")
+        sink.flush()
+
+
+async def run_on_host(transport, command, semaphore, width, sink=sys.stdout):
+    """Run command through transport, streaming its output with a host prefix"""
+    prefix = f"[{transport.target:<{width}}]"
+    async with semaphore:
+        started = time.monotonic()
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *transport.argv(command),
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT)
+        except OSError as e:
+            sink.write(f"{prefix} failed to start: {e}\n")
+            return HostResult(transport.target, None, time.monotonic() - started, error=str(e))
+        try:
+            await _stream(proc.stdout, prefix, sink)
+            returncode = await proc.wait()
+        except Exception as e:
+            # One misbehaving host is reported as failed; the rest of the fleet carries on
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            sink.write(f"{prefix} failed: {e}\n")
+            return HostResult(transport.target, proc.returncode, time.monotonic() - started, error=str(e))
+        return HostResult(transport.target, returncode, time.monotonic() - started)
+
+
+async def run_fleet(transports, command, concurrency=8, sink=sys.stdout):
+    """Run command on every target with at most concurrency in flight"""
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    width = max((len(t.target) for t in transports), default=0)
+    results = await asyncio.gather(*(run_on_host(t, command, semaphore, width, sink)
+                                     for t in transports), return_exceptions=True)
+    return [result if isinstance(result, HostResult) else HostResult(t.target, None, 0.0, error=str(result))
+            for t, result in zip(transports, results)]
+
+
+def print_fleet_summary(results):
+    """Print one line per host and return True if every host succeeded"""
+    print(f"\n{'host':<30} {'result':<8} {'exit':>5} {'time s':>8}")
+    print("-" * 55)
+    for result in results:
+        label = "ok" if result.ok else "FAILED"
+        code = "-" if result.returncode is None else str(result.returncode)
+        print(f"{result.target:<30} {label:<8} {code:>5} {result.duration:8.1f}")
+        if result.error:
+            print(f"    {result.error}")
+    failed = sum(1 for r in results if not r.ok)
+    print(f"\n{len(results) - failed} of {len(results)} hosts succeeded")
+    return failed == 0
@@ -0,0 +1,360 @@
+"""
+Shared bare-mirror cache for every git repository configs-cli clones.
+A mirror is a bare clone holding the upstream's branches and tags (not the
+pull request refs a full --mirror would drag along). Each mirror has a lock
+file: it is held exclusively to create, refresh or evict the mirror, and
+shared while a clone or fetch reads from it, so eviction never removes a
+mirror in use. The size and last use of every mirror are kept in an index,
+so eviction doesn't have to walk the cache.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import time
+from contextlib import ExitStack, contextmanager
+
+from configs_cli import offline, process
+from configs_cli.fileedit import FileEditor, atomic_write, split_managed_blocks
+
+DEFAULT_CACHE_DIR = os.path.join("~", ".cache", "configs-cli", "git")
+DEFAULT_MAX_MB = 1024
+INDEX = "index.json"
+REFSPECS = ["+refs/heads/*:refs/heads/*", "+refs/tags/*:refs/tags/*"]
+
+
+def cache_dir():
+    """Return the mirror cache directory (CONFIGS_CLI_GIT_CACHE overrides the default)"""
+    return os.path.expanduser(os.environ.get("CONFIGS_CLI_GIT_CACHE", DEFAULT_CACHE_DIR))
+
+
+def cache_limit_bytes():
+    """Return the cache size cap (CONFIGS_CLI_GIT_CACHE_MAX_MB overrides the default)"""
+    return int(os.environ.get("CONFIGS_CLI_GIT_CACHE_MAX_MB", DEFAULT_MAX_MB)) * 1024 * 1024
+
+
+def mirror_key(url):
+    """Address a mirror by the hash of its normalized URL"""
+    normalized = url.strip().rstrip("/")
+    if normalized.endswith(".git"):
+        normalized = normalized[:-4]
+    return hashlib.sha256(normalized.encode()).hexdigest()[:32]
+
+
+@contextmanager
+def _locked(path, mode=fcntl.LOCK_EX):
+    """Hold a lock on path: exclusive to change a mirror, shared to read from it"""
+    with open(path, "a") as lock:
+        fcntl.flock(lock, mode)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _dir_size(path):
+    total = 0
+    for root, _dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _load_index(root):
+    try:
+        with open(os.path.join(root, INDEX)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _update_index(root, key, entry):
+    """Set (or with entry None, drop) a mirror's {"size", "used"} in the index"""
+    with _locked(os.path.join(root, INDEX + ".lock")):
+        index = _load_index(root)
+        if entry is None:
+            index.pop(key, None)
+        else:
+            index[key] = {**index.get(key, {}), **entry}
+        atomic_write(os.path.join(root, INDEX), json.dumps(index, indent=2, sort_keys=True).encode())
+
+
+def _set_refspecs(git_dir, url):
+    """Fetch only branches and tags; also turns a legacy --mirror clone into one"""
+    config = ["git", "--git-dir", git_dir, "config"]
+    process.run(config + ["remote.origin.url", url], check=True)
+    process.run(config + ["--unset-all", "remote.origin.fetch"])
+    process.run(config + ["--unset", "remote.origin.mirror"])
+    for refspec in REFSPECS:
+        process.run(config + ["--add", "remote.origin.fetch", refspec], check=True)
+
+
+def _is_legacy_mirror(git_dir):
+    try:
+        with open(os.path.join(git_dir, "config")) as f:
+            return "mirror = true" in f.read()
+    except OSError:
+        return False
+
+
+def _drop_extra_refs(git_dir):
+    """Delete the refs/pull/* and other refs a --mirror clone fetched besides branches and tags"""
+    refs = process.run(["git", "--git-dir", git_dir, "for-each-ref", "--format=%(refname)"],
+                       check=True, capture_output=True, text=True).stdout.split()
+    extra = [ref for ref in refs if not ref.startswith(("refs/heads/", "refs/tags/"))]
+    if extra:
+        process.run(["git", "--git-dir", git_dir, "update-ref", "--stdin"],
+                    input="".join(f"delete {ref}\n" for ref in extra), text=True, check=True)
+
+
+def ensure_mirror(url, root=None):
+    """
+    Create or incrementally refresh the bare mirror of url and return its path.
+    In offline mode an existing mirror is used as is and a missing one is an error.
+    """
+    root = root or cache_dir()
+    os.makedirs(root, exist_ok=True)
+    key = mirror_key(url)
+    mirror = os.path.join(root, key + ".git")
+
+    with _locked(os.path.join(root, key + ".lock")):
+        entry = {"used": time.time()}
+        if os.path.isdir(mirror) and offline.enabled():
+            print(f"Using cached mirror of {url} (offline)")
+        elif offline.enabled():
+            raise offline.OfflineError(f"{url} is not in the git cache and network access is disabled")
+        elif os.path.isdir(mirror):
+            print(f"Refreshing cached mirror of {url}")
+            if _is_legacy_mirror(mirror):
+                _set_refspecs(mirror, url)
+                _drop_extra_refs(mirror)
+            process.run(["git", "--git-dir", mirror, "remote", "update", "--prune"],
+                        check=True, stdout=subprocess.DEVNULL)
+            entry["size"] = _dir_size(mirror)
+        else:
+            print(f"Creating cached mirror of {url}")
+            tmp = f"{mirror}.tmp-{os.getpid()}"
+            shutil.rmtree(tmp, ignore_errors=True)
+            try:
+                # --bare fetches branches and tags only; --mirror would add refs/pull/* and the like
+                process.run(["git", "clone", "--bare", "--quiet", url, tmp], check=True)
+                _set_refspecs(tmp, url)
+                os.rename(tmp, mirror)
+            finally:
+                shutil.rmtree(tmp, ignore_errors=True)
+            entry["size"] = _dir_size(mirror)
+        _update_index(root, key, entry)
+    return mirror
+
+
+def install_mirror(unpacked, name, root=None):
+    """
+    Move a mirror unpacked next to the cache (from a bundle) into place as
+    name (<key>.git), replacing any older copy under the mirror's lock, and
+    record it in the index.
+    """
+    root = root or cache_dir()
+    key = name[:-len(".git")]
+    mirror = os.path.join(root, name)
+    with _locked(os.path.join(root, key + ".lock")):
+        if os.path.isdir(mirror):
+            aside = f"{mirror}.old-{os.getpid()}"
+            os.rename(mirror, aside)
+            shutil.rmtree(aside, ignore_errors=True)
+        os.rename(unpacked, mirror)
+        _update_index(root, key, {"size": _dir_size(mirror), "used": time.time()})
+    return mirror
+
+
+@contextmanager
+def reading(mirror):
+    """Hold mirror with a shared lock, so evict() leaves it alone while git reads from it"""
+    with _locked(mirror[:-len(".git")] + ".lock", fcntl.LOCK_SH):
+        if not os.path.isdir(mirror):
+            raise FileNotFoundError(f"cached mirror {mirror} was evicted")
+        yield mirror
+
+
+@contextmanager
+def mirror_for(url, root=None):
+    """ensure_mirror(url), held for reading for the duration of the block"""
+    with reading(ensure_mirror(url, root)) as mirror:
+        yield mirror
+
+
+def evict(root=None, limit=None, keep=()):
+    """
+    Remove least recently used mirrors until the cache fits under limit bytes.
+    Sizes come from the index; only mirrors it doesn't know yet (such as ones
+    unpacked from a bundle) are measured. Mirrors being read are skipped.
+    """
+    root = root or cache_dir()
+    limit = cache_limit_bytes() if limit is None else limit
+    if not os.path.isdir(root):
+        return []
+
+    index = _load_index(root)
+    mirrors = []
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if not (entry.name.endswith(".git") and entry.is_dir(follow_symlinks=False)):
+                continue
+            key = entry.name[:-len(".git")]
+            known = index.get(key, {})
+            if "size" not in known:
+                known = {"size": _dir_size(entry.path), "used": known.get("used", entry.stat().st_mtime)}
+                _update_index(root, key, known)
+            mirrors.append((known.get("used", 0), entry.path, key, known["size"]))
+
+    total = sum(size for _used, _path, _key, size in mirrors)
+    removed = []
+    for _used, path, key, size in sorted(mirrors):
+        if total <= limit:
+            break
+        if path in keep:
+            continue
+        with open(os.path.join(root, key + ".lock"), "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Being cloned or fetched from right now
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+        _update_index(root, key, None)
+        total -= size
+        removed.append(path)
+        print(f"Evicted cached mirror {os.path.basename(path)} ({size // 1024} KiB)")
+    return removed
+
+
+def _read_head(git_dir):
+    try:
+        with open(os.path.join(git_dir, "HEAD")) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def head(checkout):
+    """Resolve a checkout's HEAD commit by reading .git directly (no fork)"""
+    git_dir = os.path.join(checkout, ".git")
+    value = _read_head(git_dir)
+    if value is None or not value.startswith("ref: "):
+        return value
+    ref = value[5:]
+    try:
+        with open(os.path.join(git_dir, ref)) as f:
+            return f.read().strip()
+    except OSError:
+        pass
+    try:
+        with open(os.path.join(git_dir, "packed-refs")) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2 and parts[1] == ref:
+                    return parts[0]
+    except OSError:
+        pass
+    return None
+
+
+def branch(checkout):
+    """The branch checked out in checkout, or None if HEAD is detached"""
+    value = _read_head(os.path.join(checkout, ".git"))
+    if value and value.startswith("ref: refs/heads/"):
+        return value[len("ref: refs/heads/"):]
+    return None
+
+
+def local_edits(checkout):
+    """
+    Split the uncommitted changes to tracked files in checkout into
+    ({path: working copy text} for files that only differ from HEAD in
+    configs-cli managed blocks, [paths with any other change]).
+    """
+    result = process.run(["git", "-C", checkout, "status", "--porcelain", "-z", "--untracked-files=no"],
+                         check=True, capture_output=True, text=True)
+    entries = result.stdout.split("\0")
+    managed, other = {}, []
+    i = 0
+    while i < len(entries):
+        entry = entries[i]
+        i += 1
+        if not entry:
+            continue
+        code, rel_path = entry[:2], entry[3:]
+        if code[0] in "RC":
+            # The source path of a rename follows; the rename itself is a real change
+            i += 1
+        if code.strip() != "M":
+            other.append(rel_path)
+            continue
+        committed = process.run(["git", "-C", checkout, "show", f"HEAD:{rel_path}"],
+                                capture_output=True, text=True)
+        try:
+            with open(os.path.join(checkout, rel_path)) as f:
+                working = f.read()
+        except (OSError, UnicodeDecodeError):
+            working = None
+        if (committed.returncode == 0 and working is not None
+                and split_managed_blocks(working)[0] == split_managed_blocks(committed.stdout)[0]):
+            managed[rel_path] = working
+        else:
+            other.append(rel_path)
+    return managed, other
+
+
+@contextmanager
+def managed_edits_set_aside(checkout, managed):
+    """
+    Check out the committed version of the files local_edits() found to only
+    carry managed blocks, so git can merge or reset over them, and re-apply
+    the blocks afterwards, into whatever version of each file is then checked out.
+    """
+    if not managed:
+        yield
+        return
+    committed = {}
+    process.run(["git", "-C", checkout, "checkout", "--quiet", "--", *managed], check=True)
+    for rel_path in managed:
+        with open(os.path.join(checkout, rel_path)) as f:
+            committed[rel_path] = dict(split_managed_blocks(f.read())[1])
+    try:
+        yield
+    finally:
+        for rel_path, working in managed.items():
+            editor = FileEditor(os.path.join(checkout, rel_path))
+            for name, body in split_managed_blocks(working)[1]:
+                if committed[rel_path].get(name) != body:
+                    editor.managed_block(name, body)
+            editor.apply()
+
+
+def clone(url, dest, root=None):
+    """
+    Clone url into dest through the local mirror cache.
+    The working copy is a local clone of the mirror (objects are hardlinked
+    where possible) with origin pointed back at url, so it doesn't depend on
+    the cache afterwards. Falls back to a direct clone if the cache is unusable.
+    """
+    with ExitStack() as stack:
+        try:
+            mirror = stack.enter_context(mirror_for(url, root))
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"Git cache unavailable ({e}); cloning {url} directly")
+            process.run(["git", "clone", url, dest], check=True)
+            return
+        process.run(["git", "clone", "--quiet", mirror, dest], check=True)
+    process.run(["git", "-C", dest, "remote", "set-url", "origin", url], check=True)
+    if offline.enabled():
+        # Mirrors imported from a bundle may not have been cloned yet
+        return
+    try:
+        evict(root, keep=(mirror,))
+    except OSError as e:
+        print(f"Warning: could not trim git cache: {e}")
@@ -0,0 +1,188 @@
+"""Dependency-graph executor for configs-cli setup steps"""
+import subprocess
+import sys
+import traceback
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from configs_cli import profiling
+
+OK = "ok"
+UNCHANGED = "unchanged"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+# Statuses that let dependent steps run
+SUCCESS = (OK, UNCHANGED)
+
+
+class Step:
+    """
+    A unit of setup work with the names of the steps it depends on.
+    fingerprint, if given, cheaply describes the step's inputs and outputs as
+    they are right now; it returns None when the desired result is missing.
+    """
+
+    def __init__(self, name, func, deps=(), description=None, fingerprint=None):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.description = description or name
+        self.fingerprint = fingerprint
+
+    def run(self):
+        with profiling.span(self.description, "step"):
+            return self.func()
+
+    def current_fingerprint(self):
+        """Evaluate the fingerprint, treating errors as 'must run'"""
+        if self.fingerprint is None:
+            return None
+        try:
+            return self.fingerprint()
+        except Exception:
+            return None
+
+    def __repr__(self):
+        return f"Step({self.name!r}, deps={list(self.deps)!r})"
+
+
+def validate_steps(steps):
+    """Ensure step names are unique, dependencies exist and there are no cycles"""
+    by_name = {}
+    for step in steps:
+        if step.name in by_name:
+            raise ValueError(f"Duplicate step name: {step.name}")
+        by_name[step.name] = step
+
+    for step in steps:
+        for dep in step.deps:
+            if dep not in by_name:
+                raise ValueError(f"Step {step.name} depends on unknown step {dep}")
+
+    # Depth-first search for cycles
+    visiting, done = set(), set()
+
+    def visit(name, path):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError("Dependency cycle: " + " -> ".join(path + [name]))
+        visiting.add(name)
+        for dep in by_name[name].deps:
+            visit(dep, path + [name])
+        visiting.discard(name)
+        done.add(name)
+
+    for step in steps:
+        visit(step.name, [])
+    return by_name
+
+
+def dependents_of(steps, name):
+    """Return the names of every step that transitively depends on name"""
+    found = set()
+    frontier = [name]
+    while frontier:
+        current = frontier.pop()
+        for step in steps:
+            if current in step.deps and step.name not in found:
+                found.add(step.name)
+                frontier.append(step.name)
+    return found
+
+
+def subgraph(steps, names):
+    """
+    The named steps plus everything that depends on them, with dependencies
+    on steps outside that set dropped (they are taken as already done).
+    """
+    chosen = set(names)
+    for name in names:
+        chosen |= dependents_of(steps, name)
+    return [Step(step.name, step.func, [dep for dep in step.deps if dep in chosen],
+                 step.description, step.fingerprint)
+            for step in steps if step.name in chosen]
+
+
+def plan_steps(steps, state):
+    """Return the steps whose recorded fingerprint no longer matches reality"""
+    validate_steps(steps)
+    return [step for step in steps if not state.matches(step.name, step.current_fingerprint())]
+
+
+def run_steps(steps, jobs=4, state=None):
+    """
+    Run steps on a bounded worker pool as soon as their dependencies succeed.
+    A failing step marks everything that depends on it as skipped; unrelated
+    branches of the graph keep running. With a state store, steps whose
+    fingerprint still matches are not run at all, and once the run is over
+    every successful step records its fingerprint as things then stand.
+    Returns a dict of step name -> status.
+    """
+    by_name = validate_steps(steps)
+    status = {}
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        while True:
+            # Marking a step unchanged can unblock others, so sweep until stable
+            progressed = True
+            while progressed:
+                progressed = False
+                for step in steps:
+                    if step.name in status or step.name in running.values():
+                        continue
+                    if not all(status.get(dep) in SUCCESS for dep in step.deps):
+                        continue
+                    if state is not None and state.matches(step.name, step.current_fingerprint()):
+                        status[step.name] = UNCHANGED
+                        progressed = True
+                        continue
+                    running[pool.submit(step.run)] = step.name
+
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    future.result()
+                    status[name] = OK
+                except (Exception, SystemExit) as e:
+                    status[name] = FAILED
+                    if state is not None:
+                        state.record(name, None)
+                    print(f"Error: step '{by_name[name].description}' failed: {e}", file=sys.stderr)
+                    if not isinstance(e, (SystemExit, subprocess.CalledProcessError)):
+                        traceback.print_exc()
+                    for dependent in dependents_of(steps, name):
+                        if dependent not in status:
+                            status[dependent] = SKIPPED
+
+    # Fingerprints are taken once every step is done: later steps edit files
+    # earlier ones fingerprint (npm-prefix the zshrc symlinks renders), and a
+    # step's result may only be complete after another ran (yay-clone, yay).
+    # Recorded any earlier, the next run would redo the step for nothing.
+    if state is not None and any(result == OK for result in status.values()):
+        for name, result in status.items():
+            if result in SUCCESS:
+                state.record(name, by_name[name].current_fingerprint())
+    return status
+
+
+def print_summary(steps, status):
+    """Print a one-line result for each step that did not succeed"""
+    problems = [s for s in steps if status.get(s.name) not in SUCCESS]
+    unchanged = sum(1 for s in steps if status.get(s.name) == UNCHANGED)
+    if not problems:
+        print(f"\nAll {len(steps)} setup steps completed successfully"
+              f" ({unchanged} already up to date)")
+        return
+    print("\nSetup finished with problems:")
+    for step in problems:
+        state = status.get(step.name, SKIPPED)
+        if state == FAILED:
+            print(f"\033[91m✗\033[0m {step.description}: failed")
+        else:
+            print(f"\033[93m⚠\033[0m {step.description}: skipped (a dependency failed)")
@@ -0,0 +1,529 @@
+"""
+Hermetic end-to-end benchmark of `configs-cli setup`.
+Every run gets a throwaway HOME and a PATH holding only stand-ins for
+pacman, apt-get, dpkg-query, sudo, zsh, tmux, nvim, npm, gem, ruby, makepkg
+and chsh, plus the few real tools they need (git, sh, cp, ...). The
+stand-ins keep their state (installed packages, the login shell, files
+"sudo" writes under /etc) in the host directory, sleep for a configurable
+latency (or one replayed from a `setup --profile` trace) and can be told to
+fail. git is real: every upstream URL is rewritten to a local file://
+fixture through insteadOf, and the Oh My Zsh installer is a local script.
+The paths outside HOME that setup reads are pointed into the host directory
+before setup starts. Per-step times come from setup's own --profile trace.
+"""
+import functools
+import json
+import os
+import shlex
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from configs_cli import process
+
+# Real tools the stand-ins, the fixture installer and setup itself use
+HOST_TOOLS = ("sh", "git", "cp", "mv", "rm", "ln", "mkdir", "touch", "cat", "grep", "chmod",
+              "sleep", "tr", "env")
+# Seconds each stand-in invocation takes; scaled by --latency-scale
+DEFAULT_LATENCIES = {
+    "pacman": 0.5,
+    "apt-get": 0.5,
+    "dpkg-query": 0.02,
+    "npm": 0.4,
+    "gem": 0.4,
+    "ruby": 0.03,
+    "nvim": 0.15,
+    "makepkg": 1.0,
+    "zsh": 0.005,
+    "tmux": 0.005,
+    "chsh": 0.02,
+}
+# scenario -> the failing stand-ins of each run; the last run is the one measured
+SCENARIOS = {
+    "fresh": [()],
+    "converged": [(), ()],
+    "partial": [("gem",), ()],
+}
+FIXTURE_DATE = "2024-01-01T00:00:00Z"
+RUBY_VERSION = "3.3.0"
+TREESITTER_URL = "https://github.com/nvim-treesitter/nvim-treesitter.git"
+
+_PRELUDE = """\
+#!/bin/sh
+# configs-cli harness stand-in
+H="$CONFIGS_CLI_HARNESS"
+tool="${0##*/}"
+printf '%s\\t%s\\n' "$tool" "$*" >> "$H/calls.log"
+if [ -r "$H/latency/$tool" ]; then read -r delay < "$H/latency/$tool"; sleep "$delay"; fi
+if [ -r "$H/fail/$tool" ]; then
+    read -r code < "$H/fail/$tool"
+    echo "$tool: injected failure" >&2
+    exit "$code"
+fi
+"""
+
+STANDINS = {
+    "pacman": """\
+db="$H/state/packages"
+touch "$db"
+case "$1" in
+-Q*)
+    shift
+    [ $# -eq 0 ] && { cat "$db"; exit 0; }
+    for pkg; do grep -qxF "$pkg" "$db" || exit 1; done
+    printf '%s\\n' "$@" ;;
+-S*)
+    case "$1" in -Sy*)
+        mkdir -p "$H/root/var/lib/pacman/sync" && touch "$H/root/var/lib/pacman/sync/core.db" ;;
+    esac
+    shift
+    skip=
+    for arg; do
+        if [ -n "$skip" ]; then skip=; continue; fi
+        case "$arg" in
+        --config|--root|--dbpath) skip=1 ;;
+        -*) ;;
+        *) grep -qxF "$arg" "$db" || echo "$arg" >> "$db" ;;
+        esac
+    done ;;
+esac
+""",
+    "apt-get": """\
+db="$H/state/packages"
+touch "$db"
+install= skip=
+for arg; do
+    if [ -n "$skip" ]; then skip=; continue; fi
+    case "$arg" in
+    -o|-c) skip=1 ;;
+    -*) ;;
+    update) mkdir -p "$H/root/var/lib/apt/lists" && touch "$H/root/var/lib/apt/lists/fixture_InRelease" ;;
+    install) install=1 ;;
+    *) [ -n "$install" ] && { grep -qxF "$arg" "$db" || echo "$arg" >> "$db"; } ;;
+    esac
+done
+""",
+    "dpkg-query": """\
+touch "$H/state/packages"
+while read -r pkg; do printf 'ii  %s\\n' "$pkg"; done < "$H/state/packages"
+""",
+    # Runs the command as the current user, with files under /etc redirected into the host root
+    "sudo": """\
+for arg; do
+    shift
+    case "$arg" in /etc/*) arg="$H/root$arg" ;; esac
+    set -- "$@" "$arg"
+done
+exec "$@"
+""",
+    "zsh": """\
+case "$1" in
+--version) echo "zsh 5.9 (x86_64-pc-linux-gnu)" ;;
+-fc)
+    out="${2#zcompile -U }"
+    out="${out#\\'}"
+    : > "${out%\\'}.zwc" ;;
+esac
+""",
+    "tmux": "",
+    "chsh": """\
+[ "$1" = "-s" ] && printf '%s\\n' "$2" > "$H/state/shell"
+""",
+    "ruby": f"""\
+case "$2" in
+*RUBY_VERSION*) printf '%s' "{RUBY_VERSION}" ;;
+*Gem.user_dir*) printf '%s' "$HOME/.local/share/gem/ruby/{RUBY_VERSION}" ;;
+esac
+""",
+    "gem": f"""\
+case "$1" in
+environment) echo "$HOME/.local/share/gem/ruby/{RUBY_VERSION}" ;;
+install)
+    name="$2" version= dir= bindir=
+    shift 2
+    while [ $# -gt 0 ]; do
+        case "$1" in
+        --version) version="$2"; shift ;;
+        --install-dir) dir="$2"; shift ;;
+        --bindir) bindir="$2"; shift ;;
+        esac
+        shift
+    done
+    bindir="${{bindir:-$dir/bin}}"
+    mkdir -p "$dir/specifications" "$dir/gems/$name-$version" "$bindir"
+    : > "$dir/specifications/$name-$version.gemspec"
+    printf '#!/bin/sh\\necho %s\\n' "$version" > "$bindir/$name"
+    chmod +x "$bindir/$name" ;;
+esac
+""",
+    "npm": """\
+case "$1" in
+pack)
+    spec="$2" dest=.
+    [ "$3" = "--pack-destination" ] && dest="$4"
+    name="${spec%@*}" version="${spec##*@}"
+    file="$(printf '%s' "${name#@}" | tr / -)-$version.tgz"
+    printf '%s %s\\n' "$name" "$version" > "$dest/$file"
+    echo "$file" ;;
+install)
+    prefix= tarball=
+    shift
+    while [ $# -gt 0 ]; do
+        case "$1" in
+        --prefix) prefix="$2"; shift ;;
+        -*) ;;
+        *) tarball="$1" ;;
+        esac
+        shift
+    done
+    read -r name version < "$tarball"
+    mkdir -p "$prefix/lib/node_modules/$name" "$prefix/bin"
+    printf '{"name": "%s", "version": "%s"}\\n' "$name" "$version" \\
+        > "$prefix/lib/node_modules/$name/package.json"
+    printf '#!/bin/sh\\necho %s\\n' "$version" > "$prefix/bin/${name##*/}"
+    chmod +x "$prefix/bin/${name##*/}" ;;
+esac
+""",
+    "nvim": """\
+data="${XDG_DATA_HOME:-$HOME/.local/share}/nvim"
+for arg; do
+    case "$arg" in
+    "+TSInstallSync! "*)
+        lang="${arg#+TSInstallSync! }"
+        ts="$data/lazy/nvim-treesitter"
+        mkdir -p "$ts/parser" "$ts/parser-info"
+        : > "$ts/parser/$lang.so"
+        printf fixture > "$ts/parser-info/$lang.revision" ;;
+    "+MasonInstall "*)
+        for pkg in ${arg#+MasonInstall }; do mkdir -p "$data/mason/packages/$pkg"; done ;;
+    esac
+done
+""",
+    # makepkg -si in the yay sources installs yay
+    "makepkg": """\
+mkdir -p "$H/bin"
+printf '#!/bin/sh\\n' > "$H/bin/yay"
+chmod +x "$H/bin/yay"
+""",
+}
+
+OH_MY_ZSH_INSTALLER = """\
+#!/bin/sh
+# Stand-in for the Oh My Zsh installer: clone $REMOTE and install the default zshrc
+set -e
+ZSH="${ZSH:-$HOME/.oh-my-zsh}"
+git clone --quiet "$REMOTE" "$ZSH"
+cp "$ZSH/templates/zshrc.zsh-template" "$HOME/.zshrc"
+"""
+
+
+def _fixture_repos():
+    """{fixture name: (upstream URL, {path: (content, executable)})}"""
+    from configs_cli import main, nvim
+
+    return {
+        "catppuccin": (main.CATPPUCCIN_URL, {
+            "themes/catppuccin_mocha-zsh-syntax-highlighting.zsh": ("ZSH_HIGHLIGHT_STYLES[comment]='fg=#585b70'\n", False),
+        }),
+        "zsh-autosuggestions": (main.AUTOSUGGESTIONS_URL, {
+            "zsh-autosuggestions.zsh": ("# zsh-autosuggestions fixture\n", False),
+        }),
+        "zsh-autocomplete": (main.AUTOCOMPLETE_URL, {
+            "zsh-autocomplete.plugin.zsh": ("# zsh-autocomplete fixture\n", False),
+        }),
+        "ohmyzsh": (main.OH_MY_ZSH_REPO_URL, {
+            "oh-my-zsh.sh": ("# oh-my-zsh fixture\n", False),
+            "templates/zshrc.zsh-template": ("export ZSH=\"$HOME/.oh-my-zsh\"\nsource $ZSH/oh-my-zsh.sh\n", False),
+        }),
+        "tpm": (main.TPM_URL, {
+            "tpm": ("#!/bin/sh\n", True),
+            "bin/install_plugins": ("#!/bin/sh\n", True),
+        }),
+        "yay": (main.YAY_URL, {
+            "PKGBUILD": ("pkgname=yay\npkgver=12.0.0\n", False),
+        }),
+        "lazy.nvim": (nvim.LAZY_URL, {
+            "lua/lazy/init.lua": ("return {}\n", False),
+        }),
+        "nvim-treesitter": (TREESITTER_URL, {
+            "lockfile.json": (json.dumps({lang: {"revision": "fixture"} for lang in nvim.TREESITTER_PARSERS},
+                                         indent=2) + "\n", False),
+            "lua/nvim-treesitter.lua": ("return {}\n", False),
+        }),
+    }
+
+
+def _configs_files(heads):
+    """The configs repository fixture, with lazy-lock.json pinned to the plugin fixtures"""
+    from configs_cli import toolchain
+
+    lazy_lock = {name: {"branch": "main", "commit": heads[name]} for name in ("lazy.nvim", "nvim-treesitter")}
+    return {
+        "dotfiles/zshrc": ("# ----------\n# Plugins\n# ----------\nsource ~/.zsh/zsh-autocomplete/"
+                           "zsh-autocomplete.plugin.zsh\n", False),
+        "dotfiles/tmux.conf": ("set -g @plugin 'tmux-plugins/tpm'\nrun '~/.tmux/plugins/tpm/tpm'\n", False),
+        "config/nvim/init.lua": ('require("lazy").setup({ "nvim-treesitter/nvim-treesitter" })\n', False),
+        "config/nvim/lazy-lock.json": (json.dumps(lazy_lock, indent=2) + "\n", False),
+        "config/xorg/00-keyboard.conf": ('Section "InputClass"\nEndSection\n', False),
+        toolchain.LOCKFILE: (json.dumps({"gem": {"neovim": {"version": "0.10.0"}},
+                                         "npm": {"pyright": {"version": "1.1.380"},
+                                                 "neovim": {"version": "5.1.0"}}}, indent=2) + "\n", False),
+    }
+
+
+def _git(*args, cwd=None):
+    env = dict(os.environ, GIT_AUTHOR_DATE=FIXTURE_DATE, GIT_COMMITTER_DATE=FIXTURE_DATE,
+               GIT_CONFIG_NOSYSTEM="1", GIT_CONFIG_GLOBAL=os.devnull)
+    result = process.run(["git", "-c", "user.name=harness", "-c", "user.email=harness@localhost", *args],
+                         cwd=cwd, env=env, check=True, capture_output=True, text=True)
+    return result.stdout.strip()
+
+
+def _make_repo(path, files):
+    """Create a one-commit git repository on branch main; returns its commit"""
+    os.makedirs(path)
+    for rel_path, (content, executable) in files.items():
+        target = os.path.join(path, rel_path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "w") as f:
+            f.write(content)
+        if executable:
+            os.chmod(target, 0o755)
+    _git("init", "--quiet", "--initial-branch", "main", cwd=path)
+    _git("add", "--all", cwd=path)
+    _git("commit", "--quiet", "--message", "fixture", cwd=path)
+    return _git("rev-parse", "HEAD", cwd=path)
+
+
+class Fixtures:
+    """Stand-in executables, git fixtures and the installer, built once and shared by every host"""
+
+    def __init__(self, root):
+        self.root = root
+        self.bin = os.path.join(root, "bin")
+        self.gitconfig = os.path.join(root, "gitconfig")
+        self.installer = os.path.join(root, "install.sh")
+        self.configs_url = None
+
+    def build(self):
+        os.makedirs(self.bin)
+        for name, body in STANDINS.items():
+            self._write_exec(os.path.join(self.bin, name), _PRELUDE + body)
+        for name in HOST_TOOLS:
+            found = shutil.which(name)
+            if found is None:
+                raise FileNotFoundError(f"{name} is needed by the harness but not installed")
+            os.symlink(found, os.path.join(self.bin, name))
+        self._write_exec(self.installer, OH_MY_ZSH_INSTALLER)
+
+        repos = os.path.join(self.root, "repos")
+        rewrites, heads = {}, {}
+        for name, (url, files) in _fixture_repos().items():
+            path = os.path.join(repos, name)
+            heads[name] = _make_repo(path, files)
+            rewrites[url] = f"file://{path}"
+        configs = os.path.join(repos, "configs")
+        _make_repo(configs, _configs_files(heads))
+        self.configs_url = f"file://{configs}"
+        with open(self.gitconfig, "w") as f:
+            for url, local in rewrites.items():
+                f.write(f'[url "{local}"]\n\tinsteadOf = {url}\n')
+        return self
+
+    @staticmethod
+    def _write_exec(path, text):
+        with open(path, "w") as f:
+            f.write(text)
+        os.chmod(path, 0o755)
+
+
+class Host:
+    """One simulated machine: a HOME plus the stand-ins' state, latencies and injected failures"""
+
+    def __init__(self, root, fixtures, latencies):
+        self.root = root
+        self.fixtures = fixtures
+        self.home = os.path.join(root, "home")
+        for directory in ("home", "state", "latency", "fail", "bin", "root/etc/X11/xorg.conf.d"):
+            os.makedirs(os.path.join(root, directory), exist_ok=True)
+        for tool, seconds in latencies.items():
+            with open(os.path.join(root, "latency", tool), "w") as f:
+                f.write(f"{seconds:.4f}\n")
+        with open(os.path.join(root, "root", "etc", "pacman.conf"), "w") as f:
+            f.write("[options]\nArchitecture = auto\n\n[core]\nInclude = /etc/pacman.d/mirrorlist\n")
+        self.runs = 0
+
+    def env(self):
+        package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        pythonpath = os.pathsep.join(filter(None, [package_root, os.environ.get("PYTHONPATH")]))
+        return {
+            "HOME": self.home,
+            "PATH": os.pathsep.join([os.path.join(self.root, "bin"), self.fixtures.bin]),
+            "PYTHONPATH": pythonpath,
+            "LANG": os.environ.get("LANG", "C.UTF-8"),
+            "TERM": os.environ.get("TERM", "dumb"),
+            "USER": os.environ.get("USER", "harness"),
+            "TMPDIR": os.path.join(self.root, "tmp"),
+            "CONFIGS_CLI_HARNESS": self.root,
+            "GIT_CONFIG_GLOBAL": self.fixtures.gitconfig,
+            "GIT_CONFIG_NOSYSTEM": "1",
+        }
+
+    def run_setup(self, system, jobs=4, fail=()):
+        """Run setup once; returns {"wall", "exit_code", "steps": {step: s}, "processes", "log"}"""
+        self.runs += 1
+        for tool in os.listdir(os.path.join(self.root, "fail")):
+            os.unlink(os.path.join(self.root, "fail", tool))
+        for tool in fail:
+            with open(os.path.join(self.root, "fail", tool), "w") as f:
+                f.write("1\n")
+        os.makedirs(os.path.join(self.root, "tmp"), exist_ok=True)
+        trace = os.path.join(self.root, f"trace-{self.runs}.json")
+        log = os.path.join(self.root, f"setup-{self.runs}.log")
+        command = [sys.executable, "-c", "import sys; from configs_cli.harness import child_main; child_main()",
+                   self.fixtures.root, "--system", system, "--repo", os.path.join(self.home, ".configs"),
+                   "--repo-url", self.fixtures.configs_url, "--jobs", str(jobs), "--profile", trace]
+        started = time.perf_counter()
+        with open(log, "w") as out:
+            result = process.run(command, env=self.env(), stdin=subprocess.DEVNULL, stdout=out,
+                                 stderr=subprocess.STDOUT)
+        wall = time.perf_counter() - started
+        steps, processes = {}, 0
+        try:
+            with open(trace) as f:
+                events = json.load(f)["traceEvents"]
+        except (OSError, ValueError, KeyError):
+            events = []
+        for event in events:
+            if event["cat"] == "step":
+                steps[event["name"]] = event["dur"] / 1e6
+            elif event["cat"] == "process":
+                processes += 1
+        return {"wall": wall, "exit_code": result.returncode, "steps": steps,
+                "processes": processes, "log": log}
+
+
+def child_main():
+    """
+    Entry point of the setup process a Host starts: argv is the fixtures
+    directory followed by setup's arguments. Points every path outside HOME
+    that setup reads into the host directory, then runs setup.
+    """
+    from configs_cli import main, packages
+    from configs_cli.state import file_digest, fingerprint, path_signature
+
+    fixtures, host = sys.argv[1], os.environ["CONFIGS_CLI_HARNESS"]
+    root = os.path.join(host, "root")
+    packages.PACMAN_CONF = os.path.join(root, "etc", "pacman.conf")
+    packages.PACMAN_SYNC_DIR = os.path.join(root, "var", "lib", "pacman", "sync")
+    packages.APT_LISTS_DIR = os.path.join(root, "var", "lib", "apt", "lists")
+    packages.APT_SOURCES = [os.path.join(root, "etc", "apt", "sources.list"),
+                            os.path.join(root, "etc", "apt", "sources.list.d")]
+    main.pacman_config = functools.partial(packages.pacman_config, base=packages.PACMAN_CONF)
+
+    installer = os.path.join(fixtures, "install.sh")
+    main.OH_MY_ZSH_INSTALLER_URLS = [f"file://{installer}"]
+    main.OH_MY_ZSH_INSTALLER_SHA256 = file_digest(installer)
+
+    package_db = os.path.join(host, "state", "packages")
+    main.packages_fingerprint = lambda system: (
+        path_signature(package_db) and fingerprint(system, path_signature(package_db)))
+
+    def keyboard_fingerprint(repo_dir):
+        digest = file_digest(os.path.join(repo_dir, "config", "xorg", "00-keyboard.conf"))
+        installed = os.path.join(root, "etc", "X11", "xorg.conf.d", "00-keyboard.conf")
+        return fingerprint(digest) if digest is not None and digest == file_digest(installed) else None
+
+    def default_shell_fingerprint():
+        try:
+            with open(os.path.join(host, "state", "shell")) as f:
+                shell = f.read().strip()
+        except OSError:
+            return None
+        return fingerprint(shell) if shell == shutil.which("zsh") else None
+
+    main.keyboard_fingerprint = keyboard_fingerprint
+    main.default_shell_fingerprint = default_shell_fingerprint
+    sys.argv = ["configs-cli", "setup", *sys.argv[2:]]
+    main.main()
+
+
+def load_latencies(path):
+    """
+    Read {tool: seconds} from a JSON file, or replay the median duration of
+    each tool's subprocesses from a Chrome trace written by `setup --profile`.
+    """
+    with open(path) as f:
+        data = json.load(f)
+    if "traceEvents" not in data:
+        return {tool: float(seconds) for tool, seconds in data.items()}
+    samples = {}
+    for event in data["traceEvents"]:
+        if event.get("cat") != "process":
+            continue
+        try:
+            argv = shlex.split(event["name"])
+        except ValueError:
+            continue
+        while argv and os.path.basename(argv[0]) == "sudo":
+            argv = argv[1:]
+        if argv:
+            samples.setdefault(os.path.basename(argv[0]), []).append(event["dur"] / 1e6)
+    return {tool: statistics.median(durations) for tool, durations in samples.items()
+            if tool in STANDINS}
+
+
+def run_scenarios(names, system="arch", repeat=1, latencies=None, jobs=4, keep=None):
+    """
+    Run each scenario repeat times on fresh hosts. Returns
+    {scenario: {"runs": [measured run, ...], "wall": median s, "steps": {step: median s}}}.
+    """
+    latencies = DEFAULT_LATENCIES if latencies is None else latencies
+    workdir = keep or tempfile.mkdtemp(prefix="configs-cli-harness-")
+    os.makedirs(workdir, exist_ok=True)
+    results = {}
+    try:
+        started = time.perf_counter()
+        fixtures = Fixtures(os.path.join(workdir, "fixtures")).build()
+        print(f"Built fixtures in {time.perf_counter() - started:.2f}s ({workdir})")
+        for name in names:
+            measured = []
+            for i in range(repeat):
+                host = Host(os.path.join(workdir, f"{name}-{i + 1}"), fixtures, latencies)
+                for fail in SCENARIOS[name]:
+                    run = host.run_setup(system, jobs, fail)
+                print(f"{name} #{i + 1}: {run['wall']:.2f}s, {len(run['steps'])} steps run, "
+                      f"{run['processes']} processes, exit {run['exit_code']}")
+                measured.append(run)
+            steps = sorted({step for run in measured for step in run["steps"]})
+            results[name] = {
+                "runs": [{key: value for key, value in run.items() if key != "log"} for run in measured],
+                "wall": statistics.median(run["wall"] for run in measured),
+                "steps": {step: statistics.median(run["steps"].get(step, 0.0) for run in measured)
+                          for step in steps},
+            }
+    finally:
+        if keep is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def print_results(results):
+    print(f"\n{'scenario':<12} {'wall s':>8} {'steps run':>10} {'processes':>10} {'exit':>5}")
+    print("-" * 49)
+    for name, result in results.items():
+        last = result["runs"][-1]
+        print(f"{name:<12} {result['wall']:8.2f} {len(result['steps']):>10} {last['processes']:>10} "
+              f"{last['exit_code']:>5}")
+    steps = sorted({step for result in results.values() for step in result["steps"]})
+    if not steps:
+        return
+    print(f"\n{'step (median s)':<40}" + "".join(f"{name:>12}" for name in results))
+    print("-" * (40 + 12 * len(results)))
+    for step in steps:
+        cells = "".join(f"{result['steps'][step]:12.2f}" if step in result["steps"] else f"{'-':>12}"
+                        for result in results.values())
+        print(f"{step[:40]:<40}{cells}")
@@ -1,42 +1,116 @@
 #!/usr/bin/env python3
 import argparse
+import asyncio
+import contextlib
+import glob
+import json
+import shlex
 import subprocess
 import os
 import sys
 import shutil
 import tempfile
+import time
 from pathlib import Path
 
-def install_oh_my_zsh_theme():
-    """Install the Catppuccin theme and zsh plugins"""
-    # Create directories
-    themes_dir = os.path.expanduser("~/.oh-my-zsh/custom/themes")
+from configs_cli import (bundle, doctor, gitcache, mirrors, nvim, offline, probe, process,
+                         profiling, shellbuild, snapshot, stamp, status, toolchain, update, watch)
+from configs_cli.audit import expand_homes, audit_homes, audit_report
+from configs_cli.download import DownloadError, fetch_first
+from configs_cli.fileedit import FileEditor, atomic_write
+from configs_cli.fleet import TRANSPORTS, load_inventory, run_fleet, print_fleet_summary
+from configs_cli.graph import Step, run_steps, plan_steps, print_summary, subgraph, SUCCESS
+from configs_cli.symlinks import MANIFEST as LINKS_MANIFEST, ManifestError, plan_links, apply_links
+from configs_cli.state import StateStore, fingerprint, path_signature, file_digest, exists_fingerprint
+from configs_cli.packages import (installed_packages, plan_packages, install_command, refresh_command,
+                                  index_age, index_ttl, last_refresh_seconds, record_refresh,
+                                  pacman_config)
+
+# Git repositories setup clones; bundle create mirrors every one of them
+CATPPUCCIN_URL = "https://github.com/catppuccin/zsh-syntax-highlighting.git"
+AUTOSUGGESTIONS_URL = "https://github.com/zsh-users/zsh-autosuggestions.git"
+AUTOCOMPLETE_URL = "https://github.com/marlonrichert/zsh-autocomplete.git"
+OH_MY_ZSH_REPO_URL = "https://github.com/ohmyzsh/ohmyzsh.git"
+TPM_URL = "https://github.com/tmux-plugins/tpm"
+YAY_URL = "https://aur.archlinux.org/yay.git"
+
+# Which setup steps to re-run when update (or watch) sees files in the configs repository change
+REPO_UPDATE_RULES = [
+    ("dotfiles/", ["symlinks"], "AD"),
+    ("config/", ["symlinks"], "AD"),
+    (LINKS_MANIFEST, ["symlinks"]),
+    ("dotfiles/zshrc", ["npm-prefix", "build-shell"]),
+    ("dotfiles/tmux.conf", ["tmux-source"]),
+    ("config/nvim/lazy-lock.json", ["nvim-plugins"]),
+    ("config/xorg/", ["keyboard"]),
+    (toolchain.LOCKFILE, ["gems", "npm-packages"]),
+]
+
+def managed_checkouts(repo_dir):
+    """Every git checkout setup creates, with the steps its changes feed into"""
+    home = os.path.expanduser("~")
+    checkouts = [
+        update.Checkout("catppuccin", os.path.join(home, ".zsh", "catppuccin-zsh-syntax-highlighting"),
+                        CATPPUCCIN_URL, [("themes/", ["catppuccin"])]),
+        update.Checkout("zsh-autosuggestions",
+                        os.path.join(home, ".oh-my-zsh", "custom", "plugins", "zsh-autosuggestions"),
+                        AUTOSUGGESTIONS_URL),
+        update.Checkout("zsh-autocomplete", os.path.join(home, ".zsh", "zsh-autocomplete"), AUTOCOMPLETE_URL),
+        update.Checkout("oh-my-zsh", os.path.join(home, ".oh-my-zsh"), OH_MY_ZSH_REPO_URL),
+        update.Checkout("tpm", os.path.join(home, ".tmux", "plugins", "tpm"), TPM_URL,
+                        [("", ["tmux-source"])]),
+    ]
+    result = process.run(["git", "-C", repo_dir, "remote", "get-url", "origin"],
+                         capture_output=True, text=True)
+    if result.returncode == 0 and result.stdout.strip():
+        checkouts.append(update.Checkout("configs", repo_dir, result.stdout.strip(), REPO_UPDATE_RULES))
+    return checkouts
+
+def install_catppuccin_theme():
+    """Install the Catppuccin zsh syntax highlighting theme"""
     zsh_dir = os.path.expanduser("~/.zsh")
-    plugins_dir = os.path.expanduser("~/.oh-my-zsh/custom/plugins")
-    os.makedirs(themes_dir, exist_ok=True)
     os.makedirs(zsh_dir, exist_ok=True)
-    os.makedirs(plugins_dir, exist_ok=True)
-    
+
     # Clone Catppuccin theme repository
     catppuccin_dir = os.path.expanduser("~/.zsh/catppuccin-zsh-syntax-highlighting")
     if not os.path.exists(catppuccin_dir):
         print_step("Installing Catppuccin syntax highlighting theme")
-        subprocess.run(["git", "clone", 
-                       "https://github.com/catppuccin/zsh-syntax-highlighting.git",
-                       catppuccin_dir], check=True)
-        
-        # Copy the mocha theme file
-        subprocess.run(["cp", 
-                       f"{catppuccin_dir}/themes/catppuccin_mocha-zsh-syntax-highlighting.zsh",
-                       f"{zsh_dir}/catppuccin_mocha-zsh-syntax-highlighting.zsh"], check=True)
+        gitcache.clone(CATPPUCCIN_URL, catppuccin_dir)
+
+    # Copy the mocha theme file (again, after update brought a new version)
+    theme = f"{catppuccin_dir}/themes/catppuccin_mocha-zsh-syntax-highlighting.zsh"
+    installed_theme = f"{zsh_dir}/catppuccin_mocha-zsh-syntax-highlighting.zsh"
+    if file_digest(theme) != file_digest(installed_theme):
+        snapshot.save(installed_theme)
+        with open(theme, "rb") as f:
+            atomic_write(installed_theme, f.read())
+
+def install_zsh_autosuggestions():
+    """Install the zsh-autosuggestions plugin into Oh My Zsh's custom plugins"""
+    themes_dir = os.path.expanduser("~/.oh-my-zsh/custom/themes")
+    plugins_dir = os.path.expanduser("~/.oh-my-zsh/custom/plugins")
+    os.makedirs(themes_dir, exist_ok=True)
+    os.makedirs(plugins_dir, exist_ok=True)
 
     # Install zsh-autosuggestions
-    autosuggestions_dir = os.path.expanduser("~/.oh-my-zsh/custom/plugins/zsh-autosuggestions")
+    autosuggestions_dir = os.path.join(plugins_dir, "zsh-autosuggestions")
     if not os.path.exists(autosuggestions_dir):
         print_step("Installing zsh-autosuggestions plugin")
-        subprocess.run(["git", "clone",
-                       "https://github.com/zsh-users/zsh-autosuggestions.git",
-                       autosuggestions_dir], check=True)
+        gitcache.clone(AUTOSUGGESTIONS_URL, autosuggestions_dir)
+
+def install_zsh_autocomplete():
+    """Install the zsh-autocomplete plugin"""
+    autocomplete_dir = os.path.expanduser("~/.zsh/zsh-autocomplete")
+    if not os.path.exists(autocomplete_dir):
+        print("\nInstalling zsh-autocomplete...")
+        gitcache.clone(AUTOCOMPLETE_URL, autocomplete_dir)
+
+OH_MY_ZSH_INSTALLER_URLS = [
+    "https://install.ohmyz.sh",
+    "https://raw.githubusercontent.com/ohmyzsh/ohmyzsh/master/tools/install.sh",
+]
+# Optional pin for the installer's sha256, e.g. for audited fleets
+OH_MY_ZSH_INSTALLER_SHA256 = os.environ.get("CONFIGS_CLI_OMZ_SHA256") or None
 
 def install_oh_my_zsh():
     """Install Oh My Zsh if not already installed"""
@@ -48,45 +122,49 @@ def install_oh_my_zsh():
         
         # Backup existing .zshrc if it exists
         zshrc_path = os.path.expanduser("~/.zshrc")
+        # The installer replaces ~/.zshrc, which we may delete again below
+        snapshot.save(zshrc_path)
         if os.path.exists(zshrc_path):
             print(f"Backing up existing .zshrc to {zshrc_backup}")
             shutil.copy2(zshrc_path, zshrc_backup)
         # First verify zsh version
-        try:
-            zsh_version = subprocess.check_output(["zsh", "--version"]).decode()
-            print(f"Found ZSH: {zsh_version.strip()}")
-        except subprocess.CalledProcessError:
+        zsh_version = probe.output(["zsh", "--version"])
+        if not zsh_version:
             print("Error: ZSH is not properly installed")
             sys.exit(1)
+        print(f"Found ZSH: {zsh_version}")
 
-        # Download the install script first for inspection
-        install_script = "/tmp/install_ohmyzsh.sh"
-        alternative_url = "https://install.ohmyz.sh"
-        
+        # Fetch the installer through the download cache; each run executes
+        # its own private copy so concurrent runs for different users can't collide
+        print_step("Downloading Oh My Zsh installer")
         try:
-            # Ensure wget is installed
-            if not shutil.which("wget"):
-                print("Installing wget...")
-                subprocess.run(["sudo", "pacman", "-S", "--noconfirm", "wget"], check=True)
-
-            print_step("Downloading Oh My Zsh installer")
-            print("Downloading from:", alternative_url)
-            subprocess.run(["wget", "-O", install_script, alternative_url], check=True)
-            print("Download completed successfully")
-        except subprocess.CalledProcessError:
-            backup_url = "https://raw.githubusercontent.com/ohmyzsh/ohmyzsh/master/tools/install.sh"
-            print("Failed to download from primary URL")
-            print("Trying backup URL:", backup_url)
-            subprocess.run(["wget", "-O", install_script, backup_url], check=True)
-            print("Download completed successfully from backup URL")
+            url, cached_script = fetch_first(OH_MY_ZSH_INSTALLER_URLS, sha256=OH_MY_ZSH_INSTALLER_SHA256)
+            print("Using installer from:", url)
+        except DownloadError as e:
+            print(f"Error downloading Oh My Zsh installer: {e}")
+            sys.exit(1)
+        fd, install_script = tempfile.mkstemp(prefix="install_ohmyzsh-", suffix=".sh")
+        with os.fdopen(fd, "wb") as dest, open(cached_script, "rb") as src:
+            shutil.copyfileobj(src, dest)
 
         # Make the script executable
-        os.chmod(install_script, 0o755)
+        os.chmod(install_script, 0o700)
+
+        # Let the installer fetch from the local mirror (it honours $REMOTE), held so it isn't evicted mid-clone
+        env = None
+        mirror = contextlib.ExitStack()
+        try:
+            env = dict(os.environ, REMOTE=mirror.enter_context(gitcache.mirror_for(OH_MY_ZSH_REPO_URL)))
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"Git cache unavailable ({e}); the installer will clone directly")
         
         # Run the installer
         try:
             print_step("Running Oh My Zsh installer")
-            subprocess.run([install_script, "--unattended"], check=True)
+            process.run([install_script, "--unattended"], check=True, env=env)
+            if env:
+                process.run(["git", "-C", oh_my_zsh_dir, "remote", "set-url", "origin",
+                             OH_MY_ZSH_REPO_URL], check=True)
             
             # Remove the default .zshrc created by oh-my-zsh installation
             zshrc_path = os.path.expanduser("~/.zshrc")
@@ -102,364 +180,279 @@ def install_oh_my_zsh():
                             shutil.copy2(zshrc_backup, zshrc_path)
                 else:
                     os.remove(zshrc_path)
-                
-            # Clean up the installer
-            os.remove(install_script)
         except subprocess.CalledProcessError as e:
             print(f"Error installing Oh My Zsh: {e}")
             sys.exit(1)
+        finally:
+            # Clean up the installer
+            mirror.close()
+            os.remove(install_script)
     else:
         print("Oh My Zsh is already installed")
-        install_oh_my_zsh_theme()
 
 def check_dependency(pkg):
     """Check if a package is installed"""
-    if shutil.which(pkg):
-        return True
-    
-    try:
-        if subprocess.run(["which", pkg], 
-                        stdout=subprocess.PIPE, 
-                        stderr=subprocess.PIPE).returncode == 0:
-            return True
-    except:
-        pass
-    return False
+    return probe.which(pkg) is not None
 
 def install_jetbrains_font():
     """Install JetBrains Mono Nerd Font if not already installed"""
     try:
-        # Check if font is installed
-        result = subprocess.run(["pacman", "-Qq", "ttf-jetbrains-mono-nerd"], 
-                              capture_output=True)
-        if result.returncode != 0:
+        # Check if font is installed; the answer holds until the package database changes
+        if probe.output(["pacman", "-Qq", "ttf-jetbrains-mono-nerd"],
+                        depends_on=["/var/lib/pacman/local"]) is None:
             print_step("Installing JetBrains Mono Nerd Font")
-            subprocess.check_call(["sudo", "pacman", "-S", "--noconfirm", "ttf-jetbrains-mono-nerd"])
+            process.check_call(["sudo", "pacman", "-S", "--noconfirm", "ttf-jetbrains-mono-nerd"])
             print("JetBrains Mono Nerd Font installed successfully")
         else:
             print("JetBrains Mono Nerd Font is already installed")
     except subprocess.CalledProcessError as e:
         print(f"Error installing JetBrains Mono Nerd Font: {e}")
 
-def install_dependencies(system, args):
-    """Install system dependencies based on the operating system."""
+ARCH_PACKAGE_GROUPS = [
+    # Essential packages first
+    ("essential packages", ["zsh", "tmux"]),
+    # Install zsh plugins separately to ensure they're found
+    ("zsh plugins", ["zsh-syntax-highlighting", "zsh-autosuggestions", "zsh-completions"]),
+    # Base packages for headless environment
+    ("core packages", [
+        "neovim", "curl", "git", "wget",
+        "ruby", "ruby-rake", "gcc",
+        "ttf-jetbrains-mono-nerd",
+        "python-pip", "nodejs", "npm"
+    ]),
+]
+
+UBUNTU_PACKAGE_GROUPS = [
+    ("essential packages", ["zsh", "tmux"]),
+    ("core packages", [
+        "neovim", "curl", "git", "wget",
+        "ruby", "ruby-dev", "gcc",
+        "fonts-jetbrains-mono-nerd",
+        "python3-pip", "nodejs", "npm"
+    ]),
+    ("zsh plugins", ["zsh-syntax-highlighting", "zsh-autosuggestions"]),
+]
+
+def normalize_system(system):
+    """Map system aliases onto 'arch' or 'ubuntu'"""
     system = system.lower()
-    
     if system in ["arch", "archlinux"]:
-        print_step("Installing dependencies on Arch Linux")
-        
-        # Install essential packages first
-        print("Installing essential packages...")
-        essential_packages = ["zsh", "tmux"]
-        subprocess.run(["sudo", "pacman", "-S", "--needed", "--noconfirm"] + essential_packages, check=True)
-        
-        # Base packages for headless environment
-        base_packages = [
-            "neovim", "curl", "git", "wget",
-            "ruby", "ruby-rake", "gcc",
-            "ttf-jetbrains-mono-nerd",
-            "python-pip", "nodejs", "npm"
-        ]
+        return "arch"
+    if system in ["ubuntu", "debian"]:
+        return "ubuntu"
+    print("Unknown system type. Please specify either arch or ubuntu")
+    sys.exit(1)
 
-        # Install zsh plugins separately to ensure they're found
-        print("\nInstalling zsh plugins...")
-        zsh_plugins = ["zsh-syntax-highlighting", "zsh-autosuggestions", "zsh-completions"]
-        subprocess.run(["sudo", "pacman", "-S", "--needed", "--noconfirm"] + zsh_plugins, check=True)
-
-        # Install zsh-autocomplete
-        autocomplete_dir = os.path.expanduser("~/.zsh/zsh-autocomplete")
-        if not os.path.exists(autocomplete_dir):
-            print("\nInstalling zsh-autocomplete...")
-            subprocess.run(["git", "clone", "--depth", "1",
-                          "https://github.com/marlonrichert/zsh-autocomplete.git",
-                          autocomplete_dir], check=True)
-
-        # Install core packages
-        core_packages = base_packages
-        
-        try:
-            # Update package database first
-            subprocess.run(["sudo", "pacman", "-Sy"], check=True)
-            
-            # Install all core packages in one command
-            print("Installing core packages...")
-            subprocess.run(["sudo", "pacman", "-S", "--needed", "--noconfirm"] + core_packages, check=True)
-            
-            # Check and install yay if needed
-            if not shutil.which("yay"):
-                print("\nInstalling yay AUR helper...")
-                with tempfile.TemporaryDirectory() as tmpdir:
-                    try:
-                        subprocess.run(["git", "clone", "https://aur.archlinux.org/yay.git", tmpdir], check=True)
-                        subprocess.run(["makepkg", "-si", "--noconfirm"], cwd=tmpdir, check=True)
-                        print("yay installed successfully")
-                    except subprocess.CalledProcessError:
-                        print("Failed to install yay. Please install it manually.")
-                        print("You can do this by running:")
-                        print("git clone https://aur.archlinux.org/yay.git")
-                        print("cd yay && makepkg -si")
-                        return
+def install_packages(system):
+    """
+    Install system packages based on the operating system.
+    The installed set is read once and every group is installed in a single
+    transaction; on a converged host the package manager is never invoked.
+    """
+    system = normalize_system(system)
+    groups = ARCH_PACKAGE_GROUPS if system == "arch" else UBUNTU_PACKAGE_GROUPS
+    total = len({pkg for _label, packages in groups for pkg in packages})
 
-            
-            # Install colorls gem with proper permissions
-            print("\nInstalling colorls gem...")
-            try:
-                subprocess.run(["gem", "install", "colorls", "--user-install"], check=True)
-                # Create bin directory if it doesn't exist
-                os.makedirs(os.path.expanduser("~/.local/share/gem/ruby/3.0.0/bin"), exist_ok=True)
-                print("colorls installed successfully")
-            except subprocess.CalledProcessError:
-                print("Failed to install colorls. You may need to install it manually with:")
-                print("gem install colorls --user-install")
-
-            # Check and install npm/node if needed
-            print("\nChecking npm/node installation...")
-            if not shutil.which("npm"):
-                print("Installing nodejs and npm...")
-                subprocess.run(["sudo", "pacman", "-S", "--needed", "--noconfirm", "nodejs", "npm"], check=True)
-                print("nodejs and npm installed successfully")
-            
-            # Set up npm global directory
-            npm_global_dir = os.path.expanduser("~/.npm-global")
-            if not os.path.exists(npm_global_dir):
-                print("\nConfiguring npm global directory...")
-                os.makedirs(npm_global_dir, exist_ok=True)
-                subprocess.run(["npm", "config", "set", "prefix", npm_global_dir], check=True)
-                
-                # Add npm-global/bin to PATH in zshrc if not already there
-                zshrc_path = os.path.expanduser("~/.zshrc")
-                if os.path.exists(zshrc_path):
-                    npm_path_line = f'export PATH="{npm_global_dir}/bin:$PATH"'
-                    with open(zshrc_path, "r") as f:
-                        if npm_path_line not in f.read():
-                            with open(zshrc_path, "a") as f:
-                                f.write(f"\n# NPM global packages\n{npm_path_line}\n")
-
-            # Ensure pyright is installed and executable
-            print("\nChecking pyright installation...")
-            pyright_bin = os.path.join(npm_global_dir, "bin", "pyright")
-            pyright_check = subprocess.run(["npm", "list", "-g", "pyright"], 
-                                         capture_output=True, text=True)
-            
-            if not os.path.exists(pyright_bin) or "pyright" not in pyright_check.stdout:
-                print("Installing pyright globally...")
-                try:
-                    subprocess.run(["npm", "install", "-g", "pyright"], check=True)
-                    # Ensure the binary is executable
-                    if os.path.exists(pyright_bin):
-                        os.chmod(pyright_bin, 0o755)
-                    print("pyright installed successfully")
-                    
-                    # Verify pyright is working
-                    subprocess.run([pyright_bin, "--version"], check=True)
-                    print("pyright is working correctly")
-                except subprocess.CalledProcessError as e:
-                    print(f"Error installing/running pyright: {e}")
-                    print("Please try installing manually with: npm install -g pyright")
-            else:
-                print("pyright is already installed")
-                try:
-                    # Ensure existing installation is executable
-                    if os.path.exists(pyright_bin):
-                        os.chmod(pyright_bin, 0o755)
-                    subprocess.run([pyright_bin, "--version"], check=True)
-                    print("pyright is working correctly")
-                except subprocess.CalledProcessError:
-                    print("pyright is installed but not working correctly")
-                    print("Try reinstalling with: npm install -g pyright")
-
-            # No services to configure for headless setup
+    missing = plan_packages(groups, installed_packages(system))
+    if not missing:
+        print(f"All {total} system packages are already installed")
+        return
 
-        except subprocess.CalledProcessError as e:
-            print(f"Error during installation: {e}")
-            print("Please check the error messages above and try to resolve any conflicts.")
-            
-    elif system in ["ubuntu", "debian"]:
+    if system == "arch":
+        print_step("Installing dependencies on Arch Linux")
+        config = pacman_config()
+    else:
         print_step("Installing dependencies on Ubuntu/Debian")
-        
-        # Update package lists
-        subprocess.run(["sudo", "apt-get", "update"], check=True)
-        
-        # Install essential packages first
-        print("Installing essential packages...")
-        essential_packages = ["zsh", "tmux"]
-        subprocess.run(["sudo", "apt-get", "install", "-y"] + essential_packages, check=True)
-        
-        # Base packages for headless environment
-        base_packages = [
-            "neovim", "curl", "git", "wget",
-            "ruby", "ruby-dev", "gcc",
-            "fonts-jetbrains-mono-nerd",
-            "python3-pip", "nodejs", "npm"
-        ]
+        config = contextlib.nullcontext()
+    with config as config_path:
+        refresh_package_index(system, config_path)
+        print(f"Installing {len(missing)} of {total} packages: {' '.join(missing)}")
+        process.run(install_command(system, missing, config_path), check=True)
 
-        # Install core packages
-        print("Installing core packages...")
-        subprocess.run(["sudo", "apt-get", "install", "-y"] + base_packages, check=True)
-        
-        # Install zsh plugins
-        print("\nInstalling zsh plugins...")
-        zsh_plugins = ["zsh-syntax-highlighting", "zsh-autosuggestions"]
-        subprocess.run(["sudo", "apt-get", "install", "-y"] + zsh_plugins, check=True)
-
-        # Install zsh-autocomplete
-        autocomplete_dir = os.path.expanduser("~/.zsh/zsh-autocomplete")
-        if not os.path.exists(autocomplete_dir):
-            print("\nInstalling zsh-autocomplete...")
-            subprocess.run(["git", "clone", "--depth", "1",
-                          "https://github.com/marlonrichert/zsh-autocomplete.git",
-                          autocomplete_dir], check=True)
-
-        # Set up npm global directory
-        npm_global_dir = os.path.expanduser("~/.npm-global")
-        if not os.path.exists(npm_global_dir):
-            print("\nConfiguring npm global directory...")
-            os.makedirs(npm_global_dir, exist_ok=True)
-            subprocess.run(["npm", "config", "set", "prefix", npm_global_dir], check=True)
-
-        # Install colorls gem
-        print("\nInstalling colorls gem...")
-        try:
-            subprocess.run(["gem", "install", "colorls", "--user-install"], check=True)
-            print("colorls installed successfully")
-        except subprocess.CalledProcessError:
-            print("Failed to install colorls. You may need to install it manually.")
-
-        # Install pyright
-        print("\nInstalling pyright...")
-        try:
-            subprocess.run(["npm", "install", "-g", "pyright"], check=True)
-            print("pyright installed successfully")
-        except subprocess.CalledProcessError:
-            print("Failed to install pyright. Please try manually: npm install -g pyright")
+def refresh_package_index(system, config_path=None):
+    """Refresh the package index unless it is younger than the TTL"""
+    name = "pacman -Sy" if system == "arch" else "apt-get update"
+    ttl = index_ttl()
+    age = index_age(system)
+    if offline.enabled():
+        reason = "offline mode"
+    elif age is not None and age < ttl:
+        reason = f"index refreshed {age / 60:.0f} min ago, TTL {ttl / 60:.0f} min"
     else:
-        print("Unknown system type. Please specify either arch or ubuntu")
+        started = time.monotonic()
+        process.run(refresh_command(system, config_path), check=True)
+        record_refresh(system, time.monotonic() - started)
+        return
+    last = last_refresh_seconds(system)
+    saved = f", saving about {last:.1f}s" if last else ""
+    print(f"Skipping {name} ({reason}{saved})")
+
+def clone_yay(build_dir):
+    """Clone the yay AUR helper sources into build_dir"""
+    if probe.which("yay"):
+        return
+    print("\nCloning yay AUR helper...")
+    gitcache.clone(YAY_URL, build_dir)
+
+def build_yay(build_dir):
+    """Build and install yay from sources cloned by clone_yay"""
+    if probe.which("yay"):
+        print("yay is already installed")
+        return
+    print("\nInstalling yay AUR helper...")
+    try:
+        process.run(["makepkg", "-si", "--noconfirm"], cwd=build_dir, check=True)
+        print("yay installed successfully")
+    except subprocess.CalledProcessError:
+        print("Failed to install yay. Please install it manually.")
+        print("You can do this by running:")
+        print("git clone https://aur.archlinux.org/yay.git")
+        print("cd yay && makepkg -si")
+        raise
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+
+def install_gems(repo_dir):
+    """Install the Ruby gems pinned in toolchain-lock.json for the current user"""
+    print("\nInstalling locked Ruby gems...")
+    try:
+        toolchain.install_gems(repo_dir)
+    except (OSError, ValueError, subprocess.CalledProcessError,
+            toolchain.ToolchainError, offline.OfflineError) as e:
+        print(f"Error installing gems: {e}")
         sys.exit(1)
 
-def ensure_line_in_file(file_path, line):
-    """
-    Helper function to ensure a given line is present in file_path.
-    If not, appends it.
-    """
+def configure_npm_prefix():
+    """Point npm's global prefix at ~/.npm-global"""
+    npm_global_dir = os.path.expanduser("~/.npm-global")
+    if not os.path.exists(npm_global_dir):
+        print("\nConfiguring npm global directory...")
+        os.makedirs(npm_global_dir, exist_ok=True)
+        process.run(["npm", "config", "set", "prefix", npm_global_dir], check=True)
+
+    # Add npm-global/bin to PATH in zshrc if not already there (again, after the zshrc was edited)
+    zshrc_path = os.path.expanduser("~/.zshrc")
+    if os.path.exists(zshrc_path):
+        npm_path_line = f'export PATH="{npm_global_dir}/bin:$PATH"'
+        snapshot.save(os.path.realpath(zshrc_path))
+        FileEditor(zshrc_path).managed_block("npm-global", ["# NPM global packages", npm_path_line]).apply()
+
+def install_npm_packages(repo_dir):
+    """Install the npm packages pinned in toolchain-lock.json into ~/.npm-global"""
+    print("\nInstalling locked npm packages...")
     try:
-        with open(file_path, "r+") as f:
-            content = f.read()
-            if line not in content:
-                f.write("\n" + line + "\n")
-                print(f"Appended line to {file_path}: {line}")
-            else:
-                print(f"Line already present in {file_path}: {line}")
-    except Exception as e:
-        print(f"Error updating {file_path}: {e}")
+        toolchain.install_npm_packages(repo_dir)
+    except (OSError, ValueError, subprocess.CalledProcessError, offline.OfflineError) as e:
+        print(f"Error installing npm packages: {e}")
+        sys.exit(1)
+
+    # Verify pyright is working; the answer is reused until the binary changes
+    pyright_bin = os.path.expanduser("~/.npm-global/bin/pyright")
+    if os.path.exists(pyright_bin):
+        pyright_version = probe.output([pyright_bin, "--version"])
+        if pyright_version:
+            print(f"pyright is working correctly ({pyright_version})")
+        else:
+            print("pyright is installed but not working correctly")
 
-def ensure_local_bin_in_zshrc(zshrc_path):
+def ensure_local_bin_in_zshrc(editor):
     local_bin_line = 'export PATH="$HOME/.local/bin:$PATH"'
-    ensure_line_in_file(zshrc_path, local_bin_line)
+    editor.ensure_line(local_bin_line, "local-bin")
 
-def clean_zshrc(zshrc_path):
+def clean_zshrc(editor):
     """Remove unwanted entries from zshrc"""
-    try:
-        with open(zshrc_path, "r") as f:
-            lines = f.readlines()
-        
-        # Filter out conda references and other unwanted lines
-        cleaned_lines = [line for line in lines if "conda" not in line]
-        
-        with open(zshrc_path, "w") as f:
-            f.writelines(cleaned_lines)
-        print("Cleaned up .zshrc file")
-    except Exception as e:
-        print(f"Error cleaning .zshrc: {e}")
+    # Filter out conda references and other unwanted lines
+    editor.remove_matching("conda")
 
-def ensure_ruby_gem_bin_in_zshrc(zshrc_path):
+def ensure_ruby_gem_bin_in_zshrc(editor):
     """
     Detects the Ruby gem bin directories and ensures they are added to the PATH
-    in the dotfile (the source for ~/.zshrc).
+    in the dotfile (the source for ~/.zshrc), inside a managed block.
     It uses two methods:
       1. The gem environment.
       2. Checks a local path under $HOME/.local/share/gem.
     """
+    gem_lines = []
+
     # First, try the gem environment.
-    try:
-        gem_dir = subprocess.check_output(["gem", "environment", "gemdir"]).decode().strip()
+    gem_dir = probe.output(["gem", "environment", "gemdir"], env_keys=["GEM_HOME"])
+    if gem_dir:
         gem_bin_dir = os.path.join(gem_dir, "bin")
-        line = f'export PATH="{gem_bin_dir}:$PATH"'
-        ensure_line_in_file(zshrc_path, line)
-        print(f"Added Ruby gems bin directory to PATH (from gem environment): {gem_bin_dir}")
-    except Exception as e:
-        print(f"Skipping gem environment PATH update: {e}")
+        gem_lines.append(f'export PATH="{gem_bin_dir}:$PATH"')
+        print(f"Adding Ruby gems bin directory to PATH (from gem environment): {gem_bin_dir}")
+    else:
+        print("Skipping gem environment PATH update: gem is not available")
 
     # Next, check for a local gem installation directory.
-    try:
-        # Determine Ruby version
-        ruby_version = subprocess.check_output(["ruby", "-e", "print RUBY_VERSION"]).decode().strip()
+    # Determine Ruby version
+    ruby_version = probe.output(["ruby", "-e", "print RUBY_VERSION"])
+    if ruby_version:
         local_gem_dir = os.path.join(os.path.expanduser("~"), ".local", "share", "gem", "ruby", ruby_version)
         local_gem_bin_dir = os.path.join(local_gem_dir, "bin")
         if os.path.isdir(local_gem_bin_dir):
-            line = f'export PATH="{local_gem_bin_dir}:$PATH"'
-            ensure_line_in_file(zshrc_path, line)
-            print(f"Added local Ruby gems bin directory to PATH: {local_gem_bin_dir}")
-    except Exception as e:
-        print(f"Skipping local gem PATH update: {e}")
+            gem_lines.append(f'export PATH="{local_gem_bin_dir}:$PATH"')
+            print(f"Adding local Ruby gems bin directory to PATH: {local_gem_bin_dir}")
+    else:
+        print("Skipping local gem PATH update: ruby is not available")
+
+    # gem's own gemdir is often the same local directory
+    editor.managed_block("ruby-gems", list(dict.fromkeys(gem_lines)))
 
 def create_symlinks(repo_dir, args):
     """Create symlinks for configuration files based on chosen environment"""
     home = os.path.expanduser("~")
     dotfiles_dir = os.path.join(repo_dir, "dotfiles")
-    config_dir = os.path.join(repo_dir, "config")
 
     # Verify that the dotfiles directory exists.
     if not os.path.isdir(dotfiles_dir):
         print(f"Error: {dotfiles_dir} does not exist. Please check your repository.")
         sys.exit(1)
     
-    # Create symlink for .zshrc.
-    zshrc_src = os.path.abspath(os.path.join(dotfiles_dir, "zshrc"))
-    zshrc_dest = os.path.join(home, ".zshrc")
-    if os.path.exists(zshrc_dest) or os.path.islink(zshrc_dest):
-        os.remove(zshrc_dest)
-    os.symlink(zshrc_src, zshrc_dest)
-    print(f"Created symlink: {zshrc_dest} -> {zshrc_src}")
-    
-    # Update and clean the source dotfile
-    ensure_local_bin_in_zshrc(zshrc_src)
-    ensure_ruby_gem_bin_in_zshrc(zshrc_src)
-    clean_zshrc(zshrc_src)
-    
-    # Create symlink for .tmux.conf.
-    tmux_src = os.path.abspath(os.path.join(dotfiles_dir, "tmux.conf"))
-    tmux_dest = os.path.join(home, ".tmux.conf")
-    if os.path.exists(tmux_dest) or os.path.islink(tmux_dest):
-        os.remove(tmux_dest)
-    os.symlink(tmux_src, tmux_dest)
-    print(f"Created symlink: {tmux_dest} -> {tmux_src}")
-    
-    # Install tmux plugin manager if not already installed
+    # Link everything links.json declares; correct links are left untouched
+    try:
+        links = plan_links(repo_dir)
+    except ManifestError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    counts = apply_links(home, links)
+    print(f"Symlinks: {counts['created']} created, {counts['updated']} updated, "
+          f"{counts['unchanged']} already correct")
+
+    # Update and clean the source dotfile in a single atomic write
+    zshrc_src = dict(links).get(".zshrc")
+    if zshrc_src:
+        editor = FileEditor(zshrc_src)
+        ensure_local_bin_in_zshrc(editor)
+        ensure_ruby_gem_bin_in_zshrc(editor)
+        clean_zshrc(editor)
+        try:
+            snapshot.save(zshrc_src)
+            if editor.apply():
+                print(f"Updated {zshrc_src}")
+            else:
+                print(f"{zshrc_src} is already up to date")
+        except OSError as e:
+            print(f"Error updating {zshrc_src}: {e}")
+
+def install_tpm():
+    """Install tmux plugin manager if not already installed"""
     tpm_dir = os.path.expanduser("~/.tmux/plugins/tpm")
     if not os.path.exists(tpm_dir):
         print("Installing Tmux Plugin Manager (TPM)")
-        subprocess.run(["git", "clone", "https://github.com/tmux-plugins/tpm", tpm_dir], check=True)
-    
-    # Source tmux config to load plugins
+        gitcache.clone(TPM_URL, tpm_dir)
+
+def source_tmux_config():
+    """Source tmux config to load plugins"""
     try:
-        subprocess.run(["tmux", "source", "~/.tmux.conf"], check=True)
+        process.run(["tmux", "source", os.path.expanduser("~/.tmux.conf")], check=True)
         print("Tmux configuration sourced successfully")
-    except subprocess.CalledProcessError:
+    except (subprocess.CalledProcessError, FileNotFoundError):
         print("Note: Run 'tmux source ~/.tmux.conf' after starting tmux to load plugins")
-
-    # Create symlink for Neovim config (placed in ~/.config/nvim).
-    nvim_src = os.path.abspath(os.path.join(config_dir, "nvim"))
-    nvim_dest = os.path.join(home, ".config", "nvim")
-    os.makedirs(os.path.join(home, ".config"), exist_ok=True)
-    if os.path.exists(nvim_dest) or os.path.islink(nvim_dest):
-        if os.path.islink(nvim_dest):
-            os.remove(nvim_dest)
-        else:
-            shutil.rmtree(nvim_dest)
-    os.symlink(nvim_src, nvim_dest)
-    print(f"Created symlink: {nvim_dest} -> {nvim_src}")
-
-    # No DE-specific symlinks needed for headless setup
+        return
+    # Plugins added to tmux.conf since the last run
+    install_plugins = os.path.expanduser("~/.tmux/plugins/tpm/bin/install_plugins")
+    if os.access(install_plugins, os.X_OK):
+        process.run([install_plugins], check=False)
 
 def set_default_shell(shell):
     if os.name != 'nt':
@@ -471,50 +464,66 @@ def set_default_shell(shell):
                 print(f"Default shell is already {shell}")
             else:
                 print_step(f"Changing default shell to {shell}")
-                subprocess.check_call(["chsh", "-s", shell])
+                process.check_call(["chsh", "-s", shell])
         except ImportError:
             print("Could not import pwd module, falling back to environment check")
             current_shell = os.environ.get("SHELL", "")
             if shell not in current_shell:
                 print_step(f"Changing default shell to {shell}")
-                subprocess.check_call(["chsh", "-s", shell])
+                process.check_call(["chsh", "-s", shell])
             else:
                 print(f"Default shell is already {shell}")
     else:
         print("Skipping default shell change on Windows.")
 
-def check_symlinks():
-    """Check all symlinks created by configs-cli"""
-    home = os.path.expanduser("~")
-    config_dir = os.path.join(home, ".config")
-    
-    # Define all expected symlinks
-    home_links = {
-        os.path.join(home, ".zshrc"): "zshrc",
-        os.path.join(home, ".tmux.conf"): "tmux.conf",
-    }
-    
-    config_links = {
-        os.path.join(config_dir, "nvim"): "nvim config"
-    }
-    
+def check_symlinks(repo_dir, homes=None, as_json=False, jobs=16):
+    """
+    Check the symlinks created by configs-cli in one or many home directories.
+    Links must point at the matching file in repo_dir, not just exist.
+    Returns True if every home is free of drift.
+    """
+    try:
+        links = plan_links(repo_dir)
+    except ManifestError as e:
+        print(f"Error: {e}")
+        return False
+    home_dirs = expand_homes(homes) if homes else [os.path.expanduser("~")]
+    reports = audit_homes(home_dirs, links, jobs=jobs)
+
+    if as_json:
+        print(json.dumps(audit_report(os.path.abspath(repo_dir), reports), indent=2))
+        return all(r["ok"] for r in reports)
+
     print_step("Checking symlinks status")
-    
-    def check_link_group(links, header):
-        print(f"\n{header}:")
-        for link_path, description in links.items():
-            if os.path.exists(link_path):
-                if os.path.islink(link_path):
-                    target = os.path.realpath(link_path)
-                    print(f"\033[92m✓\033[0m {description}: {link_path} -> {target}")
-                else:
-                    print(f"\033[93m⚠\033[0m {description}: {link_path} exists but is not a symlink")
+    symbols = {
+        "ok": "\033[92m✓\033[0m",
+        "missing": "\033[91m✗\033[0m",
+        "broken": "\033[91m✗\033[0m",
+        "not-symlink": "\033[93m⚠\033[0m",
+        "wrong-target": "\033[93m⚠\033[0m",
+    }
+    for report in reports:
+        # With many homes only the drifted ones are worth reading
+        if len(reports) > 1 and report["ok"]:
+            continue
+        print(f"\n{report['home']}:")
+        for link in report["links"]:
+            status = link["status"]
+            if status == "ok":
+                detail = f"-> {link['actual']}"
+            elif status == "missing":
+                detail = "does not exist"
+            elif status == "not-symlink":
+                detail = "exists but is not a symlink"
+            elif status == "wrong-target":
+                detail = f"-> {link['actual']} (expected {link['expected']})"
             else:
-                print(f"\033[91m✗\033[0m {description}: {link_path} does not exist")
-    
-    check_link_group(home_links, "Home directory symlinks")
-    check_link_group(config_links, "Config directory symlinks")
-    print()  # Add final newline for cleaner output
+                detail = f"-> {link['actual']} (target does not exist)"
+            print(f"{symbols[status]} {link['path']} {detail}")
+
+    drifted = sum(1 for r in reports if not r["ok"])
+    print(f"\n{len(reports) - drifted} of {len(reports)} home directories match {repo_dir}")
+    return drifted == 0
 
 def print_source_commands():
     home = os.path.expanduser("~")
@@ -531,11 +540,11 @@ def configure_keyboard(repo_dir):
     
     # Create directory if it doesn't exist
     if not os.path.exists(xorg_dir):
-        subprocess.run(["sudo", "mkdir", "-p", xorg_dir], check=True)
+        process.run(["sudo", "mkdir", "-p", xorg_dir], check=True)
     
     # Copy the keyboard configuration file
-    subprocess.run(["sudo", "cp", source_conf, keyboard_conf], check=True)
-    subprocess.run(["sudo", "chmod", "644", keyboard_conf], check=True)
+    process.run(["sudo", "cp", source_conf, keyboard_conf], check=True)
+    process.run(["sudo", "chmod", "644", keyboard_conf], check=True)
     
     print(f"Keyboard configuration copied to {keyboard_conf}")
 
@@ -545,25 +554,25 @@ def print_step(message):
     print(f">>> {message}")
     print("="*80 + "\n")
 
+# Define standard directories
+FILESYSTEM_DIRS = {
+    "Documents": ["Projects", "Work", "Personal"],
+    "Downloads": ["temp"],
+    "Pictures": ["screenshots", "wallpapers"],
+    "Videos": [],
+    ".config": [],
+    ".local/share": [],
+    ".local/bin": [],
+    ".cache": [],
+    "Github": []
+}
+
 def setup_filesystem():
     """Create standard filesystem structure"""
     home = os.path.expanduser("~")
     
-    # Define standard directories
-    dirs = {
-        "Documents": ["Projects", "Work", "Personal"],
-        "Downloads": ["temp"],
-        "Pictures": ["screenshots", "wallpapers"],
-        "Videos": [],
-        ".config": [],
-        ".local/share": [],
-        ".local/bin": [],
-        ".cache": [],
-        "Github": []
-    }
-    
     print_step("Setting up filesystem structure...")
-    for parent, subdirs in dirs.items():
+    for parent, subdirs in FILESYSTEM_DIRS.items():
         parent_path = os.path.join(home, parent)
         os.makedirs(parent_path, exist_ok=True)
         print(f"Created: {parent_path}")
@@ -575,32 +584,541 @@ def setup_filesystem():
     
     print("\nFilesystem structure created successfully!")
 
+def ensure_repo(repo, repo_url):
+    """Clone the configs repository if it doesn't exist yet"""
+    # If the repository doesn't exist, attempt to clone it if --repo-url is provided.
+    if not os.path.isdir(repo):
+        if repo_url:
+            print_step(f"Cloning repository from {repo_url}")
+            gitcache.clone(repo_url, repo)
+        else:
+            print(f"Error: repository directory {repo} does not exist. "
+                  f"Either clone it there or provide --repo-url to auto-clone it.")
+            sys.exit(1)
+
+def set_zsh_as_default_shell():
+    """Make zsh the login shell once it is installed"""
+    zsh_path = probe.which("zsh")
+    if zsh_path:
+        set_default_shell(zsh_path)
+    else:
+        print("zsh not found; please install it!")
+
+def filesystem_fingerprint():
+    home = os.path.expanduser("~")
+    paths = []
+    for parent, subdirs in FILESYSTEM_DIRS.items():
+        paths.append(os.path.join(home, parent))
+        paths.extend(os.path.join(home, parent, subdir) for subdir in subdirs)
+    if not all(os.path.isdir(path) for path in paths):
+        return None
+    return fingerprint(paths)
+
+def packages_fingerprint(system):
+    # The package database changes whenever anything is installed or removed
+    if system == "arch":
+        groups, database = ARCH_PACKAGE_GROUPS, "/var/lib/pacman/local"
+    else:
+        groups, database = UBUNTU_PACKAGE_GROUPS, "/var/lib/dpkg/status"
+    signature = path_signature(database)
+    if signature is None:
+        return None
+    return fingerprint(system, groups, signature)
+
+def mirrors_fingerprint(system):
+    # Re-rank once the cached ranking expires or someone edits the mirror file
+    entry = mirrors.cached_ranking(system)
+    signature = path_signature(mirrors.default_path(system))
+    if entry is None or signature is None:
+        return None
+    return fingerprint(entry["ranked_at"], signature)
+
+def toolchain_fingerprint(repo_dir, kind):
+    """Fingerprint the locked gems or npm packages, or None if one isn't at its version"""
+    try:
+        lock = toolchain.load_lock(repo_dir)
+    except (OSError, ValueError):
+        return None
+    user_dir = toolchain.gem_user_dir() if kind == "gem" and lock["gem"] else None
+    if any(missing_kind == kind for missing_kind, _name, _version in toolchain.missing(lock, user_dir)):
+        return None
+    return fingerprint(lock[kind], user_dir)
+
+def symlink_targets(repo_dir):
+    """Map each managed link to the repository file it should point at"""
+    home = os.path.expanduser("~")
+    return {os.path.join(home, rel_path): target for rel_path, target in plan_links(repo_dir)}
+
+def symlinks_fingerprint(repo_dir):
+    links = symlink_targets(repo_dir)
+    for dest, src in links.items():
+        if not os.path.islink(dest) or os.readlink(dest) != src:
+            return None
+    # The zshrc edits depend on the file itself and on which gem dirs exist
+    gem_dirs = sorted(glob.glob(os.path.expanduser("~/.local/share/gem/ruby/*/bin")))
+    zshrc_src = links.get(os.path.join(os.path.expanduser("~"), ".zshrc"))
+    return fingerprint(sorted(links.items()), zshrc_src and path_signature(zshrc_src), gem_dirs)
+
+def tmux_fingerprint():
+    tmux_conf = os.path.expanduser("~/.tmux.conf")
+    return exists_fingerprint(tmux_conf, os.path.realpath(tmux_conf),
+                              os.path.expanduser("~/.tmux/plugins/tpm"))
+
+def keyboard_fingerprint(repo_dir):
+    source_conf = os.path.join(repo_dir, "config/xorg/00-keyboard.conf")
+    keyboard_conf = "/etc/X11/xorg.conf.d/00-keyboard.conf"
+    digest = file_digest(source_conf)
+    if digest is None or digest != file_digest(keyboard_conf):
+        return None
+    return fingerprint(digest, oct(os.stat(keyboard_conf).st_mode & 0o777))
+
+def default_shell_fingerprint():
+    import pwd
+    zsh_path = probe.which("zsh")
+    if not zsh_path or pwd.getpwuid(os.getuid()).pw_shell != zsh_path:
+        return None
+    return fingerprint(zsh_path)
+
+def build_shell_fingerprint():
+    output = shellbuild.output_path()
+    if not os.path.exists(output):
+        return None
+    # Any input's mtime (or appearance) changing forces a re-render
+    inputs = shellbuild.shell_inputs()
+    return fingerprint([(path, path_signature(path)) for path in inputs], path_signature(output))
+
+def nvim_plugins_fingerprint(repo_dir):
+    config_dir = os.path.join(repo_dir, "config", "nvim")
+    heads = nvim.plugin_heads(config_dir)
+    if any(pinned != current for pinned, current in heads.values()):
+        return None
+    return fingerprint(file_digest(os.path.join(config_dir, "lazy-lock.json")), sorted(heads.items()))
+
+def nvim_parsers_fingerprint():
+    if not all(nvim.parser_installed(lang) for lang in nvim.TREESITTER_PARSERS):
+        return None
+    return exists_fingerprint(*(os.path.join(nvim.lazy_root(), "nvim-treesitter", "parser", f"{lang}.so")
+                                for lang in nvim.TREESITTER_PARSERS))
+
+def mason_fingerprint():
+    return exists_fingerprint(*(nvim.mason_package_dir(name) for name in nvim.MASON_PACKAGES))
+
+def yay_fingerprint():
+    yay_path = probe.which("yay")
+    return exists_fingerprint(yay_path) if yay_path else None
+
+def build_setup_steps(args):
+    """
+    Describe the setup pipeline as a dependency graph.
+    Network-bound clones only depend on the filesystem layout, so they overlap
+    with package installation; everything else waits on what it really needs.
+    Each step's fingerprint lets converged steps be skipped on re-runs.
+    """
+    home = os.path.expanduser("~")
+    system = normalize_system(args.system)
+    yay_dir = os.path.join(tempfile.gettempdir(), f"configs-cli-yay-{os.getpid()}")
+
+    steps = [
+        Step("filesystem", setup_filesystem, description="Set up filesystem structure",
+             fingerprint=filesystem_fingerprint),
+        Step("repo", lambda: ensure_repo(args.repo, args.repo_url), ["filesystem"],
+             description="Clone configs repository",
+             fingerprint=lambda: exists_fingerprint(args.repo)),
+        Step("packages", lambda: install_packages(system),
+             ["filesystem", "mirrors"] if args.rank_mirrors else ["filesystem"],
+             description="Install system packages",
+             fingerprint=lambda: packages_fingerprint(system)),
+        Step("catppuccin", install_catppuccin_theme, ["filesystem"],
+             description="Install Catppuccin syntax highlighting theme",
+             fingerprint=lambda: exists_fingerprint(
+                 os.path.join(home, ".zsh", "catppuccin-zsh-syntax-highlighting"),
+                 os.path.join(home, ".zsh", "catppuccin_mocha-zsh-syntax-highlighting.zsh"))),
+        Step("autocomplete", install_zsh_autocomplete, ["filesystem"],
+             description="Install zsh-autocomplete",
+             fingerprint=lambda: exists_fingerprint(os.path.join(home, ".zsh", "zsh-autocomplete"))),
+        Step("tpm", install_tpm, ["filesystem"],
+             description="Install Tmux Plugin Manager",
+             fingerprint=lambda: exists_fingerprint(os.path.join(home, ".tmux", "plugins", "tpm"))),
+        Step("oh-my-zsh", install_oh_my_zsh, ["packages"],
+             description="Install Oh My Zsh",
+             fingerprint=lambda: exists_fingerprint(os.path.join(home, ".oh-my-zsh", "oh-my-zsh.sh"))),
+        # The Oh My Zsh installer refuses to run into an existing ~/.oh-my-zsh
+        Step("autosuggestions", install_zsh_autosuggestions, ["oh-my-zsh"],
+             description="Install zsh-autosuggestions",
+             fingerprint=lambda: exists_fingerprint(
+                 os.path.join(home, ".oh-my-zsh", "custom", "plugins", "zsh-autosuggestions"))),
+        # Gems and npm packages come from different toolchains, so they install side by side
+        Step("gems", lambda: install_gems(args.repo), ["repo", "packages"],
+             description="Install locked Ruby gems",
+             fingerprint=lambda: toolchain_fingerprint(args.repo, "gem")),
+        # Appends to ~/.zshrc, which the symlink step replaces and edits
+        Step("npm-prefix", configure_npm_prefix, ["packages", "symlinks"],
+             description="Configure npm global directory",
+             fingerprint=lambda: exists_fingerprint(os.path.join(home, ".npm-global"))),
+        Step("npm-packages", lambda: install_npm_packages(args.repo), ["repo", "packages"],
+             description="Install locked npm packages",
+             fingerprint=lambda: toolchain_fingerprint(args.repo, "npm")),
+        # Oh My Zsh removes ~/.zshrc and the gem bin dir is probed, so link last
+        Step("symlinks", lambda: create_symlinks(args.repo, args), ["repo", "oh-my-zsh", "gems"],
+             description="Create symlinks",
+             fingerprint=lambda: symlinks_fingerprint(args.repo)),
+        Step("tmux-source", source_tmux_config, ["symlinks", "tpm"],
+             description="Source tmux configuration",
+             fingerprint=tmux_fingerprint),
+        Step("build-shell", shellbuild.build_shell,
+             ["symlinks", "npm-prefix", "packages", "catppuccin", "autocomplete", "autosuggestions"],
+             description="Render precompiled zshrc",
+             fingerprint=build_shell_fingerprint),
+        # Pre-warm Neovim so the first editor session doesn't block on installs
+        Step("nvim-plugins", lambda: nvim.sync_plugins(os.path.join(args.repo, "config", "nvim")),
+             ["symlinks", "packages"],
+             description="Sync Neovim plugins to lazy-lock.json",
+             fingerprint=lambda: nvim_plugins_fingerprint(args.repo)),
+        Step("nvim-parsers", nvim.install_parsers, ["nvim-plugins"],
+             description="Build treesitter parsers",
+             fingerprint=nvim_parsers_fingerprint),
+        Step("nvim-mason", nvim.install_mason_tools, ["nvim-plugins"],
+             description="Install Mason tools",
+             fingerprint=mason_fingerprint),
+        Step("keyboard", lambda: configure_keyboard(args.repo), ["repo"],
+             description="Configure keyboard",
+             fingerprint=lambda: keyboard_fingerprint(args.repo)),
+        Step("default-shell", set_zsh_as_default_shell, ["packages"],
+             description="Set default shell",
+             fingerprint=default_shell_fingerprint),
+    ]
+
+    if args.rank_mirrors:
+        steps.append(Step("mirrors", lambda: mirrors.rank_mirrors(system, args.rank_mirrors),
+                          ["filesystem"], description="Rank package mirrors",
+                          fingerprint=lambda: mirrors_fingerprint(system)))
+
+    if system == "arch":
+        steps += [
+            Step("yay-clone", lambda: clone_yay(yay_dir), ["filesystem"],
+                 description="Clone yay AUR helper",
+                 fingerprint=yay_fingerprint),
+            Step("yay", lambda: build_yay(yay_dir), ["packages", "yay-clone"],
+                 description="Install yay AUR helper",
+                 fingerprint=yay_fingerprint),
+        ]
+    return steps
+
+def print_plan(steps, state):
+    """Print which setup steps are up to date and which would run"""
+    stale = {step.name for step in plan_steps(steps, state)}
+    print_step("Setup plan")
+    for step in steps:
+        if step.name in stale:
+            print(f"\033[93m→\033[0m {step.description}: would run")
+        else:
+            print(f"\033[92m✓\033[0m {step.description}: up to date")
+    print(f"\n{len(stale)} of {len(steps)} steps would run")
+
+def bundle_git_urls(repo, repo_url=None):
+    """Every git repository setup clones, including the pinned Neovim plugins"""
+    urls = [CATPPUCCIN_URL, AUTOSUGGESTIONS_URL, AUTOCOMPLETE_URL, OH_MY_ZSH_REPO_URL,
+            TPM_URL, YAY_URL]
+    if repo_url:
+        urls.append(repo_url)
+    config_dir = os.path.join(repo, "config", "nvim")
+    try:
+        locked = nvim.load_lockfile(config_dir)
+    except (OSError, ValueError):
+        print(f"Warning: no lazy-lock.json in {config_dir}; Neovim plugins are not bundled")
+        return urls
+    plugin_urls = nvim.plugin_urls(config_dir)
+    urls += [plugin_urls[name] for name in sorted(locked) if name in plugin_urls]
+    return urls
+
+def create_bundle(args):
+    """Collect everything setup downloads into one offline bundle"""
+    repo = args.repo
+    if args.repo_url and not os.path.isdir(repo):
+        repo = os.path.join(tempfile.gettempdir(), f"configs-cli-bundle-repo-{os.getpid()}")
+        gitcache.clone(args.repo_url, repo)
+    try:
+        lock = toolchain.load_lock(repo)
+        bundle.create(args.output, bundle_git_urls(repo, args.repo_url),
+                      downloads=[(OH_MY_ZSH_INSTALLER_URLS, OH_MY_ZSH_INSTALLER_SHA256)],
+                      gems=[f"{name}:{version}" for name, version in sorted(lock["gem"].items())],
+                      npm_packages=[f"{name}@{version}" for name, version in sorted(lock["npm"].items())],
+                      jobs=args.jobs)
+    finally:
+        if repo != args.repo:
+            shutil.rmtree(repo, ignore_errors=True)
+
+def run_update(args):
+    """Fast-forward every managed checkout, then re-run the steps fed by what changed"""
+    checkouts = managed_checkouts(args.repo)
+    print_step(f"Checking {len(checkouts)} managed checkouts")
+    results = update.update_all(checkouts, args.jobs)
+    update.print_results(results)
+    failed = any(result["status"] == update.FAILED for result in results)
+
+    affected = {name for result in results for name in result["steps"]}
+    return rerun_steps(args, affected) and not failed
+
+
+def rerun_steps(args, affected):
+    """Run the affected setup steps (and whatever depends on them and is stale)"""
+    steps = build_setup_steps(args)
+    affected = sorted(set(affected) & {step.name for step in steps})
+    if not affected:
+        print("\nNo setup steps are affected")
+        return True
+    print_step(f"Re-running {', '.join(affected)}")
+    steps = subgraph(steps, affected)
+    state = StateStore()
+    # The affected steps run even if their fingerprint still matches; their dependents only if stale
+    for name in affected:
+        state.steps.pop(name, None)
+    try:
+        results = run_steps(steps, jobs=args.jobs, state=state)
+    finally:
+        state.dirty = True
+        state.save()
+    print_summary(steps, results)
+    return all(result in SUCCESS for result in results.values())
+
+
+def run_watch(args):
+    """Re-run the steps fed by each settled burst of edits in the configs repository"""
+    watcher = watch.open_watcher(args.repo, args.poll)
+    tracker = watch.Tracker(watcher, args.debounce)
+    print_step(f"Watching {os.path.abspath(args.repo)} ({watcher.kind}); press Ctrl-C to stop")
+    try:
+        while True:
+            changes = tracker.next_changes()
+            print()
+            for change, path in changes:
+                print(f"  {change} {path}")
+            affected = update.affected_steps(REPO_UPDATE_RULES, changes)
+            run = snapshot.begin("watch")
+            try:
+                rerun_steps(args, affected)
+            finally:
+                if run.finish():
+                    print(f"\nSnapshot {run.id} saved; undo with: configs-cli rollback {run.id}")
+                probe.save()
+                status.refresh_in_background(args.repo)
+                # What the steps wrote into the repository isn't another edit to react to
+                tracker.settle([entry["path"] for entry in run.entries])
+    except KeyboardInterrupt:
+        print("\nStopped watching")
+    finally:
+        watcher.close()
+
+
+def print_snapshots(store):
+    run_ids = store.run_ids()
+    if not run_ids:
+        print("No snapshots recorded yet")
+        return
+    print(f"{'RUN':<24} {'COMMAND':<10} {'CREATED':<20} PATHS")
+    for run_id in reversed(run_ids):
+        manifest = store.load_run(run_id)
+        print(f"{run_id:<24} {manifest['command']:<10} {manifest['created']:<20} "
+              f"{len(manifest['entries'])}")
+
+
+def rollback(run_id):
+    """Restore a snapshot; the rollback is itself snapshotted so it can be undone"""
+    run = snapshot.begin("rollback")
+    try:
+        manifest = snapshot.restore(run_id, run.store)
+    finally:
+        saved = run.finish()
+    print(f"Rolled back {len(manifest['entries'])} paths to their state before run {manifest['id']}")
+    if saved:
+        print(f"Undo with: configs-cli rollback {run.id}")
+
+
 def main():
-    print_step("Starting configs-cli setup tool")
     parser = argparse.ArgumentParser(
         description="Setup minimal headless development environment with zsh, neovim, and tmux"
     )
     subparsers = parser.add_subparsers(dest="command", required=True)
 
-    # Subcommand: setup
-    setup_parser = subparsers.add_parser("setup", help="Install dependencies and create symlinks")
-    setup_parser.add_argument("--system", required=True, choices=["arch", "ubuntu"],
-                              help="Specify the system type (arch or ubuntu)")
+    # Options shared by setup and plan
+    pipeline_parser = argparse.ArgumentParser(add_help=False)
+    pipeline_parser.add_argument("--system", required=True, choices=["arch", "ubuntu"],
+                                 help="Specify the system type (arch or ubuntu)")
     
     # Use CONFIGS_REPO environment variable if set; otherwise, default to ~/.configs
     default_repo = os.environ.get("CONFIGS_REPO", os.path.join(os.path.expanduser("~"), ".configs"))
-    setup_parser.add_argument("--repo", default=default_repo,
-                              help="Path to your configs repository (or set CONFIGS_REPO)")
-    setup_parser.add_argument("--repo-url", default=None,
-                              help="Git URL of your repository (if not already cloned)")
+    pipeline_parser.add_argument("--repo", default=default_repo,
+                                 help="Path to your configs repository (or set CONFIGS_REPO)")
+    pipeline_parser.add_argument("--repo-url", default=None,
+                                 help="Git URL of your repository (if not already cloned)")
+    pipeline_parser.add_argument("--rank-mirrors", nargs="?", type=int, const=5, default=None, metavar="N",
+                                 help="Probe package mirrors and use the fastest N before installing (default: 5)")
+
+    # Subcommand: setup
+    setup_parser = subparsers.add_parser("setup", parents=[pipeline_parser],
+                                         help="Install dependencies and create symlinks")
+    setup_parser.add_argument("--jobs", "-j", type=int, default=4,
+                              help="Number of setup steps to run in parallel (default: 4)")
+    setup_parser.add_argument("--force", action="store_true",
+                              help="Run every step even if its recorded state is up to date")
+    setup_parser.add_argument("--profile", nargs="?", const="configs-cli-trace.json", default=None,
+                              metavar="TRACE",
+                              help="Time every step and subprocess and write a Chrome trace "
+                                   "(default: configs-cli-trace.json)")
+    setup_parser.add_argument("--bundle", default=None, metavar="FILE",
+                              help="Install offline from a bundle made by 'bundle create' ('-' for stdin)")
+
+    # Subcommand: update
+    update_parser = subparsers.add_parser("update", parents=[pipeline_parser],
+                                          help="Fast-forward managed git checkouts and re-run affected steps")
+    update_parser.add_argument("--jobs", "-j", type=int, default=8,
+                               help="Number of checkouts fetched in parallel (default: 8)")
+
+    # Subcommand: watch
+    watch_parser = subparsers.add_parser("watch", parents=[pipeline_parser],
+                                         help="Re-apply configs repository edits as they are saved")
+    watch_parser.add_argument("--debounce", type=float, default=watch.DEFAULT_DEBOUNCE,
+                              help="Seconds the repository must be quiet before acting "
+                                   f"(default: {watch.DEFAULT_DEBOUNCE:g})")
+    watch_parser.add_argument("--poll", type=float, nargs="?", const=watch.DEFAULT_POLL_INTERVAL,
+                              default=None, metavar="SECONDS",
+                              help="Poll for changes instead of using inotify "
+                                   f"(default interval: {watch.DEFAULT_POLL_INTERVAL:g}s)")
+    watch_parser.add_argument("--jobs", "-j", type=int, default=4,
+                              help="Number of steps run in parallel (default: 4)")
+
+    # Subcommand: plan
+    subparsers.add_parser("plan", parents=[pipeline_parser],
+                          help="Show which setup steps would run, without applying them")
     
+    # Subcommand: build-shell
+    subparsers.add_parser("build-shell", help="Render and zcompile a static zshrc for this host")
+
+    # Subcommand: bench
+    bench_parser = subparsers.add_parser("bench", help="Benchmark zsh, nvim, tmux and prompt startup")
+    bench_parser.add_argument("--iterations", "-n", type=int, default=10,
+                              help="Timed runs per benchmark (default: 10)")
+    bench_parser.add_argument("--only", default=None,
+                              help="Comma-separated benchmarks to run: zsh, nvim, tmux, prompt (default: all)")
+    bench_parser.add_argument("--baseline", default=None,
+                              help="Baseline JSON file (default: ~/.local/state/configs-cli/bench-baseline.json)")
+    bench_parser.add_argument("--threshold", type=float, default=10.0,
+                              help="Fail if any p50 regresses by more than this percent (default: 10)")
+    bench_parser.add_argument("--update-baseline", action="store_true",
+                              help="Save this run as the new baseline instead of comparing")
+
+    # Subcommand: doctor
+    doctor_parser = subparsers.add_parser("doctor", help="Attribute zsh and nvim startup time to plugins")
+    doctor_parser.add_argument("--only", default=",".join(doctor.PROFILERS),
+                               help=f"Comma-separated tools to profile (default: {','.join(doctor.PROFILERS)})")
+    doctor_parser.add_argument("--iterations", "-n", type=int, default=3,
+                               help="Profiled startups per tool; the median is reported (default: 3)")
+    doctor_parser.add_argument("--top", type=int, default=15,
+                               help="Rows shown per table (default: 15)")
+    doctor_parser.add_argument("--json", action="store_true",
+                               help="Print every measurement as JSON")
+
+    # Subcommand: harness
+    harness_parser = subparsers.add_parser("harness",
+                                           help="Benchmark setup end to end against stand-in tools")
+    harness_parser.add_argument("--system", default="arch", choices=["arch", "ubuntu"],
+                                help="System type setup runs as (default: arch)")
+    harness_parser.add_argument("--scenarios", default=None,
+                                help="Comma-separated scenarios to run: fresh, converged, partial (default: all)")
+    harness_parser.add_argument("--repeat", "-n", type=int, default=3,
+                                help="Runs per scenario, each on a fresh home; medians are reported (default: 3)")
+    harness_parser.add_argument("--latencies", default=None, metavar="FILE",
+                                help="Tool latencies: a {tool: seconds} JSON file or a setup --profile trace")
+    harness_parser.add_argument("--latency-scale", type=float, default=1.0,
+                                help="Multiply every tool latency by this factor (default: 1)")
+    harness_parser.add_argument("--jobs", "-j", type=int, default=4,
+                                help="--jobs passed to setup (default: 4)")
+    harness_parser.add_argument("--keep", default=None, metavar="DIR",
+                                help="Build the hosts in DIR and keep them, logs and traces included")
+    harness_parser.add_argument("--json", action="store_true",
+                                help="Print every measurement as JSON")
+
+    # Subcommand: bundle
+    bundle_parser = subparsers.add_parser("bundle", help="Create offline provisioning bundles")
+    bundle_subparsers = bundle_parser.add_subparsers(dest="bundle_command", required=True)
+    bundle_create_parser = bundle_subparsers.add_parser(
+        "create", help="Collect everything setup downloads into one archive")
+    bundle_create_parser.add_argument("--output", "-o", default="configs-cli-bundle.tar.gz",
+                                      help="Bundle file to write, '-' for stdout "
+                                           "(default: configs-cli-bundle.tar.gz)")
+    bundle_create_parser.add_argument("--repo", default=default_repo,
+                                      help="Configs repository whose Neovim plugins are bundled")
+    bundle_create_parser.add_argument("--repo-url", default=None,
+                                      help="Also bundle this configs repository (cloned if --repo is missing)")
+    bundle_create_parser.add_argument("--jobs", "-j", type=int, default=8,
+                                      help="Number of git mirrors fetched in parallel (default: 8)")
+
+    # Subcommand: fleet
+    fleet_parser = subparsers.add_parser("fleet", help="Run setup on many hosts concurrently")
+    fleet_parser.add_argument("--inventory", required=True,
+                              help="File with one target per line (optionally transport:target)")
+    fleet_parser.add_argument("--system", choices=["arch", "ubuntu"],
+                              help="System type passed to setup on every host")
+    fleet_parser.add_argument("--repo", default=None,
+                              help="Path of the configs repository on the targets")
+    fleet_parser.add_argument("--repo-url", default=None,
+                              help="Git URL the targets clone the repository from")
+    fleet_parser.add_argument("--transport", default="ssh", choices=sorted(TRANSPORTS),
+                              help="Transport for targets without an explicit prefix (default: ssh)")
+    fleet_parser.add_argument("--concurrency", type=int, default=8,
+                              help="Maximum number of hosts provisioned at once (default: 8)")
+    fleet_parser.add_argument("--command", dest="remote_command", default=None,
+                              help="Run this command on each target instead of configs-cli setup")
+
+    # Subcommand: stamp
+    stamp_parser = subparsers.add_parser("stamp", help="Copy a provisioned home directory to other users")
+    stamp_parser.add_argument("--template", required=True,
+                              help="Home directory already provisioned by setup")
+    stamp_parser.add_argument("--users", nargs="+", default=[], metavar="USER",
+                              help="Accounts whose home directories are stamped (and chowned to them)")
+    stamp_parser.add_argument("--homes", nargs="+", default=[], metavar="DIR",
+                              help="Directories to stamp as they are, without changing ownership")
+    stamp_parser.add_argument("--exclude", action="append", default=[], metavar="PATH",
+                              help="Path relative to the template not to copy (repeatable)")
+    stamp_parser.add_argument("--jobs", "-j", type=int, default=8,
+                              help="Number of homes stamped in parallel (default: 8)")
+
     # Subcommand: check
-    subparsers.add_parser("check", help="Check status of all config symlinks")
+    check_parser = subparsers.add_parser("check", help="Check status of all config symlinks")
+    check_parser.add_argument("--repo", default=default_repo,
+                              help="Configs repository the links should point into (or set CONFIGS_REPO)")
+    check_parser.add_argument("--homes", nargs="+", default=None, metavar="HOMES",
+                              help="Home directories to audit: globs or comma-separated lists "
+                                   "(default: the current user's home)")
+    check_parser.add_argument("--json", action="store_true",
+                              help="Print a machine-readable JSON report")
+    check_parser.add_argument("--jobs", "-j", type=int, default=16,
+                              help="Number of home directories scanned in parallel (default: 16)")
     
+    # Subcommand: status
+    status_parser = subparsers.add_parser("status", help="Show drift between this home and the configs repo")
+    status_parser.add_argument("--repo", default=default_repo,
+                               help="Configs repository to compare against (or set CONFIGS_REPO)")
+    status_parser.add_argument("--prompt", action="store_true",
+                               help="Print a short segment for a shell prompt from the cached status")
+    status_parser.add_argument("--refresh", action="store_true",
+                               help="Recompute the status now instead of reading the cached one")
+
+    # Subcommand: rollback
+    rollback_parser = subparsers.add_parser("rollback", help="Restore files overwritten by a setup run")
+    rollback_parser.add_argument("run_id", nargs="?", default=None,
+                                 help="Snapshot to restore (default: the most recent one)")
+    rollback_parser.add_argument("--list", action="store_true",
+                                 help="List recorded snapshots instead of restoring one")
+
     # Subcommand: help
     help_parser = subparsers.add_parser("help", help="Show detailed help information")
     
     args = parser.parse_args()
+    # JSON reports and bundles streamed to stdout must not be mixed with the banner
+    if (not getattr(args, "json", False) and getattr(args, "output", None) != "-"
+            and not getattr(args, "prompt", False)):
+        print_step("Starting configs-cli setup tool")
 
     if args.command == "help":
         print("""
@@ -616,13 +1134,130 @@ Commands:
     --system    Required. Specify 'arch' or 'ubuntu'
     --repo      Path to configs repository (default: ~/.configs)
     --repo-url  Git URL to clone if repo doesn't exist
+    --jobs N    Run up to N independent setup steps in parallel (default: 4)
+    --force     Run every step even if its recorded state is up to date
+    --rank-mirrors [N]
+                Probe the mirrors in pacman's mirrorlist (or apt's sources and
+                Ubuntu's mirror list) and write the fastest N (apt: the
+                fastest) back before installing packages; reused for 24 hours
+    --profile [TRACE]
+                Time every step and subprocess, write a Chrome trace JSON
+                (default: configs-cli-trace.json) and print a summary table
+    --bundle FILE
+                Install without network access from a bundle made by
+                'bundle create' ('-' reads it from stdin)
+
+  update  Fast-forward the checkouts setup created (Oh My Zsh, zsh plugins,
+          TPM, the configs repository) and re-run only the steps fed by
+          the files that changed, e.g. re-copy the Catppuccin theme or
+          re-source tmux. Unchanged checkouts cost one 'git ls-remote'.
+    (takes the same --system/--repo options as setup)
+    --jobs N    Fetch N checkouts in parallel (default: 8)
+
+  watch   Watch the configs repository and re-run only what each edit needs:
+          tmux.conf re-sources tmux (installing new TPM plugins), zshrc
+          restores the npm PATH block and rebuilds the precompiled shell,
+          00-keyboard.conf is copied into place, added or removed dotfiles
+          are linked. Editor save bursts are debounced.
+    (takes the same --system/--repo options as setup)
+    --debounce S   Wait until the repository is quiet for S seconds (default: 0.3)
+    --poll [S]     Poll every S seconds instead of using inotify (default: 1)
+
+  plan    Show which setup steps would run, without applying them
+    (takes the same --system/--repo options as setup)
+
+  build-shell
+          Render ~/.zshrc with its plugin checks, DOTFILES_DIR and secrets.env
+          resolved for this host into ~/.local/share/configs-cli/zshrc.zsh
+          (mode 0600) and zcompile it. Setup re-runs it when an input changes.
+
+  bench   Benchmark startup of zsh -i, headless nvim, a throwaway tmux server
+          and 'status --prompt'
+    --iterations N     Timed runs per benchmark (default: 10)
+    --only LIST        Comma-separated subset of zsh,nvim,tmux,prompt
+    --baseline FILE    Baseline JSON (default: ~/.local/state/configs-cli/bench-baseline.json)
+    --threshold PCT    Exit non-zero if a p50 regresses by more than PCT (default: 10)
+    --update-baseline  Save this run as the baseline
+    The first run saves the baseline; later runs are compared against it.
+    The prompt benchmark also fails whenever its p50 is over a fixed 50ms.
+
+  doctor  Profile zsh and nvim startup and rank what it is spent on
+    --only LIST        Comma-separated subset of zsh,nvim
+    --iterations N     Profiled startups per tool, median reported (default: 3)
+    --top N            Rows per table (default: 15)
+    --json             Print every measurement as JSON
+    zsh is traced with zprof and timestamped xtrace (cost per zshrc section,
+    per sourced plugin and per function); nvim with --startuptime and
+    lazy.nvim's load times (cost per plugin and startup phase).
+
+  harness Run setup end to end in throwaway homes, against stand-ins for
+          pacman, apt-get, npm, gem, nvim and friends and file:// git fixtures
+    --system           System type setup runs as (default: arch)
+    --scenarios LIST   Comma-separated subset of fresh,converged,partial
+    --repeat N         Runs per scenario, medians reported (default: 3)
+    --latencies FILE   {tool: seconds} JSON, or a setup --profile trace to replay
+    --latency-scale X  Multiply every tool latency by X (default: 1)
+    --jobs N           --jobs passed to setup (default: 4)
+    --keep DIR         Keep the hosts, setup logs and traces in DIR
+    --json             Print every measurement as JSON
+    Reports wall time, steps run and subprocesses per scenario, and the
+    median time of every step.
+
+  bundle create
+          Collect every git repository, the Oh My Zsh installer, the gems
+          (with dependencies) and npm packages pinned in toolchain-lock.json
+          into one archive
+    --output FILE      Bundle to write, '-' for stdout (default: configs-cli-bundle.tar.gz)
+    --repo             Repository whose lazy-lock.json plugins are bundled
+    --repo-url         Also bundle the configs repository itself
+    --jobs N           Fetch N git mirrors in parallel (default: 8)
+
+  fleet   Run setup on many hosts concurrently
+    --inventory FILE   One target per line; prefix with local:, chroot: or ssh:
+                       to pick a transport per target
+    --system           System type passed to setup on every host
+    --repo/--repo-url  Repository options passed to setup on every host
+    --transport        Default transport: ssh, local or chroot (default: ssh)
+    --concurrency N    Provision at most N hosts at once (default: 8)
+    --command CMD      Run CMD on each target instead of configs-cli setup
     
+  stamp   Copy a home directory provisioned by setup into other homes
+    --template DIR     The provisioned home
+    --users USER...    Stamp these accounts' homes and chown the copies to them
+    --homes DIR...     Stamp plain directories, keeping the current ownership
+    --exclude PATH     Also skip PATH (relative to the template); repeatable
+    --jobs N           Stamp N homes in parallel (default: 8)
+    Plugin checkouts, Oh My Zsh, gems and parsers are reflinked or hardlinked;
+    paths naming the template home are rewritten; secrets and history are skipped.
+
   check   Check status of all config symlinks
+    --repo      Repository the links should point into (default: $CONFIGS_REPO or ~/.configs)
+    --homes     Audit many home directories (globs or comma-separated lists)
+    --json      Print a machine-readable JSON report
+    --jobs N    Scan N home directories in parallel (default: 16)
+
+  status  Show how far this home has drifted from the configs repository:
+          commits behind upstream, missing or wrong links, modified files
+    --repo      Repository to compare against (default: $CONFIGS_REPO or ~/.configs)
+    --prompt    Print a short segment for a shell prompt (e.g. ⇣2 ✗1); reads
+                a status file that setup, update and check refresh in the
+                background, without loading the rest of configs-cli
+    --refresh   Recompute the status now
     
+  rollback [RUN]
+          Put back every file, directory and symlink a setup run replaced
+          (default: the most recent run). Setup snapshots what it overwrites
+          into ~/.local/state/configs-cli/snapshots and keeps the last 10 runs.
+    --list      List recorded snapshots
+
   help    Show this help message
 
 Environment Variables:
-  CONFIGS_REPO  Set default repository path
+  CONFIGS_REPO       Set default repository path
+  CONFIGS_CLI_STATE  Path of the setup state file
+                     (default: ~/.local/state/configs-cli/state.json)
+  CONFIGS_CLI_SNAPSHOTS      Snapshot store directory
+  CONFIGS_CLI_SNAPSHOT_KEEP  Number of snapshots kept (default: 10)
 
 Quick Start:
   1. Clone your configs repository:
@@ -639,38 +1274,204 @@ Quick Start:
         return
 
     if args.command == "setup":
-        # Set up filesystem structure first
-        setup_filesystem()
-        
-        # If the repository doesn't exist, attempt to clone it if --repo-url is provided.
-        if not os.path.isdir(args.repo):
-            if args.repo_url:
-                print_step(f"Cloning repository from {args.repo_url}")
-                subprocess.check_call(["git", "clone", args.repo_url, args.repo])
-            else:
-                print(f"Error: repository directory {args.repo} does not exist. "
-                      f"Either clone it there or provide --repo-url to auto-clone it.")
+        profiler = profiling.start() if args.profile else None
+        if args.bundle:
+            print_step(f"Importing offline bundle {args.bundle}")
+            offline.enable()
+            try:
+                bundle.extract(args.bundle)
+            except bundle.BundleError as e:
+                print(f"Error: {e}")
                 sys.exit(1)
-        install_dependencies(args.system, args)
-        if args.system != "windows":
-            install_oh_my_zsh()
-        create_symlinks(args.repo, args)
-        if args.system != "windows":
-            # Configure keyboard before shell changes
-            if args.system in ["arch", "ubuntu"]:  # Only for Linux systems
-                configure_keyboard(args.repo)
-            
-            zsh_path = shutil.which("zsh")
-            if zsh_path:
-                set_default_shell(zsh_path)
+        steps = build_setup_steps(args)
+        state = StateStore()
+        if args.force:
+            state.steps = {}
+        run = snapshot.begin("setup")
+        try:
+            results = run_steps(steps, jobs=args.jobs, state=state)
+        finally:
+            state.save()
+            probe.save()
+            status.refresh_in_background(args.repo)
+            if run.finish():
+                print(f"\nSnapshot {run.id} saved ({len(run.entries)} paths); "
+                      f"undo with: configs-cli rollback {run.id}")
+            run.store.prune()
+        print_summary(steps, results)
+        if profiler:
+            profiler.print_summary()
+            profiler.write_trace(args.profile)
+            print(f"\nTrace written to {args.profile} (open in chrome://tracing or Perfetto)")
+        if any(result not in SUCCESS for result in results.values()):
+            sys.exit(1)
+    elif args.command == "update":
+        run = snapshot.begin("update")
+        try:
+            succeeded = run_update(args)
+        except offline.OfflineError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        finally:
+            if run.finish():
+                print(f"\nSnapshot {run.id} saved; undo with: configs-cli rollback {run.id}")
+            probe.save()
+            status.refresh_in_background(args.repo)
+        if not succeeded:
+            sys.exit(1)
+    elif args.command == "watch":
+        run_watch(args)
+    elif args.command == "plan":
+        print_plan(build_setup_steps(args), StateStore())
+    elif args.command == "build-shell":
+        shellbuild.build_shell()
+    elif args.command == "bench":
+        # Imported here so no other command pays for the bench tooling
+        from configs_cli import bench
+        only = args.only or ",".join(bench.BENCHMARKS)
+        args.baseline = args.baseline or os.path.expanduser(bench.DEFAULT_BASELINE)
+        names = [name.strip() for name in only.split(",") if name.strip()]
+        unknown = [name for name in names if name not in bench.BENCHMARKS]
+        if unknown:
+            print(f"Error: unknown benchmark(s): {', '.join(unknown)}")
+            sys.exit(1)
+        results = {}
+        for name in names:
+            print(f"Benchmarking {name} ({args.iterations} iterations)...")
+            stats = bench.run_benchmark(name, args.iterations)
+            if stats:
+                results[name] = stats
+        baseline = None if args.update_baseline else bench.load_baseline(args.baseline)
+        bench.print_results(results, baseline)
+        overruns = bench.over_budget(results)
+        for name, budget, p50 in overruns:
+            print(f"\033[91m✗\033[0m {name}: p50 {p50:.2f}ms is over its {budget}ms budget")
+        if baseline is None:
+            bench.save_baseline(args.baseline, results)
+            print(f"\nBaseline saved to {args.baseline}")
+            if overruns:
+                sys.exit(1)
+        else:
+            regressions = bench.compare(results, baseline, args.threshold)
+            for name, before, after, change in regressions:
+                print(f"\033[91m✗\033[0m {name}: p50 {before:.2f}ms -> {after:.2f}ms "
+                      f"({change:+.1f}%, threshold {args.threshold:g}%)")
+            if regressions or overruns:
+                sys.exit(1)
+            print(f"\nNo regressions over {args.threshold:g}% against {args.baseline}")
+    elif args.command == "doctor":
+        names = [name.strip() for name in args.only.split(",") if name.strip()]
+        unknown = [name for name in names if name not in doctor.PROFILERS]
+        if unknown:
+            print(f"Error: unknown tool(s): {', '.join(unknown)}")
+            sys.exit(1)
+        if args.json:
+            with contextlib.redirect_stdout(sys.stderr):
+                rows = doctor.diagnose(names, args.iterations)
+            print(json.dumps(rows, indent=2))
+        else:
+            doctor.print_report(doctor.diagnose(names, args.iterations), args.top)
+    elif args.command == "harness":
+        # Imported here, like bench, so no other command pays for it
+        from configs_cli import harness
+        scenarios = args.scenarios or ",".join(harness.SCENARIOS)
+        names = [name.strip() for name in scenarios.split(",") if name.strip()]
+        unknown = [name for name in names if name not in harness.SCENARIOS]
+        if unknown:
+            print(f"Error: unknown scenario(s): {', '.join(unknown)}")
+            sys.exit(1)
+        try:
+            latencies = harness.load_latencies(args.latencies) if args.latencies else harness.DEFAULT_LATENCIES
+        except (OSError, ValueError) as e:
+            print(f"Error reading latencies: {e}")
+            sys.exit(1)
+        latencies = {tool: seconds * args.latency_scale for tool, seconds in latencies.items()}
+        try:
+            if args.json:
+                with contextlib.redirect_stdout(sys.stderr):
+                    results = harness.run_scenarios(names, args.system, args.repeat, latencies,
+                                                    args.jobs, args.keep)
+                print(json.dumps(results, indent=2))
             else:
-                print("zsh not found; please install it!")
+                results = harness.run_scenarios(names, args.system, args.repeat, latencies,
+                                                args.jobs, args.keep)
+                harness.print_results(results)
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+    elif args.command == "bundle":
+        try:
+            create_bundle(args)
+        except (OSError, ValueError, bundle.BundleError, DownloadError, subprocess.CalledProcessError) as e:
+            print(f"Error creating bundle: {e}", file=sys.stderr)
+            sys.exit(1)
+    elif args.command == "fleet":
+        if args.remote_command:
+            command = shlex.split(args.remote_command)
+        elif args.system:
+            command = ["configs-cli", "setup", "--system", args.system]
+            if args.repo:
+                command += ["--repo", args.repo]
+            if args.repo_url:
+                command += ["--repo-url", args.repo_url]
         else:
-            print("Default shell change skipped on Windows.")
+            print("Error: fleet needs --system (or --command)")
+            sys.exit(1)
+        transports = load_inventory(args.inventory, args.transport)
+        if not transports:
+            print(f"Error: no targets found in {args.inventory}")
+            sys.exit(1)
+        print_step(f"Provisioning {len(transports)} hosts, {args.concurrency} at a time")
+        results = asyncio.run(run_fleet(transports, command, args.concurrency))
+        if not print_fleet_summary(results):
+            sys.exit(1)
     elif args.command == "source":
         print_source_commands()
-    elif args.command == "check-links":
-        check_symlinks()
+    elif args.command == "check":
+        status.refresh_in_background(args.repo)
+        if not check_symlinks(args.repo, args.homes, args.json, args.jobs):
+            sys.exit(1)
+    elif args.command == "status":
+        if args.prompt:
+            sys.exit(status.prompt())
+        fields, watches = status.read()
+        if (args.refresh or fields is None or fields.get("repo") != os.path.abspath(args.repo)
+                or status.is_stale(watches)):
+            fields = status.refresh(args.repo)
+        print(f"Repository:     {fields['repo']}")
+        print(f"Behind:         {fields['behind']} commits")
+        print(f"Drifted links:  {fields['links']}")
+        print(f"Modified files: {fields['modified']}")
+        print(f"Checked:        {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(int(fields['refreshed'])))}")
+        if status.segment(fields):
+            sys.exit(1)
+    elif args.command == "stamp":
+        try:
+            targets = stamp.resolve_targets(args.users, args.homes)
+            if not targets:
+                raise ValueError("nothing to stamp; pass --users or --homes")
+            run = snapshot.begin("stamp")
+            try:
+                results = stamp.stamp(args.template, targets, args.jobs, args.exclude)
+            finally:
+                run.finish()
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        failed = {label: error for label, error in results.items() if isinstance(error, Exception)}
+        for label, error in failed.items():
+            print(f"\033[91m✗\033[0m {label}: {error}")
+        if failed:
+            sys.exit(1)
+    elif args.command == "rollback":
+        if args.list:
+            print_snapshots(snapshot.Store())
+            return
+        try:
+            rollback(args.run_id)
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+            sys.exit(1)
 
 if __name__ == "__main__":
     main()
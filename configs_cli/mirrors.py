@@ -0,0 +1,261 @@
+"""
+Mirror ranking for the system package manager.
+Candidate mirrors are read from pacman's mirrorlist (commented-out servers
+included) or apt's sources, plus Ubuntu's geo-located mirror list. All of them
+are probed at once: the time to the first response byte plus the time to pull
+a small sample of a real index file. The fastest are written back in ranked
+order after the original is backed up, and the ranking is cached so repeated
+runs within the TTL don't probe again.
+"""
+import hashlib
+import json
+import os
+import platform
+import re
+import shutil
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from configs_cli import offline, process
+from configs_cli.fileedit import BLOCK_BEGIN, BLOCK_END, atomic_write
+
+ARCH_MIRRORLIST = "/etc/pacman.d/mirrorlist"
+APT_SOURCES = "/etc/apt/sources.list"
+APT_DEB822_SOURCES = "/etc/apt/sources.list.d/ubuntu.sources"
+UBUNTU_MIRRORS_URL = "http://mirrors.ubuntu.com/mirrors.txt"
+DEFAULT_CACHE_FILE = os.path.join("~", ".cache", "configs-cli", "mirrors.json")
+DEFAULT_TTL_HOURS = 24
+SAMPLE_BYTES = 256 * 1024
+PROBE_TIMEOUT = 5
+RANKED_BLOCK = "ranked mirrors"
+
+_ARCH_SERVER = re.compile(r"^\s*#?\s*Server\s*=\s*(\S+)")
+_APT_LINE = re.compile(r"^(\s*deb(?:-src)?\s+(?:\[[^\]]*\]\s+)?)(\S+)(\s+(\S+).*)$")
+_DEB822_URIS = re.compile(r"^(URIs:\s*)(\S+)(.*)$")
+_DEB822_SUITES = re.compile(r"^Suites:\s*(\S+)")
+
+
+def cache_file():
+    """Return the ranking cache path (CONFIGS_CLI_MIRROR_CACHE overrides the default)"""
+    return os.path.expanduser(os.environ.get("CONFIGS_CLI_MIRROR_CACHE", DEFAULT_CACHE_FILE))
+
+
+def ttl_seconds():
+    """How long a ranking is reused (CONFIGS_CLI_MIRROR_TTL_HOURS overrides the default)"""
+    return float(os.environ.get("CONFIGS_CLI_MIRROR_TTL_HOURS", DEFAULT_TTL_HOURS)) * 3600
+
+
+def default_path(system):
+    if system == "arch":
+        return ARCH_MIRRORLIST
+    # Ubuntu 24.04 and later keep the archive in a deb822 file instead of sources.list
+    return APT_DEB822_SOURCES if os.path.exists(APT_DEB822_SOURCES) else APT_SOURCES
+
+
+def _is_primary(uri):
+    # Security updates only come from the security archive; it is never swapped out
+    return "security." not in uri
+
+
+def arch_candidates(text):
+    """Return {mirror URL: probe URL} for every Server line, commented or not"""
+    found = {}
+    for line in text.splitlines():
+        match = _ARCH_SERVER.match(line)
+        if match:
+            url = match.group(1)
+            probe_url = url.replace("$repo", "core").replace("$arch", platform.machine())
+            found.setdefault(url, f"{probe_url.rstrip('/')}/core.db")
+    return found
+
+
+def apt_primary(text):
+    """Return (archive URI, suite) of the first non-security apt source, or (None, None)"""
+    suite = None
+    for line in text.splitlines():
+        match = _APT_LINE.match(line)
+        if match and _is_primary(match.group(2)):
+            return match.group(2), match.group(4)
+        suite_match = _DEB822_SUITES.match(line)
+        if suite_match:
+            suite = suite_match.group(1)
+    for line in text.splitlines():
+        match = _DEB822_URIS.match(line)
+        if match and _is_primary(match.group(2)):
+            return match.group(2), suite
+    return None, None
+
+
+def apt_candidates(text, extra=()):
+    """Return {archive URI: probe URL} for the configured archive plus extra mirrors"""
+    primary, suite = apt_primary(text)
+    if primary is None or suite is None:
+        return {}
+    return {uri: f"{uri.rstrip('/')}/dists/{suite}/Release"
+            for uri in dict.fromkeys([primary, *extra])}
+
+
+def ubuntu_mirror_list(timeout=PROBE_TIMEOUT):
+    """Ubuntu's list of mirrors near this host, or [] if it can't be fetched"""
+    try:
+        with urllib.request.urlopen(UBUNTU_MIRRORS_URL, timeout=timeout) as response:
+            return [line.strip() for line in response.read().decode().splitlines()
+                    if line.strip().startswith(("http://", "https://"))]
+    except (urllib.error.URLError, OSError, ValueError):
+        return []
+
+
+def probe_mirror(url, timeout=PROBE_TIMEOUT, sample_bytes=SAMPLE_BYTES):
+    """
+    Return the estimated seconds to fetch sample_bytes from url (latency to
+    the first response plus the sample at the measured rate), or None if the
+    mirror failed.
+    """
+    request = urllib.request.Request(url, headers={"User-Agent": "configs-cli"})
+    started = time.monotonic()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            latency = time.monotonic() - started
+            received = len(response.read(sample_bytes))
+    except (urllib.error.URLError, OSError, ValueError):
+        return None
+    transfer = time.monotonic() - started - latency
+    if received == 0:
+        return None
+    # Small index files are scaled up, so every mirror is scored on the same sample size
+    return latency + transfer * sample_bytes / received
+
+
+def rank(candidates, jobs=16, timeout=PROBE_TIMEOUT):
+    """Probe {mirror: probe URL} concurrently; return [(mirror, seconds)] fastest first"""
+    if not candidates:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(candidates)))) as pool:
+        scores = dict(zip(candidates, pool.map(lambda url: probe_mirror(url, timeout),
+                                               candidates.values())))
+    return sorted(((mirror, score) for mirror, score in scores.items() if score is not None),
+                  key=lambda item: item[1])
+
+
+def render_arch(text, ranked_urls):
+    """The mirrorlist with a block of ranked servers first and every other server commented out"""
+    begin, end = BLOCK_BEGIN.format(name=RANKED_BLOCK), BLOCK_END.format(name=RANKED_BLOCK)
+    lines = [begin, *(f"Server = {url}" for url in ranked_urls), end]
+    in_block = False
+    for line in text.splitlines():
+        # The block written by an earlier ranking is replaced
+        if line == begin:
+            in_block = True
+        elif line == end:
+            in_block = False
+        elif not in_block:
+            if _ARCH_SERVER.match(line) and not line.lstrip().startswith("#"):
+                line = f"#{line}"
+            lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def render_apt(text, fastest):
+    """The sources with the archive URI (not the security archive) replaced by fastest"""
+    primary, _suite = apt_primary(text)
+    lines = []
+    for line in text.splitlines():
+        for pattern in (_APT_LINE, _DEB822_URIS):
+            match = pattern.match(line)
+            if match and match.group(2) == primary:
+                line = line[:match.start(2)] + fastest + line[match.end(2):]
+                break
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def _install(path, data):
+    """Back up path and replace it with data, through sudo if it isn't ours to write"""
+    backup = f"{path}.pre-configs-cli-{time.strftime('%Y%m%d%H%M%S')}"
+    if os.access(os.path.dirname(path), os.W_OK) and os.access(path, os.W_OK):
+        shutil.copy2(path, backup)
+        atomic_write(path, data)
+        return backup
+    with tempfile.NamedTemporaryFile(prefix="configs-cli-mirrors-") as tmp:
+        tmp.write(data)
+        tmp.flush()
+        process.run(["sudo", "cp", "-p", path, backup], check=True)
+        process.run(["sudo", "install", "-m", "644", tmp.name, path], check=True)
+    return backup
+
+
+def _load_cache():
+    try:
+        with open(cache_file()) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(cache):
+    path = cache_file()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    atomic_write(path, json.dumps(cache, indent=2, sort_keys=True).encode())
+
+
+def cached_ranking(system, path=None):
+    """The cache entry for this system and mirror file if it is within the TTL, else None"""
+    entry = _load_cache().get(f"{system}:{path or default_path(system)}")
+    if entry and time.time() - entry["ranked_at"] < ttl_seconds():
+        return entry
+    return None
+
+
+def rank_mirrors(system, count=5, path=None, extra=None, jobs=16):
+    """
+    Rank the candidate mirrors for system and write the fastest count of them
+    (apt: the fastest one) into the mirror file. Returns [(mirror, seconds)].
+    """
+    if offline.enabled():
+        print("Offline mode: keeping the configured mirrors")
+        return []
+    path = path or default_path(system)
+    with open(path) as f:
+        text = f.read()
+    key = f"{system}:{path}"
+    cache = _load_cache()
+    entry = cache.get(key)
+    fresh = entry is not None and time.time() - entry["ranked_at"] < ttl_seconds()
+    if system == "arch":
+        candidates = arch_candidates(text)
+    else:
+        if extra is None:
+            # The geo-located list is cached with the ranking, so a run within the TTL stays off the network
+            extra = entry["extra"] if fresh and "extra" in entry else ubuntu_mirror_list()
+        candidates = apt_candidates(text, extra)
+    digest = hashlib.sha256(json.dumps(sorted(candidates)).encode()).hexdigest()
+
+    if fresh and entry["candidates"] == digest:
+        ranked = [tuple(item) for item in entry["ranked"]]
+        print(f"Using mirror ranking from {time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['ranked_at']))}")
+    else:
+        print(f"Probing {len(candidates)} mirrors...")
+        ranked = rank(candidates, jobs)
+        cache[key] = {"candidates": digest, "ranked_at": time.time(), "ranked": ranked}
+        if extra is not None:
+            cache[key]["extra"] = extra
+        _save_cache(cache)
+    if not ranked:
+        print("No mirror answered; keeping the configured mirrors")
+        return []
+
+    for mirror, seconds in ranked[:count]:
+        print(f"  {seconds * 1000:8.0f} ms  {mirror}")
+    if system == "arch":
+        updated = render_arch(text, [mirror for mirror, _seconds in ranked[:count]])
+    else:
+        updated = render_apt(text, ranked[0][0])
+    if updated == text:
+        print(f"{path} already lists the fastest mirrors")
+    else:
+        backup = _install(path, updated.encode())
+        print(f"Wrote ranked mirrors to {path} (previous version: {backup})")
+    return ranked
@@ -0,0 +1,207 @@
+"""
+Headless Neovim pre-warm: plugins pinned to lazy-lock.json, treesitter
+parsers and Mason tools are installed at setup time instead of on the
+user's first editor session.
+"""
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+from configs_cli import gitcache, offline, probe, process, snapshot
+
+LAZY_URL = "https://github.com/folke/lazy.nvim.git"
+# Mirrors ensure_installed in config/nvim/lua/plugins/treesitter.lua
+TREESITTER_PARSERS = ["c", "lua", "vim", "vimdoc", "python"]
+# Mason package names for mason-lspconfig's ensure_installed in config/nvim/lua/plugins/mason.lua
+MASON_PACKAGES = ["pyright", "ruff", "python-lsp-server"]
+
+_SPEC = re.compile(r"""["']([\w.-]+/[\w.-]+)["']""")
+_NAMED_SPEC = re.compile(r"""["']([\w.-]+/[\w.-]+)["']\s*,(?:\s*--[^\n]*)?\s*name\s*=\s*["']([^"']+)["']""")
+
+
+def data_dir():
+    """Neovim's stdpath('data')"""
+    base = os.environ.get("XDG_DATA_HOME") or os.path.expanduser("~/.local/share")
+    return os.path.join(base, "nvim")
+
+
+def lazy_root():
+    return os.path.join(data_dir(), "lazy")
+
+
+def parser_cache_dir():
+    return os.path.expanduser(os.path.join("~", ".cache", "configs-cli", "ts-parsers"))
+
+
+def load_lockfile(config_dir):
+    with open(os.path.join(config_dir, "lazy-lock.json")) as f:
+        return json.load(f)
+
+
+def plugin_urls(config_dir):
+    """Map lazy plugin names to git URLs from the "owner/repo" specs in the config"""
+    urls = {"lazy.nvim": LAZY_URL}
+    lua_files = [os.path.join(config_dir, "init.lua")]
+    plugins_dir = os.path.join(config_dir, "lua", "plugins")
+    if os.path.isdir(plugins_dir):
+        lua_files += sorted(os.path.join(plugins_dir, name) for name in os.listdir(plugins_dir)
+                            if name.endswith(".lua"))
+    for path in lua_files:
+        try:
+            with open(path) as f:
+                text = f.read()
+        except OSError:
+            continue
+        for spec in _SPEC.findall(text):
+            urls.setdefault(spec.split("/", 1)[1], f"https://github.com/{spec}.git")
+        for spec, name in _NAMED_SPEC.findall(text):
+            urls[name] = f"https://github.com/{spec}.git"
+    return urls
+
+
+def plugin_heads(config_dir):
+    """Return {name: (pinned commit, checked-out commit)} for every locked plugin"""
+    root = lazy_root()
+    return {name: (pin["commit"], gitcache.head(os.path.join(root, name)))
+            for name, pin in load_lockfile(config_dir).items()}
+
+
+def _sync_plugin(name, url, pin, root):
+    checkout = os.path.join(root, name)
+    current = gitcache.head(checkout)
+    if current == pin["commit"]:
+        return name, "up to date"
+    if not os.path.isdir(checkout):
+        # Recorded as missing: rollback removes the clone
+        snapshot.save(checkout)
+        gitcache.clone(url, checkout)
+    else:
+        # Moving between commits only needs the old one recorded, not the tree
+        if current is None:
+            snapshot.save(checkout)
+        else:
+            snapshot.save_head(checkout, current)
+        with ExitStack() as stack:
+            try:
+                source = stack.enter_context(gitcache.mirror_for(url))
+            except (OSError, subprocess.CalledProcessError) as e:
+                if offline.enabled():
+                    raise
+                print(f"Git cache unavailable ({e}); fetching {name} from origin")
+                source = "origin"
+            process.run(["git", "-C", checkout, "fetch", "--quiet", "--no-tags", source,
+                         "+refs/heads/*:refs/remotes/origin/*"], check=True)
+    process.run(["git", "-C", checkout, "checkout", "--quiet", "-B", pin.get("branch", "main"),
+                 pin["commit"]], check=True)
+    return name, f"pinned to {pin['commit'][:8]}"
+
+
+def sync_plugins(config_dir, jobs=8):
+    """
+    Check out every plugin in lazy-lock.json at its pinned commit, cloning in
+    parallel through the git mirror cache. Plugins whose URL can't be found in
+    the specs are left for lazy.nvim's own restore.
+    """
+    lock = load_lockfile(config_dir)
+    urls = plugin_urls(config_dir)
+    root = lazy_root()
+    os.makedirs(root, exist_ok=True)
+
+    known = {name: pin for name, pin in lock.items() if name in urls}
+    unknown = sorted(set(lock) - set(known))
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        futures = [pool.submit(_sync_plugin, name, urls[name], pin, root) for name, pin in known.items()]
+        for future in futures:
+            name, result = future.result()
+            print(f"nvim plugin {name}: {result}")
+
+    if not probe.which("nvim"):
+        print("nvim not found; skipping lazy.nvim restore")
+        return
+    if unknown:
+        print(f"Restoring remaining plugins with lazy.nvim: {', '.join(unknown)}")
+    # Lets lazy.nvim run build hooks and settle anything we couldn't map
+    process.run(["nvim", "--headless", "+Lazy! restore", "+qa"], check=True)
+
+
+def _treesitter_revision(lang):
+    """The parser revision nvim-treesitter pins in its lockfile"""
+    try:
+        with open(os.path.join(lazy_root(), "nvim-treesitter", "lockfile.json")) as f:
+            return json.load(f).get(lang, {}).get("revision")
+    except (OSError, ValueError):
+        return None
+
+
+def _parser_paths(lang):
+    plugin = os.path.join(lazy_root(), "nvim-treesitter")
+    return (os.path.join(plugin, "parser", f"{lang}.so"),
+            os.path.join(plugin, "parser-info", f"{lang}.revision"))
+
+
+def parser_installed(lang):
+    parser, info = _parser_paths(lang)
+    revision = _treesitter_revision(lang)
+    try:
+        with open(info) as f:
+            installed = f.read().strip()
+    except OSError:
+        return False
+    return os.path.exists(parser) and (revision is None or installed == revision)
+
+
+def _install_parser(lang):
+    parser, info = _parser_paths(lang)
+    revision = _treesitter_revision(lang)
+    cached = None
+    if revision:
+        cached = os.path.join(parser_cache_dir(), f"{lang}-{revision}-{platform.machine()}.so")
+
+    if cached and os.path.exists(cached):
+        os.makedirs(os.path.dirname(parser), exist_ok=True)
+        os.makedirs(os.path.dirname(info), exist_ok=True)
+        shutil.copy2(cached, parser)
+        with open(info, "w") as f:
+            f.write(revision)
+        return lang, "restored from cache"
+
+    process.run(["nvim", "--headless", f"+TSInstallSync! {lang}", "+qa"],
+                check=True, stdout=subprocess.DEVNULL)
+    if cached and os.path.exists(parser):
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        tmp = f"{cached}.tmp-{os.getpid()}"
+        shutil.copy2(parser, tmp)
+        os.replace(tmp, cached)
+    return lang, "built"
+
+
+def install_parsers(parsers=None, jobs=4):
+    """Build treesitter parsers concurrently, reusing compiled parsers cached by revision"""
+    parsers = [lang for lang in (parsers or TREESITTER_PARSERS) if not parser_installed(lang)]
+    if not parsers:
+        print("Treesitter parsers are up to date")
+        return
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        for lang, result in pool.map(_install_parser, parsers):
+            print(f"treesitter parser {lang}: {result}")
+
+
+def mason_package_dir(name):
+    return os.path.join(data_dir(), "mason", "packages", name)
+
+
+def install_mason_tools(packages=None):
+    """Install Mason tools headlessly (MasonInstall blocks when nvim is headless)"""
+    missing = [name for name in (packages or MASON_PACKAGES) if not os.path.isdir(mason_package_dir(name))]
+    if not missing:
+        print("Mason tools are up to date")
+        return
+    if offline.enabled():
+        print(f"Skipping Mason tools in offline mode: {', '.join(missing)}")
+        return
+    process.run(["nvim", "--headless", f"+MasonInstall {' '.join(missing)}", "+qa"], check=True)
@@ -0,0 +1,37 @@
+"""
+Offline mode, entered by setup --bundle: every artifact comes from the caches
+the bundle populated and nothing reaches for the network.
+"""
+import os
+
+ENV = "CONFIGS_CLI_OFFLINE"
+DEFAULT_STAGING_DIR = os.path.join("~", ".cache", "configs-cli", "bundle")
+
+
+class OfflineError(Exception):
+    pass
+
+
+def enabled():
+    return os.environ.get(ENV, "") not in ("", "0")
+
+
+def enable():
+    # Exported so child configs-cli processes stay offline as well
+    os.environ[ENV] = "1"
+
+
+def staging_dir(kind=None):
+    """Where bundle artifacts that aren't cache entries (gems, npm tarballs) are unpacked"""
+    root = os.path.expanduser(os.environ.get("CONFIGS_CLI_BUNDLE_STAGING", DEFAULT_STAGING_DIR))
+    return os.path.join(root, kind) if kind else root
+
+
+def staged(kind, suffix):
+    """Return the sorted paths of staged artifacts of one kind ending in suffix"""
+    directory = staging_dir(kind)
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(os.path.join(directory, name) for name in names if name.endswith(suffix))
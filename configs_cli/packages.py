@@ -0,0 +1,163 @@
+"""
+Package planner: read the installed set once and compute what is missing.
+The package index is refreshed only when it is older than a TTL, and every
+pacman/apt-get invocation gets parallel-download settings on its command line
+(a temporary pacman.conf, apt -o options) instead of edits to system config.
+"""
+import contextlib
+import glob
+import json
+import os
+import re
+import tempfile
+import time
+
+from configs_cli import process
+
+PACMAN_CONF = "/etc/pacman.conf"
+PACMAN_SYNC_DIR = "/var/lib/pacman/sync"
+APT_LISTS_DIR = "/var/lib/apt/lists"
+APT_SOURCES = ["/etc/apt/sources.list", "/etc/apt/sources.list.d"]
+DEFAULT_INDEX_TTL_MINUTES = 60
+DEFAULT_REFRESH_LOG = os.path.join("~", ".local", "state", "configs-cli", "package-index.json")
+PARALLEL_DOWNLOADS = 8
+APT_OPTIONS = [
+    # One download queue per host, so packages from different mirrors come in parallel
+    "-o", "Acquire::Queue-Mode=host",
+    "-o", "Acquire::http::Pipeline-Depth=16",
+    "-o", "Acquire::Retries=3",
+]
+
+_PARALLEL_DOWNLOADS = re.compile(r"^[ \t]*#?[ \t]*ParallelDownloads[ \t]*=.*$", re.MULTILINE)
+
+
+def installed_packages(system):
+    """Return the set of package names currently installed on the system"""
+    if system == "arch":
+        result = process.run(["pacman", "-Qq"], capture_output=True, text=True, check=True)
+        return set(result.stdout.split())
+
+    # dpkg keeps removed-but-not-purged packages around, so look at the status too
+    result = process.run(["dpkg-query", "-W", "-f", "${db:Status-Abbrev} ${Package}\n"],
+                         capture_output=True, text=True, check=True)
+    installed = set()
+    for line in result.stdout.splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[0] == "ii":
+            installed.add(parts[1])
+    return installed
+
+
+def plan_packages(groups, installed):
+    """
+    Flatten (label, packages) groups into one ordered, de-duplicated list and
+    return only the packages that are not already installed.
+    """
+    missing = []
+    seen = set()
+    for _label, packages in groups:
+        for pkg in packages:
+            if pkg in seen:
+                continue
+            seen.add(pkg)
+            if pkg not in installed:
+                missing.append(pkg)
+    return missing
+
+
+def index_ttl():
+    """Seconds a package index stays fresh (CONFIGS_CLI_INDEX_TTL_MINUTES overrides the default)"""
+    return float(os.environ.get("CONFIGS_CLI_INDEX_TTL_MINUTES", DEFAULT_INDEX_TTL_MINUTES)) * 60
+
+
+def _newest_mtime(paths):
+    mtimes = []
+    for path in paths:
+        try:
+            mtimes.append(os.stat(path).st_mtime)
+        except OSError:
+            pass
+    return max(mtimes, default=None)
+
+
+def index_age(system):
+    """
+    Seconds since the package index was last refreshed, or None if it has to
+    be refreshed regardless: it is missing, or the repository configuration
+    changed after it was fetched.
+    """
+    if system == "arch":
+        indexes, config = glob.glob(os.path.join(PACMAN_SYNC_DIR, "*.db")), [PACMAN_CONF]
+    else:
+        indexes = glob.glob(os.path.join(APT_LISTS_DIR, "*Release"))
+        config = APT_SOURCES + glob.glob(os.path.join(APT_SOURCES[1], "*"))
+    fetched = _newest_mtime(indexes)
+    if fetched is None:
+        return None
+    # pacman and apt leave an index alone when the mirror has nothing newer, so
+    # the time of our own last refresh counts too
+    refreshed = max(fetched, _last_refresh(system).get("refreshed_at") or 0)
+    configured = _newest_mtime(config)
+    if configured is not None and configured > refreshed:
+        return None
+    return max(0.0, time.time() - refreshed)
+
+
+def _refresh_log():
+    return os.path.expanduser(os.environ.get("CONFIGS_CLI_INDEX_LOG", DEFAULT_REFRESH_LOG))
+
+
+def _read_refresh_log():
+    try:
+        with open(_refresh_log()) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _last_refresh(system):
+    return _read_refresh_log().get(system) or {}
+
+
+def last_refresh_seconds(system):
+    """How long the last recorded index refresh took, if known"""
+    return _last_refresh(system).get("seconds")
+
+
+def record_refresh(system, seconds):
+    path = _refresh_log()
+    log = _read_refresh_log()
+    log[system] = {"seconds": seconds, "refreshed_at": time.time()}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(log, f)
+
+
+@contextlib.contextmanager
+def pacman_config(parallel=PARALLEL_DOWNLOADS, base=PACMAN_CONF):
+    """Yield a throwaway copy of pacman.conf with ParallelDownloads set"""
+    with open(base) as f:
+        text = f.read()
+    setting = f"ParallelDownloads = {parallel}"
+    if _PARALLEL_DOWNLOADS.search(text):
+        text = _PARALLEL_DOWNLOADS.sub(setting, text, count=1)
+    else:
+        text = text.replace("[options]", f"[options]\n{setting}", 1)
+    with tempfile.NamedTemporaryFile("w", prefix="configs-cli-pacman-", suffix=".conf") as conf:
+        conf.write(text)
+        conf.flush()
+        yield conf.name
+
+
+def refresh_command(system, config=None):
+    """Build the package index refresh command"""
+    if system == "arch":
+        return ["sudo", "pacman", "-Sy", "--config", config or PACMAN_CONF]
+    return ["sudo", "apt-get", *APT_OPTIONS, "update"]
+
+
+def install_command(system, packages, config=None):
+    """Build the single install transaction for the given packages"""
+    if system == "arch":
+        return ["sudo", "pacman", "-S", "--needed", "--noconfirm", "--config", config or PACMAN_CONF] + packages
+    return ["sudo", "apt-get", *APT_OPTIONS, "install", "-y"] + packages
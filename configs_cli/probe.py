@@ -0,0 +1,143 @@
+"""
+Memoized tool probes.
+Questions such as "where is zsh", "what does `gem environment gemdir` say" or
+"is pyright in `npm list -g`" are asked through here instead of forking each
+time. Each probe runs at most once per invocation and its result is persisted,
+keyed by the command and PATH. A stored result stays valid while the resolved
+binary (and any extra paths the probe depends on) keeps its mtime, inode and
+size, so converged runs answer probes without starting an interpreter.
+"""
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+from configs_cli import process
+from configs_cli.state import path_signature
+
+DEFAULT_CACHE_FILE = os.path.join("~", ".cache", "configs-cli", "probes.json")
+FORMAT_VERSION = 1
+
+
+def cache_file():
+    """Return the probe cache path (CONFIGS_CLI_PROBE_CACHE overrides the default)"""
+    return os.path.expanduser(os.environ.get("CONFIGS_CLI_PROBE_CACHE", DEFAULT_CACHE_FILE))
+
+
+class ProbeCache:
+    """Persistent command -> (validity signature, exit code, stdout) memo"""
+
+    def __init__(self, path=None):
+        self.path = path or cache_file()
+        self.lock = threading.Lock()
+        self.located = {}
+        self.dirty = False
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            self.results = data.get("probes", {}) if data.get("version") == FORMAT_VERSION else {}
+        except (OSError, ValueError):
+            self.results = {}
+
+    def which(self, name):
+        """shutil.which, remembered per PATH; misses aren't kept since installs can fix them"""
+        key = (name, os.environ.get("PATH", ""))
+        with self.lock:
+            found = self.located.get(key)
+        if found and os.path.exists(found):
+            return found
+        found = shutil.which(name)
+        if found:
+            with self.lock:
+                self.located[key] = found
+        return found
+
+    def _signature(self, binary, depends_on, env_keys):
+        return [path_signature(os.path.realpath(binary)),
+                [path_signature(os.path.expanduser(path)) for path in depends_on],
+                [os.environ.get(key) for key in env_keys]]
+
+    def run(self, args, depends_on=(), env_keys=()):
+        """
+        Return (exit code, stdout text) of a probe command, or None if its
+        binary isn't on PATH. depends_on lists extra paths whose state the
+        answer reflects (such as a package database directory) and env_keys
+        environment variables it reads.
+        """
+        binary = self.which(args[0])
+        if binary is None:
+            return None
+        key = json.dumps([list(args), os.environ.get("PATH", "")])
+        signature = self._signature(binary, depends_on, env_keys)
+        with self.lock:
+            cached = self.results.get(key)
+        if cached and cached["signature"] == json.loads(json.dumps(signature)):
+            return cached["returncode"], cached["stdout"]
+
+        try:
+            result = process.run([binary, *args[1:]], stdout=subprocess.PIPE,
+                                 stderr=subprocess.DEVNULL, text=True)
+            returncode, stdout = result.returncode, result.stdout
+        except OSError:
+            return None
+        with self.lock:
+            self.results[key] = {"signature": signature, "returncode": returncode, "stdout": stdout}
+            self.dirty = True
+        return returncode, stdout
+
+    def output(self, args, depends_on=(), env_keys=()):
+        """Stripped stdout of a successful probe, otherwise None"""
+        result = self.run(args, depends_on, env_keys)
+        if result is None or result[0] != 0:
+            return None
+        return result[1].strip()
+
+    def save(self):
+        """Write the cache atomically, only if a probe actually ran"""
+        with self.lock:
+            if not self.dirty:
+                return
+            data = {"version": FORMAT_VERSION, "probes": self.results}
+            self.dirty = False
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".probes-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def cache():
+    """The process-wide probe cache, loaded on first use"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ProbeCache()
+        return _cache
+
+
+def which(name):
+    return cache().which(name)
+
+
+def run(args, depends_on=(), env_keys=()):
+    return cache().run(args, depends_on, env_keys)
+
+
+def output(args, depends_on=(), env_keys=()):
+    return cache().output(args, depends_on, env_keys)
+
+
+def save():
+    if _cache is not None:
+        _cache.save()
@@ -0,0 +1,119 @@
+"""
+Single entry point for every subprocess configs-cli spawns.
+The functions mirror subprocess.run/check_call/check_output; when profiling
+is active each child is timed and its CPU time and output size recorded.
+"""
+import os
+import shlex
+import subprocess
+import sys
+import threading
+
+from configs_cli import profiling
+
+
+def run(args, **kwargs):
+    """Drop-in replacement for subprocess.run"""
+    profiler = profiling.active()
+    if profiler is None:
+        return subprocess.run(args, **kwargs)
+    return _profiled_run(profiler, args, **kwargs)
+
+
+def check_call(args, **kwargs):
+    """Drop-in replacement for subprocess.check_call"""
+    return run(args, check=True, **kwargs).returncode
+
+
+def check_output(args, **kwargs):
+    """Drop-in replacement for subprocess.check_output"""
+    return run(args, stdout=subprocess.PIPE, check=True, **kwargs).stdout
+
+
+def _pump(source, sink, keep, results, name):
+    """Copy a child's pipe to sink (if any), counting bytes and keeping them if asked"""
+    chunks = []
+    size = 0
+    for chunk in iter(lambda: source.read1(65536), b""):
+        size += len(chunk)
+        if keep:
+            chunks.append(chunk)
+        if sink is not None:
+            sink.write(chunk)
+            sink.flush()
+    source.close()
+    results[name] = (b"".join(chunks), size)
+
+
+def _profiled_run(profiler, args, check=False, capture_output=False, input=None,
+                  stdout=None, stderr=None, text=False, universal_newlines=False, **popen_kwargs):
+    """
+    Run a child with its output piped through us so it can be measured.
+    Output the caller didn't capture is forwarded to our own stdout/stderr.
+    The child is reaped with wait4 for its own resource usage, which stays
+    accurate when several children run concurrently.
+    """
+    if capture_output:
+        stdout = stderr = subprocess.PIPE
+    text = text or universal_newlines
+
+    plan = {}
+    for name, target, sink in (("stdout", stdout, sys.stdout), ("stderr", stderr, sys.stderr)):
+        if target is None:
+            plan[name] = (subprocess.PIPE, getattr(sink, "buffer", None), False)
+        elif target == subprocess.PIPE:
+            plan[name] = (subprocess.PIPE, None, True)
+        elif target == subprocess.DEVNULL:
+            plan[name] = (subprocess.PIPE, None, False)
+        else:
+            # Files and subprocess.STDOUT are passed through untouched
+            plan[name] = (target, None, False)
+
+    if input is not None:
+        popen_kwargs["stdin"] = subprocess.PIPE
+
+    display = shlex.join(str(a) for a in args) if not isinstance(args, str) else args
+    started = profiler.now()
+    try:
+        proc = subprocess.Popen(args, stdout=plan["stdout"][0], stderr=plan["stderr"][0], **popen_kwargs)
+    except OSError:
+        profiler.record(display, "process", started, profiler.now() - started, exit_code=None)
+        raise
+
+    results = {}
+    pumps = []
+    for name in ("stdout", "stderr"):
+        pipe = getattr(proc, name)
+        if pipe is None:
+            continue
+        _target, sink, keep = plan[name]
+        thread = threading.Thread(target=_pump, args=(pipe, sink, keep, results, name), daemon=True)
+        thread.start()
+        pumps.append(thread)
+
+    if input is not None:
+        data = input.encode() if isinstance(input, str) else input
+        try:
+            proc.stdin.write(data)
+        except BrokenPipeError:
+            pass
+        proc.stdin.close()
+
+    for thread in pumps:
+        thread.join()
+    _pid, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+
+    profiler.record(display, "process", started, profiler.now() - started,
+                    exit_code=proc.returncode, cpu_user=usage.ru_utime, cpu_sys=usage.ru_stime,
+                    output_bytes=sum(size for _data, size in results.values()))
+
+    out = results["stdout"][0] if plan["stdout"][2] else None
+    err = results["stderr"][0] if plan["stderr"][2] else None
+    if text:
+        out = out.decode() if out is not None else None
+        err = err.decode() if err is not None else None
+
+    if check and proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, args, output=out, stderr=err)
+    return subprocess.CompletedProcess(args, proc.returncode, out, err)
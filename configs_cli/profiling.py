@@ -0,0 +1,115 @@
+"""Timing of setup steps and subprocesses, exported as a Chrome trace"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+_active = None
+
+
+def active():
+    """Return the profiler collecting events for this invocation, if any"""
+    return _active
+
+
+def start():
+    """Start collecting events for the rest of this invocation"""
+    global _active
+    _active = Profiler()
+    return _active
+
+
+class Profiler:
+    """Thread-safe collector of timed spans"""
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.events = []
+        self.lock = threading.Lock()
+        self.threads = {}
+
+    def _tid(self):
+        ident = threading.get_ident()
+        with self.lock:
+            return self.threads.setdefault(ident, len(self.threads) + 1)
+
+    def now(self):
+        return time.perf_counter() - self.origin
+
+    def record(self, name, category, started, wall, **fields):
+        """Record a finished span; started and wall are in seconds"""
+        event = {"name": name, "cat": category, "start": started, "wall": wall,
+                 "tid": self._tid()}
+        event.update(fields)
+        with self.lock:
+            self.events.append(event)
+
+    @contextmanager
+    def span(self, name, category):
+        started = self.now()
+        exit_code = 0
+        try:
+            yield
+        except BaseException:
+            exit_code = 1
+            raise
+        finally:
+            self.record(name, category, started, self.now() - started, exit_code=exit_code)
+
+    def chrome_trace(self):
+        """Return the events in Chrome trace event format (complete 'X' events)"""
+        pid = os.getpid()
+        trace = []
+        for event in self.events:
+            args = {k: v for k, v in event.items()
+                    if k not in ("name", "cat", "start", "wall", "tid")}
+            trace.append({
+                "name": event["name"],
+                "cat": event["cat"],
+                "ph": "X",
+                "ts": round(event["start"] * 1e6),
+                "dur": round(event["wall"] * 1e6),
+                "pid": pid,
+                "tid": event["tid"],
+                "args": args,
+            })
+        return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+    def write_trace(self, path):
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f, indent=1)
+
+    def print_summary(self, limit=30):
+        """Print steps and subprocesses sorted by wall time"""
+        rows = sorted(self.events, key=lambda e: e["wall"], reverse=True)[:limit]
+        print(f"\n{'kind':<8} {'wall s':>8} {'cpu s':>8} {'exit':>5} {'output':>9}  name")
+        print("-" * 80)
+        for event in rows:
+            cpu = event.get("cpu_user", 0.0) + event.get("cpu_sys", 0.0)
+            cpu_text = f"{cpu:8.2f}" if event["cat"] == "process" else f"{'':>8}"
+            code = event.get("exit_code")
+            code_text = "-" if code is None else str(code)
+            output = event.get("output_bytes")
+            output_text = "" if output is None else _human_bytes(output)
+            name = event["name"] if len(event["name"]) <= 60 else event["name"][:57] + "..."
+            print(f"{event['cat']:<8} {event['wall']:8.2f} {cpu_text} {code_text:>5} {output_text:>9}  {name}")
+
+
+def _human_bytes(size):
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GiB"
+
+
+@contextmanager
+def span(name, category="step"):
+    """Time a block if profiling is active; a no-op otherwise"""
+    profiler = _active
+    if profiler is None:
+        yield
+        return
+    with profiler.span(name, category):
+        yield
@@ -0,0 +1,214 @@
+"""
+Render a static, precompiled zshrc at setup time.
+The dotfile's runtime probes (plugin path checks, readlink of DOTFILES_DIR,
+the secrets.env grep | xargs) are resolved once for this host, and the result
+is written to a private file and zcompiled. A stub at the top of the dotfile
+sources it while it is newer than its inputs.
+"""
+import os
+import re
+import shlex
+
+from configs_cli import probe, process
+from configs_cli.fileedit import BLOCK_BEGIN, BLOCK_END, atomic_write
+
+OUTPUT = os.path.join("~", ".local", "share", "configs-cli", "zshrc.zsh")
+SECRETS = os.path.join("~", ".config", "secrets.env")
+STUB_BLOCK = "precompiled"
+
+_TEST = re.compile(r'^\[\[?\s+-([fdre])\s+"?([^"\]]+?)"?\s+\]\]?$')
+_SECRETS_EXPORT = re.compile(r"""^export \$\(grep -v '\^#' "?([^"]+?)"? \| xargs\)$""")
+_DOTFILES_DIR = re.compile(r'^export DOTFILES_DIR="\$\(dirname \$\(readlink -f .*\)\)"$')
+_ENV_KEY = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+def output_path():
+    return os.path.expanduser(OUTPUT)
+
+
+def _expand(path, home):
+    path = path.replace("${HOME}", home).replace("$HOME", home)
+    if path.startswith("~/"):
+        path = os.path.join(home, path[2:])
+    return None if "$" in path else path
+
+
+def _static_test(condition, home, inputs):
+    """Evaluate a [ -f/-d/-r/-e path ] test now; None if it depends on runtime state"""
+    match = _TEST.match(condition.strip())
+    if not match:
+        return None
+    flag, raw = match.groups()
+    path = _expand(raw, home)
+    if path is None:
+        return None
+    inputs.add(path)
+    if flag == "f":
+        return os.path.isfile(path)
+    if flag == "d":
+        return os.path.isdir(path)
+    if flag == "r":
+        return os.access(path, os.R_OK)
+    return os.path.exists(path)
+
+
+def _quote(value):
+    return "'" + value.replace("'", "'\\''") + "'"
+
+
+def _secret_exports(path):
+    """Turn KEY=VALUE lines into export statements, as grep -v '^#' | xargs did"""
+    exports = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#") or "=" not in line:
+                continue
+            key, value = line.split("=", 1)
+            key = key.strip()
+            if key.startswith("export "):
+                key = key[len("export "):].strip()
+            if not _ENV_KEY.match(key):
+                continue
+            value = value.strip()
+            if len(value) >= 2 and value[0] == value[-1] and value[0] in "'\"":
+                value = value[1:-1]
+            exports.append(f"export {key}={_quote(value)}")
+    return exports
+
+
+def _split_if(lines, start):
+    """
+    Split the if statement starting at lines[start] into its branches.
+    Returns ([(condition or None, body lines)], index after 'fi').
+    """
+    branches = []
+    condition = lines[start].strip()[3:-len("; then")]
+    body = []
+    depth = 0
+    i = start + 1
+    while i < len(lines):
+        stripped = lines[i].strip()
+        if stripped.startswith("if ") and stripped.endswith("; then"):
+            depth += 1
+        elif stripped == "fi":
+            if depth == 0:
+                branches.append((condition, body))
+                return branches, i + 1
+            depth -= 1
+        elif depth == 0 and stripped.startswith("elif ") and stripped.endswith("; then"):
+            branches.append((condition, body))
+            condition, body = stripped[5:-len("; then")], []
+            i += 1
+            continue
+        elif depth == 0 and stripped == "else":
+            branches.append((condition, body))
+            condition, body = None, []
+            i += 1
+            continue
+        body.append(lines[i])
+        i += 1
+    raise ValueError(f"unterminated if statement at line {start + 1}")
+
+
+def _dedent(lines):
+    indents = [len(l) - len(l.lstrip()) for l in lines if l.strip()]
+    cut = min(indents, default=0)
+    return [l[cut:] for l in lines]
+
+
+def render(lines, home, dotfiles_dir, inputs):
+    """Resolve static conditionals in zshrc lines; inputs collects every probed path"""
+    begin, end = BLOCK_BEGIN.format(name=STUB_BLOCK), BLOCK_END.format(name=STUB_BLOCK)
+    out = []
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        stripped = line.strip()
+
+        # The stub that loads this file must not end up inside it
+        if stripped == begin:
+            i = lines.index(end, i) + 1
+            continue
+
+        if _DOTFILES_DIR.match(stripped):
+            out.append(f'export DOTFILES_DIR="{dotfiles_dir}"')
+            i += 1
+            continue
+
+        secrets = _SECRETS_EXPORT.match(stripped)
+        if secrets:
+            path = _expand(secrets.group(1), home)
+            if path:
+                inputs.add(path)
+                if os.path.isfile(path):
+                    out.extend(_secret_exports(path))
+                i += 1
+                continue
+
+        if stripped.startswith("if ") and stripped.endswith("; then"):
+            branches, after = _split_if(lines, i)
+            results = [None if cond is None else _static_test(cond, home, inputs)
+                       for cond, _body in branches]
+            static = all(result is not None
+                         for (cond, _body), result in zip(branches, results) if cond is not None)
+            if static:
+                for (cond, body), result in zip(branches, results):
+                    if cond is None or result:
+                        out.extend(render(_dedent(body), home, dotfiles_dir, inputs))
+                        break
+            else:
+                out.extend(lines[i:after])
+            i = after
+            continue
+
+        out.append(line)
+        i += 1
+    return out
+
+
+def shell_inputs(home=None, zshrc=None):
+    """Return every path the rendered zshrc depends on, without writing anything"""
+    home = home or os.path.expanduser("~")
+    source = os.path.realpath(zshrc or os.path.join(home, ".zshrc"))
+    inputs = {source, os.path.join(home, SECRETS[2:])}
+    with open(source) as f:
+        render(f.read().splitlines(), home, os.path.dirname(source), inputs)
+    return sorted(inputs)
+
+
+def build_shell(home=None, zshrc=None, output=None):
+    """
+    Render ~/.zshrc into the precompiled file (mode 0600, since secrets are
+    inlined) and zcompile it. Returns the sorted list of input paths.
+    """
+    home = home or os.path.expanduser("~")
+    zshrc = zshrc or os.path.join(home, ".zshrc")
+    output = output or output_path()
+    source = os.path.realpath(zshrc)
+    inputs = {source, os.path.join(home, SECRETS[2:])}
+
+    with open(source) as f:
+        lines = f.read().splitlines()
+    rendered = render(lines, home, os.path.dirname(source), inputs)
+    header = [f"# Generated by configs-cli build-shell from {source}; do not edit.",
+              "# Re-run 'configs-cli build-shell' (or setup) after changing its inputs."]
+
+    os.makedirs(os.path.dirname(output), mode=0o700, exist_ok=True)
+    if not os.path.exists(output):
+        # atomic_write keeps the existing mode, so start from a private file
+        os.close(os.open(output, os.O_WRONLY | os.O_CREAT, 0o600))
+    os.chmod(output, 0o600)
+    atomic_write(output, ("\n".join(header + rendered) + "\n").encode())
+    print(f"Rendered {source} -> {output}")
+
+    zsh = probe.which("zsh")
+    if zsh:
+        try:
+            process.run([zsh, "-fc", f"zcompile -U {shlex.quote(output)}"], check=True)
+            print(f"Compiled {output}.zwc")
+        except Exception as e:
+            print(f"Warning: zcompile failed, the plain file will be sourced instead: {e}")
+    else:
+        print("zsh not found; skipping zcompile")
+    return sorted(inputs)
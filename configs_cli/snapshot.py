@@ -0,0 +1,345 @@
+"""
+Content-addressed snapshots of everything setup is about to overwrite.
+Before a path is replaced, its current state (file contents, symlink targets,
+whole directory trees, or the fact that it didn't exist) is recorded in a run
+manifest. File contents go to objects/<sha256>, cloned with a reflink where
+the filesystem supports it and copied otherwise; never hardlinked, so the
+live file keeps its inode and mode and a later in-place write can't reach the
+stored copy. Identical contents are stored once, and files are re-hashed only
+when their inode, size or mtime changed since the last snapshot. Git
+checkouts that are only moved between commits record the commit instead of
+their tree (save_head); rollback resets them to it.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+
+from configs_cli import gitcache, process
+
+DEFAULT_STORE_DIR = os.path.join("~", ".local", "state", "configs-cli", "snapshots")
+DEFAULT_KEEP = 10
+FICLONE = 0x40049409
+
+_active = None
+
+
+def store_dir():
+    """Return the snapshot store (CONFIGS_CLI_SNAPSHOTS overrides the default)"""
+    return os.path.expanduser(os.environ.get("CONFIGS_CLI_SNAPSHOTS", DEFAULT_STORE_DIR))
+
+
+def keep_runs():
+    """Number of runs kept by prune (CONFIGS_CLI_SNAPSHOT_KEEP overrides the default)"""
+    return int(os.environ.get("CONFIGS_CLI_SNAPSHOT_KEEP", DEFAULT_KEEP))
+
+
+def clone_file(src, dst, hardlink=True, reflink=True):
+    """Copy src to a new file dst by reflink (if allowed), else hardlink (if allowed), else a real copy"""
+    if reflink:
+        try:
+            with open(src, "rb") as source, open(dst, "wb") as dest:
+                fcntl.ioctl(dest.fileno(), FICLONE, source.fileno())
+            shutil.copystat(src, dst)
+            return "reflink"
+        except OSError:
+            try:
+                os.unlink(dst)
+            except FileNotFoundError:
+                pass
+    if hardlink:
+        try:
+            os.link(src, dst)
+            return "hardlink"
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+    return "copy"
+
+
+def _digest(path):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class Store:
+    """objects/<sha256>, runs/<run-id>.json and an inode -> digest index"""
+
+    def __init__(self, root=None):
+        self.root = root or store_dir()
+        self.objects = os.path.join(self.root, "objects")
+        self.runs = os.path.join(self.root, "runs")
+        self.index_path = os.path.join(self.root, "inodes.json")
+        os.makedirs(self.objects, exist_ok=True)
+        os.makedirs(self.runs, exist_ok=True)
+        self.lock = threading.Lock()
+        try:
+            with open(self.index_path) as f:
+                self.inodes = json.load(f)
+        except (OSError, ValueError):
+            self.inodes = {}
+
+    def object_path(self, digest):
+        return os.path.join(self.objects, digest)
+
+    def store_file(self, path, st):
+        """Add a regular file to the object store and return its digest"""
+        key = f"{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"
+        with self.lock:
+            digest = self.inodes.get(key)
+        if digest and os.path.exists(self.object_path(digest)):
+            return digest
+        digest = _digest(path)
+        target = self.object_path(digest)
+        if not os.path.exists(target):
+            tmp = os.path.join(self.objects, f".tmp-{os.getpid()}-{threading.get_ident()}")
+            # A hardlink would let an in-place write to the live file change the snapshot
+            clone_file(path, tmp, hardlink=False)
+            os.replace(tmp, target)
+        with self.lock:
+            self.inodes[key] = digest
+        return digest
+
+    def capture(self, path):
+        """Describe path (recursively for directories), storing file contents"""
+        try:
+            st = os.lstat(path)
+        except FileNotFoundError:
+            return {"type": "missing"}
+        mode = stat.S_IMODE(st.st_mode)
+        if stat.S_ISLNK(st.st_mode):
+            return {"type": "symlink", "target": os.readlink(path)}
+        if stat.S_ISREG(st.st_mode):
+            return {"type": "file", "sha256": self.store_file(path, st), "mode": mode,
+                    "mtime_ns": st.st_mtime_ns}
+        if stat.S_ISDIR(st.st_mode):
+            with os.scandir(path) as entries:
+                names = sorted(entry.name for entry in entries)
+            return {"type": "dir", "mode": mode,
+                    "children": {name: self.capture(os.path.join(path, name)) for name in names}}
+        return {"type": "other"}
+
+    def materialize(self, node, path):
+        """Recreate a captured node at path, which must not exist"""
+        kind = node["type"]
+        if kind == "symlink":
+            os.symlink(node["target"], path)
+        elif kind == "file":
+            clone_file(self.object_path(node["sha256"]), path, hardlink=False)
+            os.chmod(path, node["mode"])
+            os.utime(path, ns=(node["mtime_ns"], node["mtime_ns"]))
+        elif kind == "dir":
+            os.mkdir(path)
+            for name, child in node["children"].items():
+                self.materialize(child, os.path.join(path, name))
+            os.chmod(path, node["mode"])
+
+    def save_index(self):
+        with self.lock:
+            data = json.dumps(self.inodes)
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix=".inodes-")
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+        os.replace(tmp, self.index_path)
+
+    def run_ids(self):
+        """Saved run ids, oldest first"""
+        return sorted(name[:-len(".json")] for name in os.listdir(self.runs) if name.endswith(".json"))
+
+    def load_run(self, run_id):
+        with open(os.path.join(self.runs, f"{run_id}.json")) as f:
+            return json.load(f)
+
+    def lock_file(self, mode):
+        """flock the store: runs in progress hold it shared, prune exclusively"""
+        lock = open(os.path.join(self.root, "store.lock"), "a")
+        try:
+            fcntl.flock(lock, mode)
+        except OSError:
+            lock.close()
+            return None
+        return lock
+
+    def prune(self, keep=None):
+        """
+        Drop all but the newest keep runs and every object no run references.
+        Skipped while another process is recording a run.
+        """
+        lock = self.lock_file(fcntl.LOCK_EX | fcntl.LOCK_NB)
+        if lock is None:
+            return
+        try:
+            self._prune(keep_runs() if keep is None else keep)
+        finally:
+            lock.close()
+
+    def _prune(self, keep):
+        run_ids = self.run_ids()
+        for run_id in run_ids[:max(0, len(run_ids) - keep)]:
+            os.unlink(os.path.join(self.runs, f"{run_id}.json"))
+        referenced = set()
+
+        def collect(node):
+            if node["type"] == "file":
+                referenced.add(node["sha256"])
+            for child in node.get("children", {}).values():
+                collect(child)
+
+        for run_id in self.run_ids():
+            for entry in self.load_run(run_id)["entries"]:
+                collect(entry["node"])
+        for name in os.listdir(self.objects):
+            if not name.startswith(".") and name not in referenced:
+                os.unlink(self.object_path(name))
+        with self.lock:
+            self.inodes = {key: digest for key, digest in self.inodes.items() if digest in referenced}
+        self.save_index()
+
+
+class Run:
+    """One invocation's snapshot: the pre-change state of every path it touched"""
+
+    def __init__(self, command, store=None):
+        self.store = store or Store()
+        base = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        self.id, n = base, 0
+        # A rollback started in the same second as the run it restores mustn't overwrite it
+        while os.path.exists(os.path.join(self.store.runs, f"{self.id}.json")):
+            n += 1
+            self.id = f"{base}.{n}"
+        self.command = command
+        self.entries = []
+        self.lock = threading.Lock()
+        self.store_lock = self.store.lock_file(fcntl.LOCK_SH)
+
+    def _covered(self, path):
+        # A recorded commit says nothing about uncommitted files under the checkout
+        return any(path == entry["path"] or path.startswith(entry["path"] + os.sep)
+                   for entry in self.entries if entry["node"]["type"] != "git")
+
+    def save(self, path):
+        """Record path's current state unless this run already recorded it (or a parent)"""
+        path = os.path.abspath(path)
+        with self.lock:
+            if self._covered(path):
+                return
+        node = self.store.capture(path)
+        with self.lock:
+            if not self._covered(path):
+                self.entries.append({"path": path, "node": node})
+
+    def save_head(self, path, commit):
+        """Record the commit a git checkout is at before it is moved to another one"""
+        path = os.path.abspath(path)
+        with self.lock:
+            if not any(entry["path"] == path and entry["node"]["type"] == "git" for entry in self.entries):
+                self.entries.append({"path": path, "node": {"type": "git", "head": commit}})
+
+    def finish(self):
+        """Write the run manifest; returns False if nothing was recorded"""
+        try:
+            if not self.entries:
+                return False
+            manifest = {"id": self.id, "command": self.command,
+                        "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "entries": self.entries}
+            fd, tmp = tempfile.mkstemp(dir=self.store.runs, prefix=".run-")
+            with os.fdopen(fd, "w") as f:
+                json.dump(manifest, f)
+            os.replace(tmp, os.path.join(self.store.runs, f"{self.id}.json"))
+            self.store.save_index()
+            return True
+        finally:
+            if self.store_lock:
+                self.store_lock.close()
+                self.store_lock = None
+
+
+def begin(command):
+    """Start snapshotting for this process; save() is a no-op until then"""
+    global _active
+    _active = Run(command)
+    return _active
+
+
+def active():
+    return _active
+
+
+def save(path):
+    """Snapshot path before it is overwritten, if a run is active"""
+    if _active is not None:
+        _active.save(path)
+
+
+def save_head(path, commit):
+    """Record the commit a checkout is at before it moves, if a run is active"""
+    if _active is not None:
+        _active.save_head(path, commit)
+
+
+def _reset_checkout(path, commit):
+    current = gitcache.head(path)
+    if current == commit:
+        return
+    save_head(path, current)
+    managed, _other = gitcache.local_edits(path)
+    with gitcache.managed_edits_set_aside(path, managed):
+        # --keep refuses to throw away other local changes to files that differ between the commits
+        process.run(["git", "-C", path, "reset", "--quiet", "--keep", commit], check=True)
+
+
+def _remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.unlink(path)
+
+
+def restore(run_id=None, store=None):
+    """
+    Put every path recorded by run_id (default: the newest run) back the way
+    it was, newest change first. Each path is rebuilt under a temporary name
+    next to it and swapped in. Returns the restored run's manifest.
+    """
+    store = store or Store()
+    run_ids = store.run_ids()
+    if not run_ids:
+        raise FileNotFoundError("no snapshots recorded yet")
+    run_id = run_id or run_ids[-1]
+    manifest = store.load_run(run_id)
+    for entry in reversed(manifest["entries"]):
+        path, node = entry["path"], entry["node"]
+        if node["type"] == "git":
+            _reset_checkout(path, node["head"])
+            print(f"Reset {path} to {node['head'][:8]}")
+            continue
+        save(path)
+        if node["type"] == "missing":
+            _remove(path)
+            print(f"Removed {path}")
+            continue
+        if node["type"] == "other":
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.rollback-{os.getpid()}")
+        _remove(tmp)
+        store.materialize(node, tmp)
+        replaces_dir = os.path.isdir(path) and not os.path.islink(path)
+        if os.path.lexists(path) and (replaces_dir or node["type"] == "dir"):
+            # rename() can't swap a directory with anything; move the old path aside first
+            aside = f"{tmp}.old"
+            os.rename(path, aside)
+            os.rename(tmp, path)
+            _remove(aside)
+        else:
+            os.replace(tmp, path)
+        print(f"Restored {path}")
+    return manifest
@@ -0,0 +1,281 @@
+"""
+Golden-home stamping.
+A home directory provisioned once by setup is used as a template and copied
+into other homes instead of running the whole pipeline per account. The
+template is scanned once into a plan, which every target then replays:
+immutable trees (plugin checkouts, Oh My Zsh, gems, treesitter parsers) are
+reflinked or hardlinked, other files are cloned or copied and have the
+template's path replaced by the target's (DOTFILES_DIR, the npm prefix, ...),
+and absolute symlinks into the template are pointed into the target.
+
+A hardlinked file is one inode shared by every stamped home, so a write into
+it would land in all of them. Homes therefore never link to the template's
+own files: the immutable trees are first cloned into a shared tree outside
+the template home (CONFIGS_CLI_STAMP_SHARED), whose files are read-only and,
+when stamping as root, owned by root. The template user keeps their files,
+and a changed template file gets a new shared copy on the next stamp.
+"""
+import os
+import hashlib
+import pwd
+import re
+import shutil
+import stat
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from configs_cli import shellbuild, snapshot, status
+from configs_cli.snapshot import clone_file
+
+# Content nobody edits in place; shared with the template by hardlink when a reflink isn't possible
+IMMUTABLE = (
+    ".oh-my-zsh",
+    ".zsh",
+    ".tmux/plugins",
+    ".local/share/nvim/lazy",
+    ".local/share/nvim/site",
+    ".local/share/gem",
+    ".npm-global/lib/node_modules",
+    ".cache/configs-cli/ts-parsers",
+)
+# Per-user secrets, history and caches that must not be handed to other accounts.
+# The precompiled zshrc embeds secrets.env, so each user rebuilds their own.
+EXCLUDE = (
+    ".ssh",
+    ".gnupg",
+    os.path.relpath(shellbuild.SECRETS, "~"),
+    ".zsh_history",
+    ".bash_history",
+    ".viminfo",
+    ".lesshst",
+    ".local/state/configs-cli",
+    ".cache/configs-cli/git",
+    ".cache/configs-cli/downloads",
+    ".cache/configs-cli/toolchain",
+    ".cache/configs-cli/bundle",
+    ".cache/configs-cli/probes.json",
+    os.path.relpath(status.DEFAULT_STATUS_FILE, "~"),
+    os.path.relpath(shellbuild.OUTPUT, "~"),
+    os.path.relpath(shellbuild.OUTPUT, "~") + ".zwc",
+)
+# Larger files are never searched for the template path
+REWRITE_MAX_BYTES = 1 << 20
+DEFAULT_SHARED_DIR = os.path.join("~", ".local", "state", "configs-cli", "stamp")
+
+
+def shared_dir():
+    """Return the root of the shared trees (CONFIGS_CLI_STAMP_SHARED overrides the default)"""
+    return os.path.expanduser(os.environ.get("CONFIGS_CLI_STAMP_SHARED", DEFAULT_SHARED_DIR))
+
+
+def _under(rel_path, prefixes):
+    return any(rel_path == prefix or rel_path.startswith(prefix + "/") for prefix in prefixes)
+
+
+class Template:
+    """The scanned template home: a list of (relative path, kind, details) entries"""
+
+    def __init__(self, home, exclude=()):
+        self.home = os.path.abspath(home)
+        self.needle = self.home.encode()
+        # The template path only where a path component ends: /home/a but not /home/alice
+        self.pattern = re.compile(re.escape(self.needle) + rb"(?=[/:\"'\s]|$)")
+        self.exclude = EXCLUDE + tuple(exclude)
+        self.entries = []
+        self._scan("")
+
+    def _scan(self, rel_dir):
+        with os.scandir(os.path.join(self.home, rel_dir)) as entries:
+            found = sorted(entries, key=lambda entry: entry.name)
+        for entry in found:
+            rel_path = os.path.join(rel_dir, entry.name)
+            if _under(rel_path, self.exclude):
+                continue
+            st = entry.stat(follow_symlinks=False)
+            mode = stat.S_IMODE(st.st_mode)
+            if entry.is_symlink():
+                self.entries.append((rel_path, "symlink", os.readlink(entry.path)))
+            elif entry.is_dir(follow_symlinks=False):
+                self.entries.append((rel_path, "dir", mode))
+                self._scan(rel_path)
+            elif entry.is_file(follow_symlinks=False):
+                self.entries.append((rel_path, "file", (mode, self._template_content(rel_path, entry, st))))
+
+    def _template_content(self, rel_path, entry, st):
+        """The file's bytes if they mention the template home (and need rewriting), else None"""
+        if _under(rel_path, IMMUTABLE) or st.st_size > REWRITE_MAX_BYTES:
+            return None
+        try:
+            with open(entry.path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        if b"\0" in data[:8192] or not self.pattern.search(data):
+            return None
+        return data
+
+    def rewrite(self, data, home):
+        replacement = home.encode()
+        return self.pattern.sub(lambda match: replacement, data)
+
+    def link_target(self, target, home):
+        """Point absolute links into the template at the same place in home"""
+        if target == self.home or target.startswith(self.home + os.sep):
+            return home + target[len(self.home):]
+        return target
+
+
+class SharedTree:
+    """Read-only clones of the template's immutable files, which stamped homes hardlink to"""
+
+    def __init__(self, template, root=None):
+        self.template = template
+        key = hashlib.sha256(template.home.encode()).hexdigest()[:16]
+        self.root = os.path.join(root or shared_dir(), key)
+
+    def path(self, rel_path):
+        return os.path.join(self.root, rel_path)
+
+    def share(self, rel_path):
+        """Bring the shared copy of rel_path up to date with the template; returns its path"""
+        source = os.path.join(self.template.home, rel_path)
+        path = self.path(rel_path)
+        st = os.lstat(source)
+        try:
+            shared = os.lstat(path)
+            if (shared.st_size, shared.st_mtime_ns) == (st.st_size, st.st_mtime_ns):
+                return path
+        except FileNotFoundError:
+            pass
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp-{os.getpid()}")
+        clone_file(source, tmp, hardlink=False)
+        os.chmod(tmp, stat.S_IMODE(st.st_mode) & ~0o222)
+        if os.geteuid() == 0:
+            os.lchown(tmp, 0, 0)
+        os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+        # A new inode: homes linked to the old copy keep it until they are stamped again
+        os.replace(tmp, path)
+        return path
+
+    def update(self, jobs=8):
+        """Share every file of the template's immutable trees"""
+        rel_paths = [rel_path for rel_path, kind, details in self.template.entries
+                     if kind == "file" and details[1] is None and _under(rel_path, IMMUTABLE)]
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+            list(pool.map(self.share, rel_paths))
+
+
+def _clear(path):
+    """Make way for a new entry at path, snapshotting what was there"""
+    if not os.path.lexists(path):
+        return
+    snapshot.save(path)
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    else:
+        os.unlink(path)
+
+
+def stamp_home(template, home, owner=None, shared=None):
+    """
+    Replay the template into home. owner is (uid, gid) to chown new entries
+    to; hardlinked files belong to the shared tree instead, since an inode
+    has only one owner. Immutable files are linked from shared (a SharedTree
+    already brought up to date), or copied if there is none. Returns counts
+    of each kind of entry written.
+    """
+    home = os.path.abspath(home)
+    counts = {"dirs": 0, "links": 0, "reflink": 0, "hardlink": 0, "copy": 0, "rewritten": 0}
+    os.makedirs(home, exist_ok=True)
+    # Stop trying reflinks once the filesystem turns one down
+    reflink = True
+    for rel_path, kind, details in template.entries:
+        source = os.path.join(template.home, rel_path)
+        path = os.path.join(home, rel_path)
+        if kind == "dir":
+            if not (os.path.isdir(path) and not os.path.islink(path)):
+                _clear(path)
+                os.mkdir(path)
+            os.chmod(path, details)
+            counts["dirs"] += 1
+        elif kind == "symlink":
+            target = template.link_target(details, home)
+            if os.path.islink(path) and os.readlink(path) == target:
+                continue
+            _clear(path)
+            os.symlink(target, path)
+            counts["links"] += 1
+        else:
+            mode, data = details
+            linked = shared is not None and data is None and _under(rel_path, IMMUTABLE)
+            if linked:
+                source = shared.path(rel_path)
+                if os.path.lexists(path) and os.path.samestat(os.lstat(path), os.lstat(source)):
+                    # Hardlinked by an earlier stamp
+                    continue
+            _clear(path)
+            if data is not None:
+                with open(path, "wb") as f:
+                    f.write(template.rewrite(data, home))
+                os.chmod(path, mode)
+                shutil.copystat(source, path)
+                counts["rewritten"] += 1
+            else:
+                method = clone_file(source, path, hardlink=linked, reflink=reflink)
+                reflink = method == "reflink"
+                counts[method] += 1
+                if method == "hardlink":
+                    continue
+                # The shared copy is read-only; a private one gets the template's mode back
+                os.chmod(path, mode)
+        if owner:
+            os.lchown(path, *owner)
+    if owner:
+        os.lchown(home, *owner)
+    return counts
+
+
+def resolve_targets(users=(), homes=()):
+    """Return [(label, home, (uid, gid) or None)] for user names and bare directories"""
+    targets = []
+    for user in users:
+        try:
+            entry = pwd.getpwnam(user)
+        except KeyError:
+            raise ValueError(f"no such user: {user}") from None
+        targets.append((user, entry.pw_dir, (entry.pw_uid, entry.pw_gid)))
+    for home in homes:
+        targets.append((home, os.path.abspath(home), None))
+    return targets
+
+
+def stamp(template_home, targets, jobs=8, exclude=(), shared_root=None):
+    """
+    Stamp the template into every target in parallel. Returns
+    {label: counts or the exception that stopped that home}.
+    """
+    started = time.monotonic()
+    template = Template(template_home, exclude)
+    print(f"Scanned {template.home}: {len(template.entries)} entries "
+          f"in {time.monotonic() - started:.2f}s")
+    for label, home, _owner in targets:
+        if os.path.abspath(home) == template.home:
+            raise ValueError(f"{label} is the template home itself")
+    shared = SharedTree(template, shared_root)
+    shared.update(jobs)
+
+    def run(target):
+        label, home, owner = target
+        try:
+            counts = stamp_home(template, home, owner, shared)
+        except OSError as e:
+            return label, e
+        print(f"Stamped {home}: {counts['hardlink'] + counts['reflink']} files shared, "
+              f"{counts['copy']} copied, {counts['rewritten']} rewritten, {counts['links']} links")
+        return label, counts
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        results = dict(pool.map(run, targets))
+    print(f"Stamped {len(targets)} homes in {time.monotonic() - started:.2f}s")
+    return results
@@ -0,0 +1,94 @@
+"""Persisted step fingerprints so converged setup steps can be skipped"""
+import hashlib
+import json
+import os
+import stat
+import tempfile
+
+DEFAULT_STATE_FILE = os.path.join("~", ".local", "state", "configs-cli", "state.json")
+
+
+def state_file():
+    """Return the state file path (CONFIGS_CLI_STATE overrides the default)"""
+    return os.path.expanduser(os.environ.get("CONFIGS_CLI_STATE", DEFAULT_STATE_FILE))
+
+
+def path_signature(path):
+    """
+    Describe a path cheaply from a single lstat: type, mode, size, mtime and
+    inode, plus the link target for symlinks. Returns None if it doesn't exist.
+    """
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return None
+    signature = [stat.S_IFMT(st.st_mode), stat.S_IMODE(st.st_mode),
+                 st.st_size, st.st_mtime_ns, st.st_ino]
+    if stat.S_ISLNK(st.st_mode):
+        signature.append(os.readlink(path))
+    return signature
+
+
+def file_digest(path):
+    """Return the sha256 of a (small) file's contents, or None if unreadable"""
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def fingerprint(*parts):
+    """Hash arbitrary JSON-serializable parts into a fingerprint string"""
+    blob = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+
+def exists_fingerprint(*paths):
+    """Fingerprint a set of paths that must all exist, or None if one is missing"""
+    signatures = [path_signature(path) for path in paths]
+    if any(sig is None for sig in signatures):
+        return None
+    return fingerprint(list(paths), signatures)
+
+
+class StateStore:
+    """Step name -> fingerprint of the inputs and outputs of its last successful run"""
+
+    def __init__(self, path=None):
+        self.path = path or state_file()
+        self.steps = {}
+        self.dirty = False
+        try:
+            with open(self.path) as f:
+                self.steps = json.load(f).get("steps", {})
+        except (OSError, ValueError):
+            self.steps = {}
+
+    def matches(self, name, current):
+        """True if current is a real fingerprint equal to the recorded one"""
+        return current is not None and self.steps.get(name) == current
+
+    def record(self, name, current):
+        if current is None:
+            if self.steps.pop(name, None) is not None:
+                self.dirty = True
+        elif self.steps.get(name) != current:
+            self.steps[name] = current
+            self.dirty = True
+
+    def save(self):
+        """Write the state file atomically, only if something changed"""
+        if not self.dirty:
+            return
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".state-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"version": 1, "steps": self.steps}, f, indent=2, sort_keys=True)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.dirty = False
@@ -0,0 +1,200 @@
+"""
+Precomputed drift status for shell prompts.
+setup, update and check refresh a small line-based state file in the
+background: how many commits the configs repository is behind its upstream,
+how many managed links are missing or wrong, and how many tracked files are
+modified (the blocks setup itself writes into dotfiles don't count). The file
+also records the mtime of everything those numbers depend on (the git HEAD,
+index and upstream ref, each link, each managed file), so `status --prompt`
+only has to read it and lstat that list. Only os, sys and time are imported
+on that path; a stale file is printed as-is while a detached refresh
+recomputes it for the next prompt.
+"""
+import os
+import sys
+import time
+
+DEFAULT_STATUS_FILE = os.path.join("~", ".cache", "configs-cli", "status")
+FORMAT = "configs-cli-status 1"
+# A refresh that hasn't finished after this long is assumed dead
+REFRESH_TIMEOUT = 60
+SYMBOLS = (("behind", "⇣"), ("links", "✗"), ("modified", "±"))
+
+
+def status_file():
+    """Return the status file path (CONFIGS_CLI_STATUS_FILE overrides the default)"""
+    return os.path.expanduser(os.environ.get("CONFIGS_CLI_STATUS_FILE", DEFAULT_STATUS_FILE))
+
+
+def default_repo():
+    return os.environ.get("CONFIGS_REPO", os.path.join(os.path.expanduser("~"), ".configs"))
+
+
+def _mtime(path):
+    try:
+        return str(os.lstat(path).st_mtime_ns)
+    except OSError:
+        return "-"
+
+
+def read(path=None):
+    """Return ({field: value}, [(recorded mtime, path)]), or (None, None) if there is no usable file"""
+    try:
+        with open(path or status_file(), encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None, None
+    if not lines or lines[0] != FORMAT:
+        return None, None
+    fields, watches = {}, []
+    for line in lines[1:]:
+        key, _, value = line.partition(" ")
+        if key == "watch":
+            mtime, _, watched = value.partition(" ")
+            watches.append((mtime, watched))
+        else:
+            fields[key] = value
+    return fields, watches
+
+
+def is_stale(watches):
+    return any(_mtime(path) != mtime for mtime, path in watches)
+
+
+def segment(fields):
+    """The prompt text for a status: empty when nothing drifted"""
+    parts = []
+    for key, symbol in SYMBOLS:
+        count = fields.get(key, "0")
+        if count not in ("", "0"):
+            parts.append(f"{symbol}{count}")
+    return " ".join(parts)
+
+
+def refresh_in_background(repo, path=None):
+    """Recompute the status file in a detached process, unless a refresh is already running"""
+    path = path or status_file()
+    lock = f"{path}.refreshing"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            if os.path.getmtime(lock) > time.time() - REFRESH_TIMEOUT:
+                return False
+            os.unlink(lock)
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        os.close(fd)
+        os.posix_spawn(sys.executable,
+                       [sys.executable, "-m", "configs_cli.status", "--refresh", repo, path],
+                       dict(os.environ),
+                       file_actions=[(os.POSIX_SPAWN_OPEN, stream, os.devnull, os.O_RDWR, 0)
+                                     for stream in (0, 1, 2)],
+                       setsid=True)
+    except OSError:
+        return False
+    return True
+
+
+def prompt(path=None):
+    """Print the prompt segment; never fails, so a broken state can't break the prompt"""
+    path = path or status_file()
+    fields, watches = read(path)
+    if fields is None:
+        refresh_in_background(default_repo(), path)
+        return 0
+    if is_stale(watches):
+        refresh_in_background(fields.get("repo") or default_repo(), path)
+    text = segment(fields)
+    if text:
+        sys.stdout.write(text + "\n")
+    return 0
+
+
+def _git(repo, *args):
+    # Imported here: the prompt path must not pay for subprocess
+    from configs_cli import process
+    result = process.run(["git", "-C", repo, *args], capture_output=True, text=True)
+    return result.stdout if result.returncode == 0 else None
+
+
+def compute(repo, home=None):
+    """Return ({field: value}, [watched paths]) for repo as seen from home"""
+    import subprocess
+
+    from configs_cli import gitcache
+    from configs_cli.audit import OK, audit_home
+    from configs_cli.symlinks import MANIFEST, ManifestError, plan_links
+
+    repo = os.path.abspath(repo)
+    home = home or os.path.expanduser("~")
+    watched = [os.path.join(repo, MANIFEST)]
+    try:
+        links = plan_links(repo)
+    except ManifestError:
+        links = []
+    report = audit_home(home, links)
+    drifted = sum(1 for link in report["links"] if link["status"] != OK)
+    for link in report["links"]:
+        watched += [link["path"], link["expected"]]
+    # Entries added to or removed from a linked directory change its mtime
+    watched += sorted({os.path.dirname(target) for _rel_path, target in links})
+
+    behind, modified = 0, 0
+    git_dir = (_git(repo, "rev-parse", "--absolute-git-dir") or "").strip()
+    if git_dir:
+        watched += [os.path.join(git_dir, name) for name in ("HEAD", "index", "FETCH_HEAD", "packed-refs")]
+        upstream = (_git(repo, "rev-parse", "--symbolic-full-name", "@{upstream}") or "").strip()
+        if upstream:
+            watched.append(os.path.join(git_dir, upstream))
+            behind = int((_git(repo, "rev-list", "--count", "HEAD..@{upstream}") or "0").strip() or 0)
+        # setup's own managed blocks in tracked dotfiles aren't drift
+        try:
+            modified = len(gitcache.local_edits(repo)[1])
+        except (OSError, subprocess.CalledProcessError):
+            modified = 0
+        # Editing a managed file through its link only changes the file itself
+        targets = [os.path.relpath(target, repo) for _rel_path, target in links
+                   if target.startswith(repo + os.sep)]
+        if targets:
+            tracked = _git(repo, "ls-files", "-z", "--", *targets) or ""
+            watched += [os.path.join(repo, name) for name in tracked.split("\0") if name]
+    fields = {"repo": repo, "behind": str(behind), "links": str(drifted), "modified": str(modified),
+              "refreshed": str(int(time.time()))}
+    return fields, list(dict.fromkeys(watched))
+
+
+def write(fields, watched, path=None):
+    from configs_cli.fileedit import atomic_write
+
+    path = path or status_file()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    lines = [FORMAT, *(f"{key} {value}" for key, value in fields.items()),
+             *(f"watch {_mtime(watch)} {watch}" for watch in watched)]
+    atomic_write(path, ("\n".join(lines) + "\n").encode())
+
+
+def refresh(repo, path=None, holds_lock=False):
+    """
+    Recompute and write the status file now; returns the fields. holds_lock
+    says this process owns the .refreshing marker (refresh_in_background
+    created it for us), which is then removed; a synchronous refresh leaves a
+    running background one's marker alone.
+    """
+    path = path or status_file()
+    try:
+        fields, watched = compute(repo)
+        write(fields, watched, path)
+    finally:
+        if holds_lock:
+            try:
+                os.unlink(f"{path}.refreshing")
+            except FileNotFoundError:
+                pass
+    return fields
+
+
+if __name__ == "__main__":
+    # Started by refresh_in_background: --refresh REPO STATUS_FILE
+    if sys.argv[1:2] == ["--refresh"] and len(sys.argv) == 4:
+        refresh(sys.argv[2], sys.argv[3], holds_lock=True)
@@ -0,0 +1,136 @@
+"""
+Manifest-driven symlink engine.
+links.json in the configs repository declares which repository directories
+are linked into the home (every entry of dotfiles/ as ~/.<name>, selected
+entries of config/ under ~/.config, ...) plus any one-off links. The plan is
+built with one scandir per source directory, links that are already correct
+are left alone and the rest are swapped in atomically: the new link is
+created under a temporary name and os.replace()d over the old path.
+"""
+import json
+import os
+import shutil
+import time
+
+from configs_cli import snapshot
+from configs_cli.audit import MISSING, NOT_SYMLINK, OK, audit_home
+
+MANIFEST = "links.json"
+
+# Used when a repository has no links.json
+DEFAULT_MANIFEST = {
+    "version": 1,
+    "directories": [
+        {"source": "dotfiles", "target": "", "prefix": "."},
+        {"source": "config", "target": ".config", "include": ["nvim"]},
+    ],
+    "links": [],
+}
+
+
+class ManifestError(Exception):
+    pass
+
+
+def load_manifest(repo_dir):
+    try:
+        with open(os.path.join(repo_dir, MANIFEST)) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return DEFAULT_MANIFEST
+    except (OSError, ValueError) as e:
+        raise ManifestError(f"cannot read {MANIFEST}: {e}") from e
+    if manifest.get("version") != 1:
+        raise ManifestError(f"unsupported {MANIFEST} version {manifest.get('version')}")
+    return manifest
+
+
+def _safe(rel_path, what):
+    if os.path.isabs(rel_path) or ".." in rel_path.split("/"):
+        raise ManifestError(f"{what} must stay inside its directory: {rel_path}")
+    return rel_path
+
+
+def plan_links(repo_dir, manifest=None):
+    """Return sorted (link path relative to the home, absolute target) pairs"""
+    repo_dir = os.path.abspath(repo_dir)
+    manifest = manifest or load_manifest(repo_dir)
+    plan = {}
+    for spec in manifest.get("directories", []):
+        source = os.path.join(repo_dir, _safe(spec["source"], "source"))
+        target = _safe(spec.get("target", ""), "target")
+        include = set(spec["include"]) if "include" in spec else None
+        exclude = set(spec.get("exclude", []))
+        try:
+            with os.scandir(source) as entries:
+                names = [entry.name for entry in entries]
+        except FileNotFoundError:
+            continue
+        for name in names:
+            # Hidden entries (editor swap files, .gitkeep) are never linked
+            if name.startswith(".") or name in exclude or (include is not None and name not in include):
+                continue
+            plan[os.path.join(target, spec.get("prefix", "") + name)] = os.path.join(source, name)
+    for link in manifest.get("links", []):
+        plan[_safe(link["target"], "target")] = os.path.join(repo_dir, _safe(link["source"], "source"))
+    return sorted(plan.items())
+
+
+def _backup(path):
+    """Keep a real file or directory that is about to be replaced by a link"""
+    backup = f"{path}.pre-configs-cli-{time.strftime('%Y%m%d%H%M%S')}"
+    if os.path.isdir(path):
+        # A directory can't be replaced atomically, so it is moved aside first
+        os.rename(path, backup)
+    else:
+        try:
+            os.link(path, backup)
+        except OSError:
+            shutil.copy2(path, backup)
+    return backup
+
+
+def _swap(link_path, target):
+    tmp = os.path.join(os.path.dirname(link_path),
+                       f".{os.path.basename(link_path)}.configs-cli-{os.getpid()}")
+    try:
+        os.unlink(tmp)
+    except FileNotFoundError:
+        pass
+    os.symlink(target, tmp)
+    try:
+        os.replace(tmp, link_path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def apply_links(home, links):
+    """
+    Make every (relative path, target) link exist in home.
+    Returns {"created": n, "updated": n, "unchanged": n}. Whatever is replaced
+    goes into the active snapshot; without one, real files and directories in
+    the way are kept under a .pre-configs-cli-<time> name.
+    """
+    counts = {"created": 0, "updated": 0, "unchanged": 0}
+    for result in audit_home(home, links)["links"]:
+        status, link_path, target = result["status"], result["path"], result["expected"]
+        if status == OK:
+            counts["unchanged"] += 1
+            continue
+        os.makedirs(os.path.dirname(link_path), exist_ok=True)
+        snapshot.save(link_path)
+        stale = None
+        if status == NOT_SYMLINK:
+            if snapshot.active() is None:
+                print(f"Backed up {link_path} to {_backup(link_path)}")
+            elif os.path.isdir(link_path):
+                # The snapshot holds its contents, but it still has to be moved out of the way
+                stale = f"{link_path}.configs-cli-old-{os.getpid()}"
+                os.rename(link_path, stale)
+        _swap(link_path, target)
+        if stale:
+            shutil.rmtree(stale)
+        counts["created" if status == MISSING else "updated"] += 1
+        print(f"Created symlink: {link_path} -> {target}")
+    return counts
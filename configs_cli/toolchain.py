@@ -0,0 +1,160 @@
+"""
+Version-pinned Ruby gems and npm packages from toolchain-lock.json.
+Packages already installed at their locked version are left alone. Gems are
+built once per Ruby version and architecture into a local artifact cache and
+copied into each user's gem directory from there; npm packages are packed
+into the same cache once and installed from the tarball.
+"""
+import json
+import os
+import platform
+import shutil
+import tempfile
+
+from configs_cli import offline, probe, process
+
+LOCKFILE = "toolchain-lock.json"
+DEFAULT_CACHE_DIR = os.path.join("~", ".cache", "configs-cli", "toolchain")
+NPM_PREFIX = os.path.join("~", ".npm-global")
+
+
+class ToolchainError(Exception):
+    pass
+
+
+def cache_dir():
+    """Return the artifact cache directory (CONFIGS_CLI_TOOLCHAIN_CACHE overrides the default)"""
+    return os.path.expanduser(os.environ.get("CONFIGS_CLI_TOOLCHAIN_CACHE", DEFAULT_CACHE_DIR))
+
+
+def load_lock(repo_dir):
+    """Return {"gem": {name: version}, "npm": {name: version}} from the repo's lockfile"""
+    with open(os.path.join(repo_dir, LOCKFILE)) as f:
+        lock = json.load(f)
+    return {kind: {name: pin["version"] for name, pin in lock.get(kind, {}).items()}
+            for kind in ("gem", "npm")}
+
+
+def gem_user_dir():
+    """Where gem install --user-install puts gems (answered by the probe cache)"""
+    return probe.output(["ruby", "-e", "print Gem.user_dir"], env_keys=["GEM_HOME"])
+
+
+def installed_gem_versions(name, user_dir):
+    """Versions of a gem in the user gem directory, read from its specifications"""
+    prefix = f"{name}-"
+    try:
+        names = os.listdir(os.path.join(user_dir, "specifications"))
+    except FileNotFoundError:
+        return []
+    return [spec[len(prefix):-len(".gemspec")] for spec in names
+            if spec.startswith(prefix) and spec.endswith(".gemspec")
+            and spec[len(prefix):-len(".gemspec")][:1].isdigit()]
+
+
+def installed_npm_version(name, prefix=None):
+    prefix = os.path.expanduser(prefix or NPM_PREFIX)
+    try:
+        with open(os.path.join(prefix, "lib", "node_modules", name, "package.json")) as f:
+            return json.load(f).get("version")
+    except (OSError, ValueError):
+        return None
+
+
+def missing(lock, user_dir=None, prefix=None):
+    """Return [(kind, name, version)] for every locked package not installed at its version"""
+    result = []
+    for name, version in sorted(lock["gem"].items()):
+        if not user_dir or version not in installed_gem_versions(name, user_dir):
+            result.append(("gem", name, version))
+    for name, version in sorted(lock["npm"].items()):
+        if installed_npm_version(name, prefix) != version:
+            result.append(("npm", name, version))
+    return result
+
+
+def _build_gem(name, version, built):
+    """Install a gem and its dependencies into a private directory of the cache"""
+    tmp = f"{built}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    command = ["gem", "install", name, "--version", version, "--install-dir", tmp,
+               "--bindir", os.path.join(tmp, "bin"), "--no-document"]
+    cwd = None
+    if offline.enabled():
+        # gem resolves dependencies from .gem files in the working directory
+        if not offline.staged("gems", ".gem"):
+            raise offline.OfflineError(f"no gems staged from a bundle; cannot build {name} offline")
+        command.append("--local")
+        cwd = offline.staging_dir("gems")
+    try:
+        process.run(command, cwd=cwd, check=True)
+        os.makedirs(os.path.dirname(built), exist_ok=True)
+        os.rename(tmp, built)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def install_gem(name, version, user_dir):
+    """Copy a locked gem (built on first use) into the user gem directory"""
+    if version in installed_gem_versions(name, user_dir):
+        return "up to date"
+    built = os.path.join(cache_dir(), f"gem-{os.path.basename(user_dir)}-{platform.machine()}",
+                         f"{name}-{version}")
+    result = "copied from cache"
+    if not os.path.isdir(built):
+        _build_gem(name, version, built)
+        result = "built"
+    for part in ("gems", "specifications", "extensions", "bin"):
+        source = os.path.join(built, part)
+        if os.path.isdir(source):
+            shutil.copytree(source, os.path.join(user_dir, part), symlinks=True, dirs_exist_ok=True)
+    return result
+
+
+def _pack_npm(name, version, tarball):
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(tarball)) as workdir:
+        if offline.enabled():
+            staged = [path for path in offline.staged("npm", ".tgz")
+                      if os.path.basename(path) == os.path.basename(tarball)]
+            if not staged:
+                raise offline.OfflineError(f"{name}@{version} is not staged from a bundle")
+            shutil.copy(staged[0], tarball)
+            return
+        result = process.run(["npm", "pack", f"{name}@{version}", "--pack-destination", workdir],
+                             check=True, capture_output=True, text=True)
+        os.replace(os.path.join(workdir, result.stdout.strip().splitlines()[-1]), tarball)
+
+
+def install_npm(name, version, prefix=None):
+    """Install a locked npm package globally from its cached tarball"""
+    prefix = os.path.expanduser(prefix or NPM_PREFIX)
+    if installed_npm_version(name, prefix) == version:
+        return "up to date"
+    npm_cache = os.path.join(cache_dir(), "npm")
+    os.makedirs(npm_cache, exist_ok=True)
+    # npm pack names scoped packages scope-name-version.tgz
+    tarball = os.path.join(npm_cache, f"{name.lstrip('@').replace('/', '-')}-{version}.tgz")
+    result = "installed from cache"
+    if not os.path.exists(tarball):
+        _pack_npm(name, version, tarball)
+        result = "downloaded"
+    # An explicit prefix keeps this independent of the user's npm config
+    process.run(["npm", "install", "--global", "--prefix", prefix,
+                 "--offline" if offline.enabled() else "--prefer-offline", tarball], check=True)
+    return result
+
+
+def install_gems(repo_dir):
+    lock = load_lock(repo_dir)
+    if not lock["gem"]:
+        return
+    user_dir = gem_user_dir()
+    if not user_dir:
+        raise ToolchainError("ruby is not available; cannot install gems")
+    for name, version in sorted(lock["gem"].items()):
+        print(f"gem {name} {version}: {install_gem(name, version, user_dir)}")
+
+
+def install_npm_packages(repo_dir, prefix=None):
+    for name, version in sorted(load_lock(repo_dir)["npm"].items()):
+        print(f"npm {name} {version}: {install_npm(name, version, prefix)}")
@@ -0,0 +1,140 @@
+"""
+Incremental updates of the git checkouts setup created.
+Every checkout's branch tip is compared with the remote's through one
+`git ls-remote`, so an unchanged repository costs a single ref lookup. The
+ones that moved are fetched concurrently (just their branch, without tags,
+through the mirror cache) and fast-forwarded; the files that changed decide
+which setup steps have to run again. The blocks setup writes into tracked
+dotfiles are set aside for the merge and re-applied after it; any other local
+change leaves the checkout alone. Rollback resets a checkout to the commit it
+was at.
+"""
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+from configs_cli import gitcache, offline, process, snapshot
+
+UNCHANGED = "unchanged"
+UPDATED = "updated"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+class Checkout:
+    """
+    A managed working copy. rules maps changed files to setup steps, see
+    affected_steps().
+    """
+
+    def __init__(self, name, path, url, rules=()):
+        self.name = name
+        self.path = path
+        self.url = url
+        self.rules = list(rules)
+
+    def affected_steps(self, changes):
+        return affected_steps(self.rules, changes)
+
+
+def affected_steps(rules, changes):
+    """
+    Step names to re-run for [(git status letter, path)] changes. Each rule
+    is (path prefix, step names[, git statuses]): an empty prefix matches
+    every file and statuses (such as "AD") limit it to added, deleted, ...
+    files.
+    """
+    steps = set()
+    for status, path in changes:
+        for rule in rules:
+            prefix, names = rule[0], rule[1]
+            statuses = rule[2] if len(rule) > 2 else None
+            if path.startswith(prefix) and (statuses is None or status in statuses):
+                steps.update(names)
+    return steps
+
+
+def remote_head(url, branch):
+    """The commit url's branch points at, from a single ls-remote"""
+    result = process.run(["git", "ls-remote", url, f"refs/heads/{branch}"],
+                         check=True, capture_output=True, text=True)
+    line = result.stdout.split()
+    return line[0] if line else None
+
+
+def _changes(path, old, new):
+    result = process.run(["git", "-C", path, "diff", "--name-status", "--no-renames", old, new],
+                         check=True, capture_output=True, text=True)
+    return [tuple(line.split("\t", 1)) for line in result.stdout.splitlines() if "\t" in line]
+
+
+def update_checkout(checkout):
+    """
+    Fast-forward one checkout to its remote branch. Returns a result dict with
+    name, status, old and new commits, the changed files and the steps to re-run.
+    """
+    result = {"name": checkout.name, "status": SKIPPED, "old": None, "new": None,
+              "changes": [], "steps": set(), "message": ""}
+    branch = gitcache.branch(checkout.path)
+    old = gitcache.head(checkout.path)
+    if old is None:
+        result["message"] = "not checked out"
+        return result
+    if branch is None:
+        result["message"] = "detached HEAD; left alone"
+        return result
+    result["old"] = old
+    try:
+        new = remote_head(checkout.url, branch)
+        if new is None:
+            raise ValueError(f"{branch} not found on {checkout.url}")
+        if new == old:
+            result.update(status=UNCHANGED, new=old)
+            return result
+        managed, other = gitcache.local_edits(checkout.path)
+        if other:
+            result.update(status=FAILED, message=f"local changes to {', '.join(other)}; not fast-forwarded")
+            return result
+        with ExitStack() as stack:
+            try:
+                source = stack.enter_context(gitcache.mirror_for(checkout.url))
+            except (OSError, subprocess.CalledProcessError):
+                source = checkout.url
+            process.run(["git", "-C", checkout.path, "fetch", "--quiet", "--no-tags", source,
+                         f"refs/heads/{branch}"], check=True)
+        # git keeps the objects; the old commit is all rollback needs
+        snapshot.save_head(checkout.path, old)
+        # The blocks setup adds to tracked dotfiles mustn't block the fast-forward
+        with gitcache.managed_edits_set_aside(checkout.path, managed):
+            merge = process.run(["git", "-C", checkout.path, "merge", "--ff-only", "--quiet", "FETCH_HEAD"],
+                                capture_output=True, text=True)
+        if merge.returncode != 0:
+            result.update(status=FAILED, message="local commits; not fast-forwarded")
+            return result
+        new = gitcache.head(checkout.path)
+        changes = _changes(checkout.path, old, new)
+    except (OSError, ValueError, subprocess.CalledProcessError) as e:
+        result.update(status=FAILED, message=str(e))
+        return result
+    result.update(status=UPDATED, new=new, changes=changes, steps=checkout.affected_steps(changes))
+    return result
+
+
+def update_all(checkouts, jobs=8):
+    """Update every checkout on a bounded pool; returns the results in order"""
+    if offline.enabled():
+        raise offline.OfflineError("updates need network access")
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        return list(pool.map(update_checkout, checkouts))
+
+
+def print_results(results):
+    for result in results:
+        if result["status"] == UPDATED:
+            detail = (f"{result['old'][:8]} -> {result['new'][:8]}, "
+                      f"{len(result['changes'])} files changed")
+        elif result["status"] == UNCHANGED:
+            detail = f"at {result['old'][:8]}"
+        else:
+            detail = result["message"]
+        print(f"  {result['name']:<24} {result['status']:<10} {detail}")
@@ -0,0 +1,247 @@
+"""
+Filesystem watcher for `configs-cli watch`.
+The configs repository is watched with inotify (through libc, one watch per
+directory, .git excluded); where inotify isn't available the tree is polled
+for mtime and size changes instead. Events are collected until the
+repository has been quiet for the debounce interval, so an editor's
+write-rename-chmod burst is a single change. Each touched path is then
+reported once as added, deleted or modified, the same status letters
+`git diff --name-status` uses, for the update rules to map onto setup steps.
+The steps a change re-runs write files in the repository too (dotfiles/zshrc);
+the events of those writes are dropped, so a run doesn't trigger itself.
+"""
+import ctypes
+import ctypes.util
+import os
+import re
+import select
+import struct
+import time
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+DEFAULT_DEBOUNCE = 0.3
+DEFAULT_POLL_INTERVAL = 1.0
+
+_EVENT = struct.Struct("iIII")
+# Editor droppings: vim swap files and its 4913 write test, backups, emacs lock files;
+# and configs-cli's own temp files: atomic_write's, rollback's and the .tmp-<pid> ones
+_SCRATCH = re.compile(r"(^\..*\.sw[a-p]$|~$|^\.#|^4913$"
+                      r"|^\..+\.[a-z0-9_]{8}\.tmp$|^\..+\.(detach|rollback)-\d+(\.old)?$|\.tmp-\d+$)")
+
+
+def _signature(path):
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def ignored(rel_path):
+    parts = rel_path.split("/")
+    return ".git" in parts or bool(_SCRATCH.search(parts[-1]))
+
+
+def _walk(root):
+    """Yield every path under root relative to it, .git and editor scratch files excluded"""
+    for directory, dirs, files in os.walk(root):
+        rel_dir = os.path.relpath(directory, root)
+        rel_dir = "" if rel_dir == "." else rel_dir
+        dirs[:] = [name for name in dirs if not ignored(os.path.join(rel_dir, name))]
+        for name in dirs + files:
+            rel_path = os.path.join(rel_dir, name)
+            if not ignored(rel_path):
+                yield rel_path
+
+
+class InotifyWatcher:
+    """inotify watches on every directory of the tree"""
+
+    kind = "inotify"
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_init1: {os.strerror(errno)}")
+        self.dirs = {}
+        self._add_tree("")
+
+    def _add(self, rel_dir):
+        path = os.path.join(self.root, rel_dir)
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            # A directory that disappeared again is not worth failing over; running out of watches is
+            if os.path.isdir(path):
+                raise OSError(errno, f"inotify_add_watch {path}: {os.strerror(errno)}")
+            return
+        self.dirs[wd] = rel_dir
+
+    def _add_tree(self, rel_dir):
+        """Watch rel_dir and everything below it; returns the paths found in it"""
+        self._add(rel_dir)
+        found = []
+        for rel_path in _walk(os.path.join(self.root, rel_dir)):
+            rel_path = os.path.join(rel_dir, rel_path)
+            found.append(rel_path)
+            path = os.path.join(self.root, rel_path)
+            if os.path.isdir(path) and not os.path.islink(path):
+                self._add(rel_path)
+        return found
+
+    def touched(self, timeout=None):
+        """Wait up to timeout seconds (None: forever) and return the set of paths events named"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        paths = set()
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            wd, mask, _cookie, length = _EVENT.unpack_from(data, offset)
+            name = data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b"\0")
+            offset += _EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                print("Warning: inotify queue overflowed; some changes may have been missed")
+                continue
+            if mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+                continue
+            if wd not in self.dirs or not name:
+                continue
+            rel_path = os.path.join(self.dirs[wd], os.fsdecode(name))
+            if ignored(rel_path):
+                continue
+            paths.add(rel_path)
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                # Files may land in a new directory before its watch exists
+                paths.update(self._add_tree(rel_path))
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Rescans the tree every interval and reports paths whose mtime or size changed"""
+
+    kind = "polling"
+
+    def __init__(self, root, interval=DEFAULT_POLL_INTERVAL):
+        self.root = os.path.abspath(root)
+        self.interval = interval
+        self.seen = self._scan()
+
+    def _scan(self):
+        seen = {}
+        for rel_path in _walk(self.root):
+            try:
+                st = os.lstat(os.path.join(self.root, rel_path))
+            except FileNotFoundError:
+                continue
+            seen[rel_path] = (st.st_mtime_ns, st.st_size)
+        return seen
+
+    def touched(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.interval if deadline is None else min(self.interval, deadline - time.monotonic())
+            time.sleep(max(0.0, wait))
+            seen = self._scan()
+            paths = {rel_path for rel_path in seen.keys() | self.seen.keys()
+                     if seen.get(rel_path) != self.seen.get(rel_path)}
+            self.seen = seen
+            if paths or (deadline is not None and time.monotonic() >= deadline):
+                return paths
+
+    def close(self):
+        pass
+
+
+def open_watcher(root, poll_interval=None):
+    """An inotify watcher for root, or a polling one if asked for or inotify is unavailable"""
+    if poll_interval is None:
+        try:
+            return InotifyWatcher(root)
+        except (OSError, AttributeError) as e:
+            print(f"inotify unavailable ({e}); polling every {DEFAULT_POLL_INTERVAL:g}s instead")
+    return PollingWatcher(root, poll_interval or DEFAULT_POLL_INTERVAL)
+
+
+class Tracker:
+    """Turns bursts of touched paths into (status, path) changes"""
+
+    def __init__(self, watcher, debounce=DEFAULT_DEBOUNCE):
+        self.watcher = watcher
+        self.debounce = debounce
+        self.known = set(_walk(watcher.root))
+        # Touched paths left over from settle(), and the state it saw written paths in
+        self.pending = set()
+        self.written = {}
+
+    def _quiet(self, paths):
+        """Add events to paths until none arrive for debounce seconds"""
+        while True:
+            more = self.watcher.touched(self.debounce)
+            if not more:
+                return paths
+            paths |= more
+
+    def settle(self, written):
+        """
+        Drain the events of a run of setup, dropping those on the paths it
+        wrote itself (absolute paths, such as its snapshot entries); events on
+        other paths are kept for next_changes(). The stat of each written path
+        is remembered, so a late event that still finds it that way is dropped too.
+        """
+        prefixes = [os.path.relpath(path, self.watcher.root) for path in written]
+        prefixes = [prefix for prefix in prefixes if prefix != ".." and not prefix.startswith("../")]
+        for rel_path in self._quiet(set()):
+            if not any(prefix == "." or rel_path == prefix or rel_path.startswith(prefix + "/")
+                       for prefix in prefixes):
+                self.pending.add(rel_path)
+                continue
+            path = os.path.join(self.watcher.root, rel_path)
+            self.written[rel_path] = _signature(path)
+            if os.path.lexists(path):
+                self.known.add(rel_path)
+            else:
+                self.known.discard(rel_path)
+
+    def next_changes(self):
+        """Block until something changed and the tree has been quiet for debounce seconds"""
+        while True:
+            paths, self.pending = self.pending or self.watcher.touched(), set()
+            paths = self._quiet(paths)
+            changes = []
+            for rel_path in sorted(paths):
+                existed = rel_path in self.known
+                path = os.path.join(self.watcher.root, rel_path)
+                if rel_path in self.written and self.written.pop(rel_path) == _signature(path):
+                    continue
+                exists = os.path.lexists(path)
+                if exists:
+                    self.known.add(rel_path)
+                    # A directory's own mtime moves with every entry added to it
+                    if not (existed and os.path.isdir(path) and not os.path.islink(path)):
+                        changes.append(("M" if existed else "A", rel_path))
+                elif existed:
+                    self.known.discard(rel_path)
+                    changes.append(("D", rel_path))
+            if changes:
+                return changes
@@ -8,7 +8,7 @@ setup(
     packages=find_packages(),
     entry_points={
         'console_scripts': [
-            'configs-cli=configs_cli.main:main',
+            'configs-cli=configs_cli.cli:main',
         ],
     },
     python_requires=">=3.9",
@@ -0,0 +1,76 @@
+"""`configs-cli status --prompt` runs on every prompt and must stay a bare-Python startup"""
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Ceiling on what the prompt path spends importing configs-cli, well above the
+# few milliseconds it takes and well below the ~170ms of configs_cli.main
+IMPORT_BUDGET_MS = 30
+
+# Everything main pulls in, plus the stdlib modules that dominate its import time
+HEAVY = [
+    "configs_cli.main",
+    "configs_cli.process",
+    "configs_cli.graph",
+    "configs_cli.harness",
+    "configs_cli.bench",
+    "argparse",
+    "asyncio",
+    "concurrent.futures",
+    "json",
+    "subprocess",
+    "tempfile",
+]
+
+PROMPT = """
+import sys
+sys.argv = ["configs-cli", "status", "--prompt"]
+from configs_cli import cli
+try:
+    cli.main()
+except SystemExit:
+    pass
+sys.stderr.write(",".join(sys.modules))
+"""
+
+
+def _prompt_env(tmp_path):
+    status_file = tmp_path / "status"
+    status_file.write_text("configs-cli-status 1\nrepo /nonexistent\nbehind 2\nlinks 1\nmodified 0\n")
+    return dict(os.environ, CONFIGS_CLI_STATUS_FILE=str(status_file),
+                PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+
+
+def test_prompt_path_skips_the_full_cli(tmp_path):
+    env = _prompt_env(tmp_path)
+    result = subprocess.run([sys.executable, "-c", PROMPT], env=env, capture_output=True, text=True, check=True)
+
+    assert result.stdout == "⇣2 ✗1\n"
+    loaded = set(result.stderr.split(","))
+    assert [name for name in HEAVY if name in loaded] == []
+
+
+def test_prompt_imports_fit_the_budget(tmp_path):
+    env = _prompt_env(tmp_path)
+    totals = []
+    # Best of a few runs, so one slow start on a busy machine doesn't fail it
+    for _ in range(3):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", PROMPT], env=env,
+                                capture_output=True, text=True, check=True)
+        # "import time: self [us] | cumulative | name", nested imports indented under their importer
+        rows = [line.split("|") for line in result.stderr.splitlines() if line.startswith("import time:")]
+        totals.append(sum(int(cumulative) for _self, cumulative, name in rows[1:]
+                          if name.startswith(" configs_cli")) / 1000)
+
+    assert min(totals) < IMPORT_BUDGET_MS
+
+
+def test_main_leaves_the_bench_tooling_to_its_commands():
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+    script = "import sys, configs_cli.main; sys.stdout.write(','.join(sys.modules))"
+    result = subprocess.run([sys.executable, "-c", script], env=env, capture_output=True, text=True, check=True)
+
+    loaded = set(result.stdout.split(","))
+    assert "configs_cli.harness" not in loaded
+    assert "configs_cli.bench" not in loaded